@@ -0,0 +1,399 @@
+"""
+Array-backed parsing of a3m alignments into the MSA features of AlphaFold.
+
+The sequences of an a3m are joined into one uint8 buffer, so finding the match columns (everything
+that isn't a lowercase insertion), encoding the residues and counting the deletions before every
+column are a few vectorized operations instead of a Python loop over every character. The features
+are the same as those of `pipeline.make_msa_features([pipeline.parsers.parse_a3m(a3m)])`.
+"""
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from alphafold.common import residue_constants
+from alphafold.data import msa_identifiers
+
+from colabfold.input import ComplexMSA
+
+logger = logging.getLogger(__name__)
+
+# byte -> HHblits residue id, -1 for bytes that aren't a residue or a gap
+HHBLITS_LOOKUP = np.full(256, -1, dtype=np.int8)
+for _residue, _id in residue_constants.HHBLITS_AA_TO_ID.items():
+    HHBLITS_LOOKUP[ord(_residue)] = _id
+
+GAP_ID = residue_constants.HHBLITS_AA_TO_ID["-"]
+
+# a3m insertions, which are removed from the aligned sequence and counted in the deletion matrix
+IS_INSERTION = np.zeros(256, dtype=bool)
+IS_INSERTION[ord("a") : ord("z") + 1] = True
+
+
+def split_a3m(a3m: Union[str, bytes]) -> Tuple[List[str], List[bytes]]:
+    """Descriptions and (unaligned) sequences of an a3m, following alphafold's parse_fasta"""
+    if isinstance(a3m, str):
+        a3m = a3m.encode()
+    descriptions = []
+    sequences = []
+    lines = []
+    for line in a3m.splitlines():
+        line = line.strip()
+        if line.startswith(b">"):
+            if descriptions:
+                sequences.append(b"".join(lines))
+            descriptions.append(line[1:].decode())
+            lines = []
+        elif line:
+            lines.append(line)
+    if descriptions:
+        sequences.append(b"".join(lines))
+    return descriptions, sequences
+
+
+class A3M:
+    """An alignment as a (rows, columns) uint8 matrix of HHblits residue ids and its deletions"""
+
+    def __init__(
+        self,
+        msa: np.ndarray,
+        deletion_matrix: np.ndarray,
+        descriptions: List[str],
+        trailing_insertions: Optional[np.ndarray] = None,
+    ):
+        self.msa = msa
+        self.deletion_matrix = deletion_matrix
+        self.descriptions = descriptions
+        # insertions after the last column, which only count when more columns follow
+        if trailing_insertions is None:
+            trailing_insertions = np.zeros(len(descriptions), dtype=np.int32)
+        self.trailing_insertions = trailing_insertions
+
+    def __len__(self) -> int:
+        return self.msa.shape[0]
+
+    @classmethod
+    def parse(cls, a3m: Union[str, bytes]) -> "A3M":
+        return cls.from_records(*split_a3m(a3m))
+
+    @classmethod
+    def from_records(cls, descriptions: List[str], sequences: List[bytes]) -> "A3M":
+        if not sequences:
+            raise ValueError("The a3m contains no sequences")
+        buffer = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+        starts = np.zeros(len(sequences) + 1, dtype=np.int64)
+        np.cumsum([len(sequence) for sequence in sequences], out=starts[1:])
+
+        column_positions = np.flatnonzero(~np.take(IS_INSERTION, buffer))
+        row_columns = np.diff(np.searchsorted(column_positions, starts))
+        num_columns = int(row_columns[0])
+        if np.any(row_columns != num_columns):
+            row = int(np.flatnonzero(row_columns != num_columns)[0])
+            raise ValueError(
+                f"Sequence {row} ({descriptions[row]}) has {row_columns[row]} aligned "
+                f"columns, but the query has {num_columns}"
+            )
+
+        msa = np.take(HHBLITS_LOOKUP, np.take(buffer, column_positions))
+        if np.any(msa < 0):
+            position = column_positions[np.flatnonzero(msa < 0)[0]]
+            row = int(np.searchsorted(starts, position, side="right")) - 1
+            raise ValueError(
+                f"Sequence {row} ({descriptions[row]}) contains the invalid character "
+                f"{chr(buffer[position])!r}"
+            )
+        msa = msa.view(np.uint8).reshape(len(sequences), num_columns)
+
+        # the deletions of a column are the insertions between it and the previous column of its
+        # row (or the start of the row)
+        column_positions = column_positions.reshape(len(sequences), num_columns)
+        deletion_matrix = np.zeros(column_positions.shape, dtype=np.int32)
+        if num_columns == 0:
+            return cls(msa, deletion_matrix, descriptions, np.diff(starts))
+        deletion_matrix[:, 0] = column_positions[:, 0] - starts[:-1]
+        np.subtract(
+            column_positions[:, 1:],
+            column_positions[:, :-1] + 1,
+            out=deletion_matrix[:, 1:],
+            casting="unsafe",
+        )
+        trailing_insertions = starts[1:] - column_positions[:, -1] - 1
+        return cls(msa, deletion_matrix, descriptions, trailing_insertions)
+
+    def unique_mask(self) -> np.ndarray:
+        """True for the first occurrence of every aligned sequence"""
+        if self.msa.shape[1] == 0:
+            return np.arange(len(self)) == 0
+        rows = np.ascontiguousarray(self.msa).view(
+            np.dtype((np.void, self.msa.shape[1]))
+        )[:, 0]
+        _, first = np.unique(rows, return_index=True)
+        mask = np.zeros(len(self), dtype=bool)
+        mask[first] = True
+        return mask
+
+    def species_identifiers(self) -> np.ndarray:
+        return np.array(
+            [
+                msa_identifiers.get_identifiers(description).species_id.encode()
+                for description in self.descriptions
+            ],
+            dtype=np.object_,
+        )
+
+    def features(self) -> Dict[str, np.ndarray]:
+        """The features of pipeline.make_msa_features, which (in this alphafold) keeps duplicates"""
+        return {
+            "deletion_matrix_int": self.deletion_matrix,
+            "msa": self.msa.astype(np.int32),
+            "num_alignments": np.full(self.msa.shape[1], len(self), dtype=np.int32),
+            "msa_species_identifiers": self.species_identifiers(),
+        }
+
+
+def make_msa_features(a3m: Union[str, bytes]) -> Dict[str, np.ndarray]:
+    return A3M.parse(a3m).features()
+
+
+def identity_counts(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Number of columns in which rows of a and b have the same residue (not a gap), (len(a), len(b))"""
+    counts = np.zeros((len(a), len(b)), dtype=np.float32)
+    for residue in range(GAP_ID):
+        counts += (a == residue).astype(np.float32) @ (b == residue).astype(
+            np.float32
+        ).T
+    return counts
+
+
+def greedy_identity_filter(
+    msa: np.ndarray,
+    rows: np.ndarray,
+    max_seq_id: float,
+    limit: Optional[int] = None,
+    chunk_size: int = 512,
+) -> np.ndarray:
+    """The rows (in order, the first is always kept) that have at most max_seq_id identity to every
+    earlier kept row, stopping after limit rows
+
+    The identity of two rows is their identical residues over the residues of the shorter one.
+    Candidates are compared to the kept rows a chunk at a time.
+    """
+    residues = (msa != GAP_ID).sum(axis=1)
+    kept = [rows[0]]
+    for start in range(1, len(rows), chunk_size):
+        if limit is not None and len(kept) >= limit:
+            break
+        chunk = rows[start : start + chunk_size]
+        identity = identity_counts(msa[chunk], msa[kept]) / np.maximum(
+            np.minimum(residues[chunk][:, None], residues[kept][None, :]), 1
+        )
+        candidates = chunk[(identity <= max_seq_id).all(axis=1)]
+        # the candidates of a chunk also have to differ from the ones accepted before them
+        within = identity_counts(msa[candidates], msa[candidates]) / np.maximum(
+            np.minimum(residues[candidates][:, None], residues[candidates][None, :]), 1
+        )
+        accepted = []
+        for i, row in enumerate(candidates):
+            if limit is not None and len(kept) >= limit:
+                break
+            if np.all(within[i, accepted] <= max_seq_id):
+                accepted.append(i)
+                kept.append(row)
+    return np.array(kept)
+
+
+class MSAFilter:
+    """Filters the rows of an MSA like hhfilter, keeping the query (the first row)
+
+    max_seq_id: remove rows with more than this identity to an earlier row that was kept
+    min_coverage: remove rows that have residues in less than this fraction of the columns
+    diff: keep at most this many rows, the most diverse ones. The identity filter is repeated
+        with increasing thresholds up to max_seq_id, and the first one that keeps enough rows is
+        used (in the order of the MSA)
+    """
+
+    def __init__(
+        self,
+        max_seq_id: Optional[float] = None,
+        min_coverage: float = 0.0,
+        diff: int = 0,
+    ):
+        self.max_seq_id = 1.0 if max_seq_id is None else max_seq_id
+        self.min_coverage = min_coverage
+        self.diff = diff
+
+    def mask(self, a3m: A3M) -> np.ndarray:
+        rows = np.arange(len(a3m))
+        if self.min_coverage > 0 and a3m.msa.shape[1] > 0:
+            coverage = (a3m.msa != GAP_ID).mean(axis=1)
+            rows = rows[(rows == 0) | (coverage >= self.min_coverage)]
+        if self.diff > 0 and len(rows) > self.diff:
+            thresholds = [t / 10 for t in range(3, 10) if t / 10 < self.max_seq_id]
+            for threshold in thresholds + [self.max_seq_id]:
+                if threshold >= 1.0:
+                    kept = rows[: self.diff]
+                else:
+                    kept = greedy_identity_filter(a3m.msa, rows, threshold, self.diff)
+                if len(kept) >= self.diff:
+                    break
+            rows = kept
+        elif self.max_seq_id < 1.0:
+            rows = greedy_identity_filter(a3m.msa, rows, self.max_seq_id)
+        mask = np.zeros(len(a3m), dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def __call__(self, a3m: str) -> str:
+        """The a3m with only the rows that pass the filter"""
+        descriptions, sequences = split_a3m(a3m)
+        try:
+            mask = self.mask(A3M.from_records(descriptions, sequences))
+        except ValueError as e:
+            logger.warning(f"Not filtering an MSA that can't be parsed: {e}")
+            return a3m
+        if mask.all():
+            return a3m
+        return "".join(
+            f">{descriptions[i]}\n{sequences[i].decode()}\n"
+            for i in np.flatnonzero(mask)
+        )
+
+
+def complex_msa_features(msa: ComplexMSA, query_sequence: str) -> Dict[str, np.ndarray]:
+    """make_msa_features of the query (all chain copies) followed by the complex MSA
+
+    Every chain MSA is parsed once and copied into the columns of its chain copies.
+    """
+    widths = msa.widths()
+    offsets = np.cumsum([0] + widths)
+    copies = np.split(
+        np.arange(len(widths)), np.cumsum(msa.query_seqs_cardinality)[:-1]
+    )
+    query = A3M.parse(f">0\n{query_sequence}\n")
+    # blocks of rows: (chain MSA, the copies whose columns it fills) and the row descriptions
+    blocks = []
+    if msa.paired_msa is not None:
+        chains = [A3M.parse(a3m) for a3m in msa.paired_msa]
+        if len({len(chain) for chain in chains}) != 1:
+            raise ValueError(
+                "The paired MSAs of the chains have different numbers of rows"
+            )
+        descriptions = [
+            "\t".join(row) for row in zip(*[c.descriptions for c in chains])
+        ]
+        blocks.append((list(zip(chains, copies)), descriptions))
+    if msa.unpaired_msa is not None:
+        for n, a3m in enumerate(msa.unpaired_msa):
+            chain = A3M.parse(a3m)
+            for copy in copies[n]:
+                blocks.append(([(chain, [copy])], chain.descriptions))
+
+    num_rows = 1 + sum(len(descriptions) for _, descriptions in blocks)
+    features_msa = np.full((num_rows, offsets[-1]), GAP_ID, dtype=np.uint8)
+    deletion_matrix = np.zeros((num_rows, offsets[-1]), dtype=np.int32)
+    features_msa[0] = query.msa[0]
+    all_descriptions = list(query.descriptions)
+    for chains, descriptions in blocks:
+        rows = slice(len(all_descriptions), len(all_descriptions) + len(descriptions))
+        for chain, chain_copies in chains:
+            for copy in chain_copies:
+                if chain.msa.shape[1] != widths[copy]:
+                    raise ValueError(
+                        f"An MSA of chain copy {copy} has {chain.msa.shape[1]} columns, "
+                        f"but the chain has {widths[copy]}"
+                    )
+                columns = slice(offsets[copy], offsets[copy + 1])
+                features_msa[rows, columns] = chain.msa
+                deletion_matrix[rows, columns] = chain.deletion_matrix
+        # insertions at the end of a chain row count as deletions of the next column
+        for chain, chain_copies in chains:
+            for copy in chain_copies:
+                if offsets[copy + 1] < offsets[-1]:
+                    deletion_matrix[
+                        rows, offsets[copy + 1]
+                    ] += chain.trailing_insertions
+        all_descriptions += descriptions
+    return A3M(features_msa, deletion_matrix, all_descriptions).features()
+
+
+def split_row(seq: str, chain_lengths: List[int]) -> Tuple[List[str], List[bool]]:
+    """The chains of an MSA row of a complex and whether each has a residue (not only gaps)
+
+    Insertions go to the chain whose next column follows them, insertions after the last column
+    are dropped. A row that is too short is split the same way colabfold always did.
+    """
+    has_residue = [False] * len(chain_lengths)
+    chains = []
+    prev_pos = 0
+    for n, chain_length in enumerate(chain_lengths):
+        chain = ""
+        columns = 0
+        for pos in range(prev_pos, len(seq)):
+            if columns == chain_length:
+                prev_pos = pos
+                break
+            chain += seq[pos]
+            if seq[pos].islower():
+                continue
+            if seq[pos] != "-":
+                has_residue[n] = True
+            columns += 1
+        chains.append(chain)
+    return chains, has_residue
+
+
+def split_rows(
+    seqs: List[str], chain_lengths: List[int]
+) -> Tuple[List[List[str]], np.ndarray]:
+    """split_row for many rows, with the column boundaries of all rows found at once"""
+    has_residue = np.zeros((len(seqs), len(chain_lengths)), dtype=bool)
+    joined = "".join(seqs)
+    if not seqs or not joined.isascii():
+        rows = []
+        for i, seq in enumerate(seqs):
+            chains, has_residue[i] = split_row(seq, chain_lengths)
+            rows.append(chains)
+        return rows, has_residue
+
+    buffer = np.frombuffer(joined.encode(), dtype=np.uint8)
+    starts = np.zeros(len(seqs) + 1, dtype=np.int64)
+    np.cumsum([len(seq) for seq in seqs], out=starts[1:])
+    column_positions = np.flatnonzero(~np.take(IS_INSERTION, buffer))
+    first_column = np.searchsorted(column_positions, starts)
+    row_columns = np.diff(first_column)
+    first_column = first_column[:-1]
+    chain_ends = np.cumsum(chain_lengths)
+    chain_starts = chain_ends - chain_lengths
+    complete = row_columns == chain_ends[-1]
+
+    # residues (columns that aren't gaps) before each column, to check every chain for one
+    is_residue = np.take(buffer, column_positions) != ord("-")
+    residues_before = np.zeros(len(column_positions) + 1, dtype=np.int64)
+    np.cumsum(is_residue, out=residues_before[1:])
+    first_complete = first_column[complete][:, None]
+    has_residue[complete] = (
+        residues_before[first_complete + chain_ends]
+        - residues_before[first_complete + chain_starts]
+        > 0
+    )
+    # a chain ends after its last column, and the next one starts there
+    ends = np.zeros((int(complete.sum()), len(chain_lengths)), dtype=np.int64)
+    last_column = first_complete + chain_ends - 1
+    ends[:, chain_ends > 0] = (
+        column_positions[last_column[:, chain_ends > 0]]
+        + 1
+        - starts[:-1][complete][:, None]
+    )
+
+    rows = []
+    complete_ends = iter(ends.tolist())
+    for i, seq in enumerate(seqs):
+        if complete[i]:
+            chains = []
+            start = 0
+            for end in next(complete_ends):
+                chains.append(seq[start:end])
+                start = end
+        else:
+            chains, has_residue[i] = split_row(seq, chain_lengths)
+        rows.append(chains)
+    return rows, has_residue
@@ -18,6 +18,9 @@ import zipfile
 import shutil
 import pickle
 import gzip
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
 
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from pathlib import Path
@@ -52,8 +55,10 @@ from alphafold.data import (
     templates,
 )
 from alphafold.data.tools import hhsearch
+from colabfold.a3m import MSAFilter, complex_msa_features, make_msa_features, split_rows
 from colabfold.citations import write_bibtex
 from colabfold.download import default_data_dir, download_alphafold_params
+from colabfold.feature_cache import FeatureCache
 from colabfold.utils import (
     ACCEPT_DEFAULT_TERMS,
     DEFAULT_API_SERVER,
@@ -64,11 +69,15 @@ from colabfold.utils import (
     CFMMCIFIO,
 )
 from colabfold.input import (
-    pair_msa,
-    msa_to_str,
+    ComplexMSA,
+    write_msa,
     get_queries,
-    safe_filename
+    safe_filename,
+    watch_queries,
 )
+from colabfold.mmseqs.cache import MSACache
+from colabfold.mmseqs.client import set_rate_limit
+from colabfold.msa_file import SUFFIX as MSA_FILE_SUFFIX, load_msa_and_templates, save_msa_and_templates
 from colabfold.relax import relax_me
 from colabfold.alphafold import extra_ptm
 
@@ -569,11 +578,16 @@ def get_msa_and_templates(
     pairing_strategy: str = "greedy",
     host_url: str = DEFAULT_API_SERVER,
     user_agent: str = "",
+    msa_cache: Optional[MSACache] = None,
+    template_store: Optional[str] = None,
 ) -> Tuple[
     Optional[List[str]], Optional[List[str]], List[str], List[int], List[Dict[str, Any]]
 ]:
     from colabfold.colabfold import run_mmseqs2
 
+    if msa_cache is not None:
+        run_mmseqs2 = msa_cache.wrap_run_mmseqs2(run_mmseqs2)
+
     use_env = msa_mode == "mmseqs2_uniref_env" or msa_mode == "mmseqs2_uniref_env_envpair"
     use_envpair = msa_mode == "mmseqs2_uniref_env_envpair"
     if isinstance(query_sequences, str): query_sequences = [query_sequences]
@@ -623,6 +637,7 @@ def get_msa_and_templates(
                 use_templates=True,
                 host_url=host_url,
                 user_agent=user_agent,
+                template_store=template_store,
             )
         if template_paths is None:
             logger.info("No template detected")
@@ -707,25 +722,62 @@ def get_msa_and_templates(
         template_features,
     )
 
+def search_msa_batches(
+    query_seqs: List[str],
+    result_dir: Path,
+    msa_cache: MSACache,
+    batch_size: int,
+    use_env: bool,
+    use_templates: bool,
+    host_url: str = DEFAULT_API_SERVER,
+    user_agent: str = "",
+    template_store: Optional[str] = None,
+):
+    """Search the unpaired MSAs (and templates) of all sequences in a few large tickets.
+
+    The results are stored in msa_cache, from where get_msa_and_templates hands each job its MSAs.
+    Paired MSAs depend on the chain combination of each job and are still searched per job."""
+    from colabfold.colabfold import run_mmseqs2
+
+    cached_run_mmseqs2 = msa_cache.wrap_run_mmseqs2(run_mmseqs2)
+    query_seqs = [
+        seq for seq in dict.fromkeys(query_seqs)
+        if not msa_cache.has_unpaired(seq, use_env, True, use_templates, host_url)
+    ]
+    num_batches = math.ceil(len(query_seqs) / batch_size)
+    for batch_number, start in enumerate(range(0, len(query_seqs), batch_size)):
+        batch = query_seqs[start:start + batch_size]
+        logger.info(f"MSA batch {batch_number + 1}/{num_batches} ({len(batch)} sequences)")
+        # name the ticket directory after its content, so a restart never reuses a tarball of other sequences
+        batch_hash = hashlib.sha1("\n".join(batch).encode()).hexdigest()[:10]
+        cached_run_mmseqs2(
+            batch,
+            str(result_dir.joinpath(f"msa_batch_{batch_hash}")),
+            use_env,
+            use_templates=use_templates,
+            host_url=host_url,
+            user_agent=user_agent,
+            template_store=template_store,
+        )
+
 def build_monomer_feature(
-    sequence: str, unpaired_msa: str, template_features: Dict[str, Any]
+    sequence: str, unpaired_msa: Union[str, ComplexMSA], template_features: Dict[str, Any]
 ):
-    msa = pipeline.parsers.parse_a3m(unpaired_msa)
+    if isinstance(unpaired_msa, ComplexMSA):
+        msa_features = complex_msa_features(unpaired_msa, sequence)
+    else:
+        msa_features = make_msa_features(unpaired_msa)
     # gather features
     return {
         **pipeline.make_sequence_features(
             sequence=sequence, description="none", num_res=len(sequence)
         ),
-        **pipeline.make_msa_features([msa]),
+        **msa_features,
         **template_features,
     }
 
 def build_multimer_feature(paired_msa: str) -> Dict[str, ndarray]:
-    parsed_paired_msa = pipeline.parsers.parse_a3m(paired_msa)
-    return {
-        f"{k}_all_seq": v
-        for k, v in pipeline.make_msa_features([parsed_paired_msa]).items()
-    }
+    return {f"{k}_all_seq": v for k, v in make_msa_features(paired_msa).items()}
 
 def process_multimer_features(
     features_for_chain: Dict[str, Dict[str, ndarray]],
@@ -806,11 +858,9 @@ def generate_input_feature(
                 full_sequence += sequence
                 Ls.append(len(sequence))
 
-        # bugfix
-        a3m_lines = f">0\n{full_sequence}\n"
-        a3m_lines += pair_msa(query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa)
-
-        input_feature = build_monomer_feature(full_sequence, a3m_lines, mk_mock_template(full_sequence))
+        # bugfix: the full sequence as the first row
+        complex_msa = ComplexMSA(query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa)
+        input_feature = build_monomer_feature(full_sequence, complex_msa, mk_mock_template(full_sequence))
         input_feature["residue_index"] = np.concatenate([np.arange(L) for L in Ls])
         input_feature["asym_id"] = np.concatenate([np.full(L,n) for n,L in enumerate(Ls)])
         if any(
@@ -916,33 +966,16 @@ def unserialize_msa(
             a3m_lines[2][prev_query_start : prev_query_start + query_len]
         )
         prev_query_start += query_len
-    paired_msa = [""] * len(query_seq_len)
-    unpaired_msa = [""] * len(query_seq_len)
-    already_in = dict()
-    for i in range(1, len(a3m_lines), 2):
-        header = a3m_lines[i]
-        seq = a3m_lines[i + 1]
-        if (header, seq) in already_in:
-            continue
-        already_in[(header, seq)] = 1
-        has_amino_acid = [False] * len(query_seq_len)
-        seqs_line = []
-        prev_pos = 0
-        for n, query_len in enumerate(query_seq_len):
-            paired_seq = ""
-            curr_seq_len = 0
-            for pos in range(prev_pos, len(seq)):
-                if curr_seq_len == query_len:
-                    prev_pos = pos
-                    break
-                paired_seq += seq[pos]
-                if seq[pos].islower():
-                    continue
-                if seq[pos] != "-":
-                    has_amino_acid[n] = True
-                curr_seq_len += 1
-            seqs_line.append(paired_seq)
-
+    paired_msa = [[] for _ in query_seq_len]
+    unpaired_msa = [[] for _ in query_seq_len]
+    # rows of the a3m without duplicates, then split into chains all at once
+    rows = dict.fromkeys(zip(a3m_lines[1::2], a3m_lines[2::2]))
+    rows_chains, rows_have_amino_acid = split_rows(
+        [seq for _, seq in rows], query_seq_len
+    )
+    for (header, _), seqs_line, has_amino_acid in zip(
+        rows, rows_chains, rows_have_amino_acid.tolist()
+    ):
         # if sequence is paired add them to output
         if (
             not is_single_protein
@@ -952,13 +985,15 @@ def unserialize_msa(
             header_no_faster = header.replace(">", "")
             header_no_faster_split = header_no_faster.split("\t")
             for j in range(0, len(seqs_line)):
-                paired_msa[j] += ">" + header_no_faster_split[j] + "\n"
-                paired_msa[j] += seqs_line[j] + "\n"
+                paired_msa[j].append(">" + header_no_faster_split[j] + "\n")
+                paired_msa[j].append(seqs_line[j] + "\n")
         else:
             for j, seq in enumerate(seqs_line):
                 if has_amino_acid[j]:
-                    unpaired_msa[j] += header + "\n"
-                    unpaired_msa[j] += seq + "\n"
+                    unpaired_msa[j].append(header + "\n")
+                    unpaired_msa[j].append(seq + "\n")
+    paired_msa = ["".join(lines) for lines in paired_msa]
+    unpaired_msa = ["".join(lines) for lines in unpaired_msa]
     if is_homooligomer:
         # homooligomers
         num = 101
@@ -1077,6 +1112,13 @@ def run(
     feature_dict_callback: Callable[[Any], Any] = None,
     calc_extra_ptm: bool = False,
     use_probs_extra: bool = True,
+    msa_prefetch: int = 0,
+    msa_cache: Optional[MSACache] = None,
+    msa_batch_size: int = 0,
+    template_store: Optional[str] = None,
+    msa_compression: Optional[str] = None,
+    msa_filter: Optional[MSAFilter] = None,
+    feature_cache: Optional[FeatureCache] = None,
     **kwargs
 ):
     # check what device is available
@@ -1233,31 +1275,134 @@ def run(
     if custom_template_path is not None:
         mk_hhsearch_db(custom_template_path)
 
+    def get_jobname(job_number: int, raw_jobname: str) -> str:
+        if jobname_prefix is not None:
+            # pad job number based on number of queries
+            fill = len(str(len(queries)))
+            return safe_filename(jobname_prefix) + "_" + str(job_number).zfill(fill)
+        else:
+            return safe_filename(raw_jobname)
+
+    def is_done(jobname: str) -> Optional[str]:
+        # In the colab version and with --zip we know we're done when a zip file has been written
+        result_zip = result_dir.joinpath(jobname).with_suffix(".result.zip")
+        if keep_existing_results and result_zip.is_file():
+            return "result.zip"
+        # In the local version we use a marker file
+        is_done_marker = result_dir.joinpath(jobname + ".done.txt")
+        if keep_existing_results and is_done_marker.is_file():
+            return "already done"
+        return None
+
+    def filter_msa(msa_and_templates):
+        # only the unpaired MSAs, the rows of the paired MSAs have to stay aligned between the chains
+        (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) = msa_and_templates
+        if msa_filter is not None and unpaired_msa is not None:
+            unpaired_msa = [msa_filter(msa) for msa in unpaired_msa]
+        return (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features)
+
+    def get_msa(jobname: str, query_sequence: Union[str, List[str]], a3m_lines: Optional[List[str]]):
+        stored_msa_and_templates = result_dir.joinpath(f"{jobname}{MSA_FILE_SUFFIX}")
+        if stored_msa_and_templates.is_file():
+            msa_and_templates = load_msa_and_templates(stored_msa_and_templates)
+            logger.info(f"Loaded {stored_msa_and_templates}")
+            return filter_msa(msa_and_templates)
+        # written by --msa-only of earlier versions
+        pickled_msa_and_templates = result_dir.joinpath(f"{jobname}.pickle")
+        if pickled_msa_and_templates.is_file():
+            with open(pickled_msa_and_templates, 'rb') as f:
+                msa_and_templates = pickle.load(f)
+            logger.info(f"Loaded {pickled_msa_and_templates}")
+            return filter_msa(msa_and_templates)
+
+        if a3m_lines is None:
+            (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) \
+            = get_msa_and_templates(jobname, query_sequence, a3m_lines, result_dir, msa_mode, use_templates,
+                custom_template_path, pair_mode, pairing_strategy, host_url, user_agent, msa_cache, template_store)
+
+        elif a3m_lines is not None:
+            (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) \
+            = unserialize_msa(a3m_lines, query_sequence)
+            if use_templates:
+                (_, _, _, _, template_features) \
+                    = get_msa_and_templates(jobname, query_seqs_unique, unpaired_msa, result_dir, 'single_sequence', use_templates,
+                        custom_template_path, pair_mode, pairing_strategy, host_url, user_agent, msa_cache, template_store)
+
+        msa_and_templates = filter_msa(
+            (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features)
+        )
+        if num_models == 0:
+            save_msa_and_templates(stored_msa_and_templates, msa_and_templates, msa_compression)
+            logger.info(f"Saved {stored_msa_and_templates}")
+        return msa_and_templates
+
+    # with --msa-batch-size, the unpaired MSAs of all queries are searched up front in a few large tickets
+    if msa_batch_size > 0 and "mmseqs2" in msa_mode:
+        if msa_cache is None:
+            msa_cache = MSACache(result_dir.joinpath("msa_cache"))
+        server_templates = use_templates and custom_template_path is None
+        batch_seqs = []
+        for job_number, (raw_jobname, query_sequence, a3m_lines) in enumerate(queries):
+            jobname = get_jobname(job_number, raw_jobname)
+            if a3m_lines is not None or is_done(jobname) is not None \
+                or result_dir.joinpath(f"{jobname}{MSA_FILE_SUFFIX}").is_file() \
+                or result_dir.joinpath(f"{jobname}.pickle").is_file():
+                continue
+            query_seqs = [query_sequence] if isinstance(query_sequence, str) else query_sequence
+            # complexes in paired-only mode have no unpaired MSAs to search
+            if pair_mode == "paired" and len(set(query_seqs)) > 1 and not server_templates:
+                continue
+            batch_seqs += query_seqs
+        try:
+            search_msa_batches(batch_seqs, result_dir, msa_cache, msa_batch_size, "env" in msa_mode,
+                server_templates, host_url, user_agent, template_store)
+        except Exception as e:
+            # jobs fall back to searching their own MSAs
+            logger.exception(f"Could not get batched MSAs: {e}")
+
+    # with --msa-prefetch, the MSAs and templates of the next queries are retrieved
+    # in background threads while the current query is being predicted
+    msa_executor = ThreadPoolExecutor(max_workers=msa_prefetch) if msa_prefetch > 0 else None
+    msa_futures = {}
+    next_prefetch = 0
+
+    def prefetch_msas(current: int):
+        nonlocal next_prefetch
+        next_prefetch = max(next_prefetch, current + 1)
+        while next_prefetch < len(queries) and sum(i > current for i in msa_futures) < msa_prefetch:
+            raw_jobname, query_sequence, a3m_lines = queries[next_prefetch]
+            jobname = get_jobname(next_prefetch, raw_jobname)
+            if is_done(jobname) is None:
+                msa_futures[next_prefetch] = msa_executor.submit(get_msa, jobname, query_sequence, a3m_lines)
+            next_prefetch += 1
+
+    def jobs_with_prefetch():
+        # the generator is closed when the loop over it ends or raises, which also stops the
+        # prefetching of the jobs that will not be run
+        try:
+            yield from enumerate(queries)
+        finally:
+            if msa_executor is not None:
+                msa_executor.shutdown(cancel_futures=True)
+
     pad_len = 0
     ranks, metrics = [],[]
     first_job = True
     job_number = 0
-    for job_number, (raw_jobname, query_sequence, a3m_lines) in enumerate(queries):
+    for job_number, (raw_jobname, query_sequence, a3m_lines) in jobs_with_prefetch():
+        query_index = job_number
+        jobname = get_jobname(job_number, raw_jobname)
         if jobname_prefix is not None:
-            # pad job number based on number of queries
-            fill = len(str(len(queries)))
-            jobname = safe_filename(jobname_prefix) + "_" + str(job_number).zfill(fill)
             job_number += 1
-        else:
-            jobname = safe_filename(raw_jobname)
 
         #######################################
         # check if job has already finished
         #######################################
-        # In the colab version and with --zip we know we're done when a zip file has been written
         result_zip = result_dir.joinpath(jobname).with_suffix(".result.zip")
-        if keep_existing_results and result_zip.is_file():
-            logger.info(f"Skipping {jobname} (result.zip)")
-            continue
-        # In the local version we use a marker file
         is_done_marker = result_dir.joinpath(jobname + ".done.txt")
-        if keep_existing_results and is_done_marker.is_file():
-            logger.info(f"Skipping {jobname} (already done)")
+        done_reason = is_done(jobname)
+        if done_reason is not None:
+            logger.info(f"Skipping {jobname} ({done_reason})")
             continue
 
         seq_len = len("".join(query_sequence))
@@ -1267,34 +1412,16 @@ def run(
         # generate MSA (a3m_lines) and templates
         ###########################################
         try:
-            pickled_msa_and_templates = result_dir.joinpath(f"{jobname}.pickle")
-            if pickled_msa_and_templates.is_file():
-                with open(pickled_msa_and_templates, 'rb') as f:
-                    (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) = pickle.load(f)
-                logger.info(f"Loaded {pickled_msa_and_templates}")
-
+            if msa_executor is not None:
+                prefetch_msas(query_index)
+            if query_index in msa_futures:
+                msa_and_templates = msa_futures.pop(query_index).result()
             else:
-                if a3m_lines is None:
-                    (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) \
-                    = get_msa_and_templates(jobname, query_sequence, a3m_lines, result_dir, msa_mode, use_templates,
-                        custom_template_path, pair_mode, pairing_strategy, host_url, user_agent)
-
-                elif a3m_lines is not None:
-                    (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) \
-                    = unserialize_msa(a3m_lines, query_sequence)
-                    if use_templates:
-                        (_, _, _, _, template_features) \
-                            = get_msa_and_templates(jobname, query_seqs_unique, unpaired_msa, result_dir, 'single_sequence', use_templates,
-                                custom_template_path, pair_mode, pairing_strategy, host_url, user_agent)
-
-                if num_models == 0:
-                    with open(pickled_msa_and_templates, 'wb') as f:
-                        pickle.dump((unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features), f)
-                    logger.info(f"Saved {pickled_msa_and_templates}")
+                msa_and_templates = get_msa(jobname, query_sequence, a3m_lines)
+            (unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality, template_features) = msa_and_templates
 
             # save a3m
-            msa = msa_to_str(unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality)
-            result_dir.joinpath(f"{jobname}.a3m").write_text(msa)
+            write_msa(result_dir.joinpath(f"{jobname}.a3m"), unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality)
 
         except Exception as e:
             logger.exception(f"Could not get MSA/templates for {jobname}: {e}")
@@ -1304,9 +1431,19 @@ def run(
         # generate features
         #######################
         try:
-            (feature_dict, domain_names) \
-            = generate_input_feature(query_seqs_unique, query_seqs_cardinality, unpaired_msa, paired_msa,
-                                     template_features, is_complex, model_type, max_seq=max_seq)
+            cached_features = None
+            if feature_cache is not None:
+                feature_key = feature_cache.key(msa_and_templates, is_complex, model_type, max_seq)
+                cached_features = feature_cache.get(feature_key)
+            if cached_features is not None:
+                (feature_dict, domain_names) = cached_features
+                logger.info(f"Using cached input features of {jobname}")
+            else:
+                (feature_dict, domain_names) \
+                = generate_input_feature(query_seqs_unique, query_seqs_cardinality, unpaired_msa, paired_msa,
+                                         template_features, is_complex, model_type, max_seq=max_seq)
+                if feature_cache is not None:
+                    feature_cache.put(feature_key, feature_dict, domain_names)
 
             # to allow display of MSA info during colab/chimera run (thanks tomgoddard)
             if feature_dict_callback is not None:
@@ -1510,7 +1647,7 @@ def main():
     parser.add_argument(
         "input",
         default="input",
-        help="One of: 1) directory with FASTA/A3M files, 2) CSV/TSV file, 3) FASTA file or 4) A3M file.",
+        help="One of: 1) directory with FASTA/A3M files, 2) CSV/TSV file, 3) FASTA file or 4) A3M file or 5) the final.a3m database of colabfold_search --unpack 0.",
     )
     parser.add_argument("results", help="Results output directory.")
 
@@ -1520,6 +1657,33 @@ def main():
         action="store_true",
         help="Query and store MSAs from the MSA server without structure prediction",
     )
+    msa_group.add_argument(
+        "--msa-compression",
+        default=None,
+        choices=["zstd", "lz4"],
+        help="Compress the MSA and template files written by --msa-only (needs the zstandard or lz4 package). "
+        "By default they are stored uncompressed and memory mapped when loaded.",
+    )
+    msa_group.add_argument(
+        "--msa-filter-id",
+        default=None,
+        type=float,
+        help="Remove MSA sequences with more than this sequence identity (0-1) to a sequence that is kept, "
+        "like hhfilter -id. Only the unpaired MSAs are filtered, before the input features are built.",
+    )
+    msa_group.add_argument(
+        "--msa-filter-cov",
+        default=0.0,
+        type=float,
+        help="Remove MSA sequences that cover less than this fraction (0-1) of the query, like hhfilter -cov.",
+    )
+    msa_group.add_argument(
+        "--msa-filter-diff",
+        default=0,
+        type=int,
+        help="Keep at most this many of the most diverse MSA sequences per chain, like hhfilter -diff. "
+        "Bounds the time and memory of building the features for very deep MSAs. By default all are kept.",
+    )
     msa_group.add_argument(
         "--msa-mode",
         default="mmseqs2_uniref_env",
@@ -1806,6 +1970,13 @@ def main():
         default="length",
         choices=["none", "length", "random"],
     )
+    output_group.add_argument(
+        "--watch",
+        help="Predict the results of a colabfold_search that is still running, as they appear in its output directory (the input). "
+        "The directory is checked every this many seconds until the search is done. 0 reads the input once.",
+        type=float,
+        default=0,
+    )
 
     adv_group = parser.add_argument_group(
         "Advanced arguments", ""
@@ -1815,6 +1986,59 @@ def main():
         default=DEFAULT_API_SERVER,
         help="Which MSA server should be queried. By default, the free public MSA server hosted by the ColabFold team is queried. "
     )
+    adv_group.add_argument(
+        "--msa-rate-limit",
+        type=float,
+        default=0,
+        help="Maximum number of ticket submissions and status requests per second to the MSA server, "
+        "shared by all colabfold_batch processes on this machine that use the same --host-url. Set to 0 to disable.",
+    )
+    adv_group.add_argument(
+        "--msa-prefetch",
+        type=int,
+        default=0,
+        help="Retrieve MSAs and templates of the next N queries in background threads while the current query is predicted. "
+        "This hides the MSA server round trip behind the structure prediction. Set to 0 to disable.",
+    )
+    adv_group.add_argument(
+        "--msa-batch-size",
+        type=int,
+        default=0,
+        help="Before predicting, search the unpaired MSAs of all distinct chains of all queries in tickets of up to N sequences, "
+        "instead of one ticket per query. Chains repeated across queries are only searched once. "
+        "Results are handed to the queries through the MSA cache (--msa-cache or <results>/msa_cache). Set to 0 to disable.",
+    )
+    adv_group.add_argument(
+        "--template-store",
+        default=None,
+        help="Directory in which template structures retrieved from the MSA server are stored once and shared by all queries. "
+        "Can be shared between runs. Defaults to <results>/template_store.",
+    )
+    adv_group.add_argument(
+        "--msa-cache",
+        default=None,
+        help="Directory of a persistent MSA cache. Unpaired MSAs, paired MSAs and template hits are stored by sequence "
+        "and reused across jobs and runs instead of querying the MSA server again. "
+        "The directory can be shared by several concurrent colabfold_batch processes.",
+    )
+    adv_group.add_argument(
+        "--msa-cache-size",
+        type=float,
+        default=50,
+        help="Maximum size of the MSA cache in GB. The least recently used entries are removed first. Set to 0 for no limit.",
+    )
+    adv_group.add_argument(
+        "--msa-cache-version",
+        type=str,
+        default="",
+        help="Tag that is part of every MSA cache key. Change it when the databases of the MSA server are updated.",
+    )
+    adv_group.add_argument(
+        "--feature-cache",
+        default=None,
+        help="Directory in which the input features of every job are stored, keyed by its MSAs, templates, model type and max-seq. "
+        "Reruns of a job (e.g. with other seeds, models or recycles) load them instead of building them again.",
+    )
     adv_group.add_argument(
         "--disable-unified-memory",
         default=False,
@@ -1852,15 +2076,12 @@ def main():
 
     data_dir = Path(args.data or default_data_dir)
 
-    queries, is_complex = get_queries(args.input, args.sort_queries_by)
-    model_type = set_model_type(is_complex, args.model_type)
+    if args.watch > 0 and args.jobname_prefix is not None:
+        parser.error("--jobname-prefix can't be used with --watch, the queries are numbered per round")
 
     if args.msa_only:
         args.num_models = 0
 
-    if args.num_models > 0:
-        download_alphafold_params(model_type, data_dir)
-
     if args.msa_mode != "single_sequence" and not args.templates:
         uses_api = False
         if uses_api and args.host_url == DEFAULT_API_SERVER:
@@ -1877,53 +2098,84 @@ def main():
     # added for actifptm calculation
     use_probs_extra = False if args.no_use_probs_extra else True
 
+    if args.msa_rate_limit > 0:
+        set_rate_limit(args.host_url, args.msa_rate_limit)
+
+    msa_cache = None
+    if args.msa_cache is not None:
+        msa_cache = MSACache(args.msa_cache, int(args.msa_cache_size * 1024**3), args.msa_cache_version)
+
+    msa_filter = None
+    if args.msa_filter_id is not None or args.msa_filter_cov > 0 or args.msa_filter_diff > 0:
+        msa_filter = MSAFilter(args.msa_filter_id, args.msa_filter_cov, args.msa_filter_diff)
+
     user_agent = f"colabfold/{version}"
-    run(
-        queries=queries,
-        result_dir=args.results,
-        use_templates=args.templates,
-        custom_template_path=args.custom_template_path,
-        num_relax=args.num_relax,
-        relax_max_iterations=args.relax_max_iterations,
-        relax_tolerance=args.relax_tolerance,
-        relax_stiffness=args.relax_stiffness,
-        relax_max_outer_iterations=args.relax_max_outer_iterations,
-        msa_mode=args.msa_mode,
-        model_type=model_type,
-        num_models=args.num_models,
-        num_recycles=args.num_recycle,
-        recycle_early_stop_tolerance=args.recycle_early_stop_tolerance,
-        num_ensemble=args.num_ensemble,
-        model_order=model_order,
-        is_complex=is_complex,
-        keep_existing_results=not args.overwrite_existing_results,
-        rank_by=args.rank,
-        pair_mode=args.pair_mode,
-        pairing_strategy=args.pair_strategy,
-        data_dir=data_dir,
-        host_url=args.host_url,
-        user_agent=user_agent,
-        random_seed=args.random_seed,
-        num_seeds=args.num_seeds,
-        stop_at_score=args.stop_at_score,
-        recompile_padding=args.recompile_padding,
-        zip_results=args.zip,
-        save_single_representations=args.save_single_representations,
-        save_pair_representations=args.save_pair_representations,
-        use_dropout=args.use_dropout,
-        max_seq=args.max_seq,
-        max_extra_seq=args.max_extra_seq,
-        max_msa=args.max_msa,
-        pdb_hit_file=args.pdb_hit_file,
-        local_pdb_path=args.local_pdb_path,
-        use_cluster_profile=not args.disable_cluster_profile,
-        use_gpu_relax = args.use_gpu_relax,
-        jobname_prefix=args.jobname_prefix,
-        save_all=args.save_all,
-        save_recycles=args.save_recycles,
-        calc_extra_ptm=args.calc_extra_ptm,
-        use_probs_extra=use_probs_extra,
-    )
+
+    def run_queries(queries, is_complex: bool):
+        model_type = set_model_type(is_complex, args.model_type)
+        if args.num_models > 0:
+            download_alphafold_params(model_type, data_dir)
+        run(
+            queries=queries,
+            result_dir=args.results,
+            use_templates=args.templates,
+            custom_template_path=args.custom_template_path,
+            num_relax=args.num_relax,
+            relax_max_iterations=args.relax_max_iterations,
+            relax_tolerance=args.relax_tolerance,
+            relax_stiffness=args.relax_stiffness,
+            relax_max_outer_iterations=args.relax_max_outer_iterations,
+            msa_mode=args.msa_mode,
+            model_type=model_type,
+            num_models=args.num_models,
+            num_recycles=args.num_recycle,
+            recycle_early_stop_tolerance=args.recycle_early_stop_tolerance,
+            num_ensemble=args.num_ensemble,
+            model_order=model_order,
+            is_complex=is_complex,
+            keep_existing_results=not args.overwrite_existing_results,
+            rank_by=args.rank,
+            pair_mode=args.pair_mode,
+            pairing_strategy=args.pair_strategy,
+            data_dir=data_dir,
+            host_url=args.host_url,
+            user_agent=user_agent,
+            random_seed=args.random_seed,
+            num_seeds=args.num_seeds,
+            stop_at_score=args.stop_at_score,
+            recompile_padding=args.recompile_padding,
+            zip_results=args.zip,
+            save_single_representations=args.save_single_representations,
+            save_pair_representations=args.save_pair_representations,
+            use_dropout=args.use_dropout,
+            max_seq=args.max_seq,
+            max_extra_seq=args.max_extra_seq,
+            max_msa=args.max_msa,
+            pdb_hit_file=args.pdb_hit_file,
+            local_pdb_path=args.local_pdb_path,
+            use_cluster_profile=not args.disable_cluster_profile,
+            use_gpu_relax = args.use_gpu_relax,
+            jobname_prefix=args.jobname_prefix,
+            save_all=args.save_all,
+            save_recycles=args.save_recycles,
+            calc_extra_ptm=args.calc_extra_ptm,
+            use_probs_extra=use_probs_extra,
+            msa_prefetch=args.msa_prefetch,
+            msa_cache=msa_cache,
+            msa_batch_size=args.msa_batch_size,
+            template_store=args.template_store,
+            msa_compression=args.msa_compression,
+            msa_filter=msa_filter,
+            feature_cache=FeatureCache(args.feature_cache) if args.feature_cache else None,
+        )
+
+    if args.watch > 0:
+        for queries, is_complex in watch_queries(args.input, args.sort_queries_by, args.watch):
+            logger.info(f"Found {len(queries)} new queries in {args.input}")
+            run_queries(queries, is_complex)
+    else:
+        queries, is_complex = get_queries(args.input, args.sort_queries_by)
+        run_queries(queries, is_complex)
 
 if __name__ == "__main__":
     main()
@@ -5,14 +5,11 @@
 # imports
 ############################################
 import jax
-import requests
 import hashlib
-import tarfile
 import time
 import os
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 
-import random
 from tqdm import tqdm
 
 import numpy as np
@@ -69,89 +66,15 @@ TQDM_BAR_FORMAT = '{l_bar}{bar}| {n_fmt}/{total_fmt} [elapsed: {elapsed} remaini
 def run_mmseqs2(x, prefix, use_env=True, use_filter=True,
                 use_templates=False, filter=None, use_pairing=False, pairing_strategy="greedy",
                 host_url="https://api.colabfold.com",
-                user_agent: str = "") -> Tuple[List[str], List[str]]:
-  submission_endpoint = "ticket/pair" if use_pairing else "ticket/msa"
+                user_agent: str = "", template_store: Optional[str] = None) -> Tuple[List[str], List[str]]:
+  from colabfold.mmseqs.client import get_client
+  from colabfold.mmseqs.journal import TicketJournal
+  from colabfold.mmseqs.result import parse_m8, read_result
+  from colabfold.mmseqs.templates import TemplateStore
 
-  headers = {}
-  if user_agent != "":
-    headers['User-Agent'] = user_agent
-  else:
+  if user_agent == "":
     logger.warning("No user agent specified. Please set a user agent (e.g., 'toolname/version contact@email') to help us debug in case of problems. This warning will become an error in the future.")
-
-  def submit(seqs, mode, N=101):
-    n, query = N, ""
-    for seq in seqs:
-      query += f">{n}\n{seq}\n"
-      n += 1
-
-    while True:
-      error_count = 0
-      try:
-        # https://requests.readthedocs.io/en/latest/user/advanced/#advanced
-        # "good practice to set connect timeouts to slightly larger than a multiple of 3"
-        res = requests.post(f'{host_url}/{submission_endpoint}', data={ 'q': query, 'mode': mode }, timeout=6.02, headers=headers)
-      except requests.exceptions.Timeout:
-        logger.warning("Timeout while submitting to MSA server. Retrying...")
-        continue
-      except Exception as e:
-        error_count += 1
-        logger.warning(f"Error while fetching result from MSA server. Retrying... ({error_count}/5)")
-        logger.warning(f"Error: {e}")
-        time.sleep(5)
-        if error_count > 5:
-          raise
-        continue
-      break
-
-    try:
-      out = res.json()
-    except ValueError:
-      logger.error(f"Server didn't reply with json: {res.text}")
-      out = {"status":"ERROR"}
-    return out
-
-  def status(ID):
-    while True:
-      error_count = 0
-      try:
-        res = requests.get(f'{host_url}/ticket/{ID}', timeout=6.02, headers=headers)
-      except requests.exceptions.Timeout:
-        logger.warning("Timeout while fetching status from MSA server. Retrying...")
-        continue
-      except Exception as e:
-        error_count += 1
-        logger.warning(f"Error while fetching result from MSA server. Retrying... ({error_count}/5)")
-        logger.warning(f"Error: {e}")
-        time.sleep(5)
-        if error_count > 5:
-          raise
-        continue
-      break
-    try:
-      out = res.json()
-    except ValueError:
-      logger.error(f"Server didn't reply with json: {res.text}")
-      out = {"status":"ERROR"}
-    return out
-
-  def download(ID, path):
-    error_count = 0
-    while True:
-      try:
-        res = requests.get(f'{host_url}/result/download/{ID}', timeout=6.02, headers=headers)
-      except requests.exceptions.Timeout:
-        logger.warning("Timeout while fetching result from MSA server. Retrying...")
-        continue
-      except Exception as e:
-        error_count += 1
-        logger.warning(f"Error while fetching result from MSA server. Retrying... ({error_count}/5)")
-        logger.warning(f"Error: {e}")
-        time.sleep(5)
-        if error_count > 5:
-          raise
-        continue
-      break
-    with open(path,"wb") as out: out.write(res.content)
+  client = get_client(host_url, user_agent)
 
   # process input x
   seqs = [x] if isinstance(x, str) else x
@@ -183,139 +106,64 @@ def run_mmseqs2(x, prefix, use_env=True, use_filter=True,
 
   # call mmseqs2 api
   tar_gz_file = f'{path}/out.tar.gz'
-  N,REDO = 101,True
+  N = 101
 
   # deduplicate and keep track of order
   seqs_unique = []
   #TODO this might be slow for large sets
   [seqs_unique.append(x) for x in seqs if x not in seqs_unique]
   Ms = [N + seqs_unique.index(seq) for seq in seqs]
-  # lets do it!
-  if not os.path.isfile(tar_gz_file):
-    TIME_ESTIMATE = 150 * len(seqs_unique)
-    with tqdm(total=TIME_ESTIMATE, bar_format=TQDM_BAR_FORMAT) as pbar:
-      while REDO:
-        pbar.set_description("SUBMIT")
-
-        # Resubmit job until it goes through
-        out = submit(seqs_unique, mode, N)
-        while out["status"] in ["UNKNOWN", "RATELIMIT"]:
-          sleep_time = 5 + random.randint(0, 5)
-          logger.error(f"Sleeping for {sleep_time}s. Reason: {out['status']}")
-          # resubmit
-          time.sleep(sleep_time)
-          out = submit(seqs_unique, mode, N)
-
-        if out["status"] == "ERROR":
-          raise Exception(f'MMseqs2 API is giving errors. Please confirm your input is a valid protein sequence. If error persists, please try again an hour later.')
-
-        if out["status"] == "MAINTENANCE":
-          raise Exception(f'MMseqs2 API is undergoing maintenance. Please try again in a few minutes.')
-
-        # wait for job to finish
-        ID,TIME = out["id"],0
-        pbar.set_description(out["status"])
-        while out["status"] in ["UNKNOWN","RUNNING","PENDING"]:
-          t = 5 + random.randint(0,5)
-          logger.error(f"Sleeping for {t}s. Reason: {out['status']}")
-          time.sleep(t)
-          out = status(ID)
-          pbar.set_description(out["status"])
-          if out["status"] == "RUNNING":
-            TIME += t
-            pbar.update(n=t)
-          #if TIME > 900 and out["status"] != "COMPLETE":
-          #  # something failed on the server side, need to resubmit
-          #  N += 1
-          #  break
-
-        if out["status"] == "COMPLETE":
-          if TIME < TIME_ESTIMATE:
-            pbar.update(n=(TIME_ESTIMATE-TIME))
-          REDO = False
-
-        if out["status"] == "ERROR":
-          REDO = False
-          raise Exception(f'MMseqs2 API is giving errors. Please confirm your input is a valid protein sequence. If error persists, please try again an hour later.')
-
-      # Download results
-      download(ID, tar_gz_file)
 
   # prep list of a3m files
   if use_pairing:
-    a3m_files = [f"{path}/pair.a3m"]
+    a3m_files = ["pair.a3m"]
   else:
-    a3m_files = [f"{path}/uniref.a3m"]
-    if use_env: a3m_files.append(f"{path}/bfd.mgnify30.metaeuk30.smag30.a3m")
+    a3m_files = ["uniref.a3m"]
+    if use_env: a3m_files.append("bfd.mgnify30.metaeuk30.smag30.a3m")
 
-  # extract a3m files
-  if any(not os.path.isfile(a3m_file) for a3m_file in a3m_files):
-    with tarfile.open(tar_gz_file) as tar_gz:
-      tar_gz.extractall(path)
+  # lets do it!
+  # the result is parsed while it is downloaded, the tarball is only kept to skip the search next time
+  if not os.path.isfile(tar_gz_file):
+    TIME_ESTIMATE = 150 * len(seqs_unique)
+    with tqdm(total=TIME_ESTIMATE, bar_format=TQDM_BAR_FORMAT) as pbar:
+      pbar.set_description("SUBMIT")
+      def update(ticket):
+        pbar.set_description(ticket.status)
+        if ticket.status == "RUNNING":
+          pbar.update(n=max(0, min(time.time() - ticket.submitted, TIME_ESTIMATE) - pbar.n))
+        elif ticket.status == "COMPLETE":
+          pbar.update(n=TIME_ESTIMATE - pbar.n)
+      # tickets in flight are journaled next to the jobs, so a restarted run resumes them
+      journal = TicketJournal(os.path.join(os.path.dirname(prefix), "tickets.jsonl"))
+      ticket = client.run(seqs_unique, mode, use_pairing=use_pairing, callback=update, journal=journal)
+    with client.open_download(ticket) as res:
+      a3m_lines, m8 = read_result(res.raw, a3m_files, keep=tar_gz_file)
+    journal.finished(ticket.key)
+  else:
+    with open(tar_gz_file, "rb") as f:
+      a3m_lines, m8 = read_result(f, a3m_files)
 
   # templates
   if use_templates:
-    templates = {}
-    #print("seq\tpdb\tcid\tevalue")
-    for line in open(f"{path}/pdb70.m8","r"):
-      p = line.rstrip().split()
-      M,pdb,qid,e_value = p[0],p[1],p[2],p[10]
-      M = int(M)
-      if M not in templates: templates[M] = []
-      templates[M].append(pdb)
-      #if len(templates[M]) <= 20:
-      #  print(f"{int(M)-N}\t{pdb}\t{qid}\t{e_value}")
+    templates = {k: TMPL[:20] for k,TMPL in parse_m8(m8 or "").items()}
+
+    # structures are fetched once into a store shared by all queries (by default next to the jobs)
+    # and linked into the template directory of each query
+    if template_store is None:
+      template_store = os.path.join(os.path.dirname(prefix), "template_store")
+    store = TemplateStore(template_store)
+    store.fetch(client, [pdb for TMPL in templates.values() for pdb in TMPL])
 
     template_paths = {}
     for k,TMPL in templates.items():
       TMPL_PATH = f"{prefix}_{mode}/templates_{k}"
       if not os.path.isdir(TMPL_PATH):
-        os.mkdir(TMPL_PATH)
-        TMPL_LINE = ",".join(TMPL[:20])
-        response = None
-        while True:
-          error_count = 0
-          try:
-            # https://requests.readthedocs.io/en/latest/user/advanced/#advanced
-            # "good practice to set connect timeouts to slightly larger than a multiple of 3"
-            response = requests.get(f"{host_url}/template/{TMPL_LINE}", stream=True, timeout=6.02, headers=headers)
-          except requests.exceptions.Timeout:
-            logger.warning("Timeout while submitting to template server. Retrying...")
-            continue
-          except Exception as e:
-            error_count += 1
-            logger.warning(f"Error while fetching result from template server. Retrying... ({error_count}/5)")
-            logger.warning(f"Error: {e}")
-            time.sleep(5)
-            if error_count > 5:
-              raise
-            continue
-          break
-        with tarfile.open(fileobj=response.raw, mode="r|gz") as tar:
-          tar.extractall(path=TMPL_PATH)
-        os.symlink("pdb70_a3m.ffindex", f"{TMPL_PATH}/pdb70_cs219.ffindex")
-        with open(f"{TMPL_PATH}/pdb70_cs219.ffdata", "w") as f:
-          f.write("")
+        store.assemble(TMPL, TMPL_PATH)
       template_paths[k] = TMPL_PATH
 
-  # gather a3m lines
-  a3m_lines = {}
-  for a3m_file in a3m_files:
-    update_M,M = True,None
-    for line in open(a3m_file,"r"):
-      if len(line) > 0:
-        if "\x00" in line:
-          line = line.replace("\x00","")
-          update_M = True
-        if line.startswith(">") and update_M:
-          M = int(line[1:].rstrip())
-          update_M = False
-          if M not in a3m_lines: a3m_lines[M] = []
-        a3m_lines[M].append(line)
-
   # return results
 
-  a3m_lines = ["".join(a3m_lines[n]) for n in Ms]
+  a3m_lines = [a3m_lines[n] for n in Ms]
 
   if use_templates:
     template_paths_ = []
@@ -0,0 +1,102 @@
+"""
+On-disk cache of the input features of a job, so that runs with other seeds, models or recycle
+settings skip building them again.
+
+Entries are keyed by a hash of everything generate_input_feature depends on: the MSAs, the query
+sequences and their cardinality, the template features, whether the job is a complex, the model type
+and max_seq. They are stored as `root/<key[:2]>/<key>.cffeat` in the container format of the MSA
+files, uncompressed, and read back as copy-on-write memory maps: the arrays are only read from disk
+when they are used, and changing them doesn't change the file.
+"""
+import hashlib
+import json
+import logging
+import mmap
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from colabfold.msa_file import (
+    ArrayWriter,
+    MsaAndTemplates,
+    decode_features,
+    encode_features,
+    read_container,
+)
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CFFEAT\x00"
+VERSION = 1
+SUFFIX = ".cffeat"
+
+Features = Tuple[Dict[str, Any], Dict[str, List[str]]]
+
+
+class FeatureCache:
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def key(
+        self,
+        msa_and_templates: MsaAndTemplates,
+        is_complex: bool,
+        model_type: str,
+        max_seq: int,
+    ) -> str:
+        (
+            unpaired_msa,
+            paired_msa,
+            query_seqs_unique,
+            query_seqs_cardinality,
+            template_features,
+        ) = msa_and_templates
+        digest = hashlib.sha256()
+        fields = [VERSION, query_seqs_unique, query_seqs_cardinality]
+        fields += [is_complex, model_type, max_seq]
+        digest.update(json.dumps(fields).encode())
+        for msas in [unpaired_msa, paired_msa]:
+            digest.update(json.dumps(None if msas is None else len(msas)).encode())
+            for msa in msas or []:
+                digest.update(f"{len(msa)}\n".encode())
+                digest.update(msa.encode())
+        for features in template_features:
+            kinds, arrays = encode_features(features)
+            for key, kind in sorted(kinds.items()):
+                array = np.ascontiguousarray(arrays[key])
+                digest.update(
+                    json.dumps([key, kind, array.dtype.str, array.shape]).encode()
+                )
+                digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root.joinpath(key[:2], key + SUFFIX)
+
+    def get(self, key: str) -> Optional[Features]:
+        path = self.path(key)
+        if not path.is_file():
+            return None
+        try:
+            manifest, get = read_container(
+                path, MAGIC, VERSION, "ColabFold feature", mmap.ACCESS_COPY
+            )
+        except ValueError as e:
+            logger.warning(f"Ignoring cached features: {e}")
+            return None
+        arrays = {key: get(entry) for key, entry in manifest["arrays"].items()}
+        return decode_features(manifest["kinds"], arrays), manifest["domain_names"]
+
+    def put(self, key: str, feature_dict: Dict[str, Any], domain_names: Dict):
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        kinds, arrays = encode_features(feature_dict)
+        writer = ArrayWriter()
+        manifest = {
+            "kinds": kinds,
+            "arrays": {key: writer.add(array) for key, array in arrays.items()},
+            "domain_names": domain_names,
+        }
+        writer.write(path, MAGIC, VERSION, manifest)
@@ -1,51 +1,113 @@
-from typing import List, Optional, Tuple, Union
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple, Union
 from pathlib import Path
+import csv
 import random
 import logging
+import time
+
+from colabfold.mmseqs.db import MMseqsDB, db_exists, read_lookup
+
 logger = logging.getLogger(__name__)
 
+# written by colabfold_search when all results are in its output directory
+SEARCH_DONE = "search.done"
+
 def safe_filename(file: str) -> str:
     return "".join([c if c.isalnum() or c in ["_", ".", "-"] else "_" for c in file])
 
+class ComplexMSA:
+    """The MSA of a complex as blocks of the MSAs of its chains
+
+    The paired rows put the paired MSAs of all chains (each repeated for its copies) side by side,
+    the unpaired rows have the unpaired MSA of one chain copy and gaps in the columns of all other
+    copies. The gaps are implicit: the a3m text is only put together line by line when it is
+    written, and colabfold.a3m.complex_msa_features builds the features from the blocks directly.
+    """
+
+    def __init__(
+        self,
+        query_seqs_unique: List[str],
+        query_seqs_cardinality: List[int],
+        paired_msa: Optional[List[str]],
+        unpaired_msa: Optional[List[str]],
+    ):
+        if paired_msa is None and unpaired_msa is None:
+            raise ValueError(f"Invalid pairing")
+        self.query_seqs_unique = query_seqs_unique
+        self.query_seqs_cardinality = query_seqs_cardinality
+        self.paired_msa = paired_msa
+        self.unpaired_msa = unpaired_msa
+
+    def widths(self) -> List[int]:
+        """Number of columns of every chain copy"""
+        return [
+            len(seq)
+            for n, seq in enumerate(self.query_seqs_unique)
+            for _ in range(self.query_seqs_cardinality[n])
+        ]
+
+    def paired_lines(self) -> Iterator[str]:
+        chain_lines = [
+            self.paired_msa[n].splitlines() for n in range(len(self.query_seqs_unique))
+        ]
+        for n, lines in enumerate(chain_lines):
+            if len(lines) > len(chain_lines[0]):
+                raise ValueError(
+                    f"The paired MSA of chain {n} has more lines than the one of the first chain"
+                )
+        for i in range(len(chain_lines[0])):
+            parts = []
+            for n, lines in enumerate(chain_lines):
+                if i >= len(lines):
+                    continue
+                line = lines[i]
+                if line.startswith(">"):
+                    parts.append(line.replace(">", "\t", 1) if n != 0 else line)
+                else:
+                    parts.append(line * self.query_seqs_cardinality[n])
+            yield "".join(parts)
+
+    def unpaired_lines(self) -> Iterator[str]:
+        widths = self.widths()
+        pos = 0
+        for n in range(len(self.query_seqs_unique)):
+            lines = [line for line in self.unpaired_msa[n].split("\n") if line]
+            for _ in range(self.query_seqs_cardinality[n]):
+                before = "-" * sum(widths[:pos])
+                after = "-" * sum(widths[pos + 1 :])
+                for line in lines:
+                    yield line if line.startswith(">") else before + line + after
+                pos += 1
+
+    def chunks(self) -> Iterator[str]:
+        """Pieces of the a3m text, the paired rows before the unpaired ones"""
+        blocks = []
+        if self.paired_msa is not None:
+            blocks.append(self.paired_lines())
+        if self.unpaired_msa is not None:
+            blocks.append(self.unpaired_lines())
+        for b, lines in enumerate(blocks):
+            if b != 0:
+                yield "\n"
+            for i, line in enumerate(lines):
+                yield line if i == 0 else "\n" + line
+
+    def to_str(self) -> str:
+        return "".join(self.chunks())
+
 def pair_sequences(
     a3m_lines: List[str], query_sequences: List[str], query_cardinality: List[int]
 ) -> str:
-    a3m_line_paired = [""] * len(a3m_lines[0].splitlines())
-    for n, seq in enumerate(query_sequences):
-        lines = a3m_lines[n].splitlines()
-        for i, line in enumerate(lines):
-            if line.startswith(">"):
-                if n != 0:
-                    line = line.replace(">", "\t", 1)
-                a3m_line_paired[i] = a3m_line_paired[i] + line
-            else:
-                a3m_line_paired[i] = a3m_line_paired[i] + line * query_cardinality[n]
-    return "\n".join(a3m_line_paired)
+    return "\n".join(
+        ComplexMSA(query_sequences, query_cardinality, a3m_lines, None).paired_lines()
+    )
 
 def pad_sequences(
     a3m_lines: List[str], query_sequences: List[str], query_cardinality: List[int]
 ) -> str:
-    _blank_seq = [
-        ("-" * len(seq))
-        for n, seq in enumerate(query_sequences)
-        for _ in range(query_cardinality[n])
-    ]
-    a3m_lines_combined = []
-    pos = 0
-    for n, seq in enumerate(query_sequences):
-        for j in range(0, query_cardinality[n]):
-            lines = a3m_lines[n].split("\n")
-            for a3m_line in lines:
-                if len(a3m_line) == 0:
-                    continue
-                if a3m_line.startswith(">"):
-                    a3m_lines_combined.append(a3m_line)
-                else:
-                    a3m_lines_combined.append(
-                        "".join(_blank_seq[:pos] + [a3m_line] + _blank_seq[pos + 1 :])
-                    )
-            pos += 1
-    return "\n".join(a3m_lines_combined)
+    return "\n".join(
+        ComplexMSA(query_sequences, query_cardinality, None, a3m_lines).unpaired_lines()
+    )
 
 def pair_msa(
     query_seqs_unique: List[str],
@@ -53,36 +115,46 @@ def pair_msa(
     paired_msa: Optional[List[str]],
     unpaired_msa: Optional[List[str]],
 ) -> str:
-    if paired_msa is None and unpaired_msa is not None:
-        a3m_lines = pad_sequences(
-            unpaired_msa, query_seqs_unique, query_seqs_cardinality
-        )
-    elif paired_msa is not None and unpaired_msa is not None:
-        a3m_lines = (
-            pair_sequences(paired_msa, query_seqs_unique, query_seqs_cardinality)
-            + "\n"
-            + pad_sequences(unpaired_msa, query_seqs_unique, query_seqs_cardinality)
-        )
-    elif paired_msa is not None and unpaired_msa is None:
-        a3m_lines = pair_sequences(
-            paired_msa, query_seqs_unique, query_seqs_cardinality
-        )
-    else:
-        raise ValueError(f"Invalid pairing")
-    return a3m_lines
+    return ComplexMSA(
+        query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa
+    ).to_str()
 
-def msa_to_str(
+def msa_chunks(
     unpaired_msa: List[str],
     paired_msa: List[str],
     query_seqs_unique: List[str],
     query_seqs_cardinality: List[int],
-) -> str:
-    msa = "#" + ",".join(map(str, map(len, query_seqs_unique))) + "\t"
-    msa += ",".join(map(str, query_seqs_cardinality)) + "\n"
+) -> Iterator[str]:
+    yield "#" + ",".join(map(str, map(len, query_seqs_unique))) + "\t"
+    yield ",".join(map(str, query_seqs_cardinality)) + "\n"
     # build msa with cardinality of 1, it makes it easier to parse and manipulate
     query_seqs_cardinality = [1 for _ in query_seqs_cardinality]
-    msa += pair_msa(query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa)
-    return msa
+    yield from ComplexMSA(
+        query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa
+    ).chunks()
+
+def msa_to_str(
+    unpaired_msa: List[str],
+    paired_msa: List[str],
+    query_seqs_unique: List[str],
+    query_seqs_cardinality: List[int],
+) -> str:
+    return "".join(
+        msa_chunks(unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality)
+    )
+
+def write_msa(
+    path: Path,
+    unpaired_msa: List[str],
+    paired_msa: List[str],
+    query_seqs_unique: List[str],
+    query_seqs_cardinality: List[int],
+):
+    """msa_to_str written to a file, without building the text of the whole MSA"""
+    with Path(path).open("w") as f:
+        f.writelines(
+            msa_chunks(unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality)
+        )
 
 def parse_fasta(fasta_string: str) -> Tuple[List[str], List[str]]:
     """Parses FASTA string and returns list of strings with amino-acid sequences.
@@ -114,36 +186,216 @@ def parse_fasta(fasta_string: str) -> Tuple[List[str], List[str]]:
 
     return sequences, descriptions
 
+def first_sequence(a3m: str) -> str:
+    """The query of an a3m, without parsing the rest of it"""
+    start = a3m.find(">")
+    end = a3m.find("\n>", start)
+    return parse_fasta(a3m[: end if end != -1 else len(a3m)])[0][0]
+
+
+class A3MLines(Sequence[str]):
+    """The a3m lines of a query (a list with the text of its a3m), which are read each time they
+    are used instead of being kept in memory with the queries. Compares equal to that list.
+
+    first_line is the first line of the a3m, which tells whether it is the MSA of a complex.
+    """
+
+    def __init__(self, load: Callable[[], str], first_line: str):
+        self.load = load
+        self.first_line = first_line
+
+    def __len__(self) -> int:
+        return 1
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and index not in (0, -1):
+            raise IndexError("A3MLines index out of range")
+        return [self.load()][index]
+
+    def __iter__(self) -> Iterator[str]:
+        yield self.load()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, A3MLines):
+            other = list(other)
+        return list(self) == other
+
+    def __repr__(self) -> str:
+        return f"A3MLines({self.first_line!r})"
+
+
+def read_a3m_start(path: Path) -> Tuple[str, List[str]]:
+    """The first line of an a3m file and the sequence of its first entry (or none if it has no
+    entry), reading only up to the second entry"""
+    lines = []
+    headers = 0
+    with path.open() as f:
+        for line in f:
+            if line.strip().startswith(">"):
+                headers += 1
+                if headers == 2:
+                    break
+            lines.append(line)
+    first_line = lines[0].splitlines()[0] if lines and lines[0].strip() else ""
+    return first_line, parse_fasta("".join(lines))[0]
+
+
+def db_first_sequence(db: MMseqsDB, key: int) -> str:
+    """first_sequence of an a3m in a database, reading only the start of the entry"""
+    max_length = 4096
+    while True:
+        head = db.get(key, max_length)
+        text = head.decode(errors="ignore")
+        if len(head) < max_length or text.find("\n>", text.find(">")) != -1:
+            return first_sequence(text)
+        max_length *= 2
+
+
+def get_queries_from_db(input_path: Path) -> List[Tuple[str, str, A3MLines]]:
+    """Reads the MSAs of a colabfold_search --unpack 0 run from its final.a3m database (and pair.a3m
+    and pair_env.a3m next to it) without unpacking them. The result is the same as reading the
+    a3m files that --unpack 1 would have written, each MSA is put together when it is used."""
+    base = input_path.parent
+    lookup = input_path.with_name(f"{input_path.name}.lookup")
+    if not lookup.is_file():
+        lookup = base.joinpath("qdb.lookup")
+    jobs = {}
+    for key, (name, file_number) in sorted(read_lookup(lookup).items()):
+        jobs.setdefault(file_number, (name, []))[1].append(key)
+    cardinality = {}
+    if base.joinpath("qdb.cardinality").is_file():
+        with base.joinpath("qdb.cardinality").open() as f:
+            for line in f:
+                key, count = line.split("\t")
+                cardinality[int(key)] = int(count)
+
+    queries = []
+    # kept open for loading the MSAs, the maps are closed when the queries are gone
+    final = MMseqsDB(input_path)
+    pair_dbs = [
+        MMseqsDB(base.joinpath(name))
+        for name in ["pair.a3m", "pair_env.a3m"]
+        if db_exists(base.joinpath(name))
+    ]
+
+    def load(keys: List[int]) -> str:
+        unpaired_msa = [final.get_text(key) for key in keys]
+        if len(pair_dbs) == 0:
+            # a search in monomer mode, with one chain per job
+            return unpaired_msa[0]
+        query_seqs_unique = [first_sequence(a3m) for a3m in unpaired_msa]
+        query_seqs_cardinality = [cardinality.get(key, 1) for key in keys]
+        paired_msa = None
+        if len(keys) > 1:
+            paired_msa = [
+                "".join(db.get_text(key) for db in pair_dbs) for key in keys
+            ]
+        return msa_to_str(
+            unpaired_msa, paired_msa, query_seqs_unique, query_seqs_cardinality
+        )
+
+    for file_number, (name, keys) in sorted(jobs.items()):
+        query_seqs_unique = [db_first_sequence(final, key) for key in keys]
+        if len(pair_dbs) == 0:
+            first_line = final.get(keys[0], 4096).decode(errors="ignore")
+            first_line = first_line.splitlines()[0] if first_line else ""
+        else:
+            query_seqs_cardinality = [cardinality.get(key, 1) for key in keys]
+            first_line = "#" + ",".join(map(str, map(len, query_seqs_unique))) + "\t"
+            first_line += ",".join(map(str, query_seqs_cardinality))
+        # the first row of the MSA: the query, or the paired queries of all chains
+        query_sequence = "".join(query_seqs_unique)
+        a3m_lines = A3MLines(lambda keys=keys: load(keys), first_line)
+        queries.append((safe_filename(name), query_sequence, a3m_lines))
+    return queries
+
+
+def watch_queries(
+    input_path: Union[str, Path], sort_queries_by: str = "length", interval: float = 60
+) -> Iterator[Tuple[List[Tuple[str, str, Optional[List[str]]]], bool]]:
+    """Yields the queries of a colabfold_search output directory as they appear, until the search
+    has written search.done
+
+    Each round yields the jobs that weren't yielded before: the a3m files of a --unpack 1 search or
+    the finished shards (and at the end the merged final.a3m) of a --unpack 0 search.
+    """
+    input_path = Path(input_path)
+    seen_files, seen_jobs = set(), set()
+    while True:
+        # checked first, so nothing that was written before the marker is missed
+        done = input_path.joinpath(SEARCH_DONE).is_file()
+        # only loose a3m files, the databases of the search (uniref.a3m, pair.a3m, final.a3m, ...) are
+        # also named *.a3m but are incomplete while it runs
+        sources = [
+            file for file in sorted(input_path.glob("*.a3m"))
+            if file not in seen_files and not db_exists(file)
+        ]
+        # databases are complete once their shard or the whole search is done
+        for db in [input_path.joinpath("final.a3m")] + sorted(input_path.glob("shards/shard_*/final.a3m")):
+            finished = done if db.parent == input_path else db.with_name("shard.done").is_file()
+            if finished and db_exists(db) and db not in seen_files:
+                sources.append(db)
+
+        queries, is_complex = [], False
+        for source in sources:
+            try:
+                source_queries, source_is_complex = get_queries(source, None)
+            except (OSError, ValueError) as e:
+                # e.g. a shard that was merged and removed in the meantime
+                logger.debug(f"Could not read {source}: {e}")
+                continue
+            seen_files.add(source)
+            for query in source_queries:
+                if query[0] not in seen_jobs:
+                    seen_jobs.add(query[0])
+                    queries.append(query)
+                    is_complex = is_complex or source_is_complex
+        if sort_queries_by == "length":
+            queries.sort(key=lambda t: len("".join(t[1])))
+
+        if queries:
+            yield queries, is_complex
+        elif done:
+            return
+        else:
+            time.sleep(interval)
+
+
 def get_queries(
     input_path: Union[str, Path], sort_queries_by: str = "length"
 ) -> Tuple[List[Tuple[str, str, Optional[List[str]]]], bool]:
-    """Reads a directory of fasta files, a single fasta file or a csv file and returns a tuple
-    of job name, sequence and the optional a3m lines"""
+    """Reads a directory of fasta files, a single fasta file, a csv file or the final.a3m database
+    of colabfold_search and returns a tuple of job name, sequence and the optional a3m lines
+
+    The a3m lines of a3m inputs are A3MLines, which only read the MSA when it is used. Sorting
+    and telling whether the input has complexes only look at the first lines of the a3m files."""
 
     input_path = Path(input_path)
-    if not input_path.exists():
+    if db_exists(input_path):
+        queries = get_queries_from_db(input_path)
+    elif not input_path.exists():
         raise OSError(f"{input_path} could not be found")
-
-    if input_path.is_file():
+    elif input_path.is_file():
         if input_path.suffix == ".csv" or input_path.suffix == ".tsv":
             sep = "\t" if input_path.suffix == ".tsv" else ","
-            import pandas
-            df = pandas.read_csv(input_path, sep=sep, dtype=str)
-            assert "id" in df.columns and "sequence" in df.columns
-            queries = [
-                (seq_id, sequence.upper().split(":"), None)
-                for seq_id, sequence in df[["id", "sequence"]].itertuples(index=False)
-            ]
-            for i in range(len(queries)):
-                if len(queries[i][1]) == 1:
-                    queries[i] = (queries[i][0], queries[i][1][0], None)
+            queries = []
+            # read row by row, a large table doesn't need to fit into memory twice
+            with input_path.open(newline="") as f:
+                reader = csv.DictReader(f, delimiter=sep)
+                assert "id" in reader.fieldnames and "sequence" in reader.fieldnames
+                for row in reader:
+                    sequences = row["sequence"].upper().split(":")
+                    if len(sequences) == 1:
+                        queries.append((row["id"], sequences[0], None))
+                    else:
+                        queries.append((row["id"], sequences, None))
         elif input_path.suffix == ".a3m":
-            (seqs, header) = parse_fasta(input_path.read_text())
+            first_line, seqs = read_a3m_start(input_path)
             if len(seqs) == 0:
                 raise ValueError(f"{input_path} is empty")
             query_sequence = seqs[0]
             # Use a list so we can easily extend this to multiple msas later
-            a3m_lines = [input_path.read_text()]
+            a3m_lines = A3MLines(input_path.read_text, first_line)
             queries = [(input_path.stem, query_sequence, a3m_lines)]
         elif input_path.suffix in [".fasta", ".faa", ".fa"]:
             (sequences, headers) = parse_fasta(input_path.read_text())
@@ -167,7 +419,11 @@ def get_queries(
             if file.suffix.lower() not in [".a3m", ".fasta", ".faa"]:
                 logger.warning(f"non-fasta/a3m file in input directory: {file}")
                 continue
-            (seqs, header) = parse_fasta(file.read_text())
+            if file.suffix.lower() == ".a3m":
+                # only the query is read now, the MSA when the job runs
+                first_line, seqs = read_a3m_start(file)
+            else:
+                (seqs, header) = parse_fasta(file.read_text())
             if len(seqs) == 0:
                 logger.error(f"{file} is empty")
                 continue
@@ -178,7 +434,7 @@ def get_queries(
                 )
 
             if file.suffix.lower() == ".a3m":
-                a3m_lines = [file.read_text()]
+                a3m_lines = A3MLines(file.read_text, first_line)
                 queries.append((file.stem, query_sequence.upper(), a3m_lines))
             else:
                 if query_sequence.count(":") == 0:
@@ -200,8 +456,14 @@ def get_queries(
         if isinstance(query_sequence, list):
             is_complex = True
             break
-        if a3m_lines is not None and a3m_lines[0].startswith("#"):
-            a3m_line = a3m_lines[0].splitlines()[0]
+        if a3m_lines is None:
+            continue
+        a3m_line = (
+            a3m_lines.first_line
+            if isinstance(a3m_lines, A3MLines)
+            else (a3m_lines[0].splitlines() or [""])[0]
+        )
+        if a3m_line.startswith("#"):
             tab_sep_entries = a3m_line[1:].split("\t")
             if len(tab_sep_entries) == 2:
                 query_seq_len = tab_sep_entries[0].split(",")
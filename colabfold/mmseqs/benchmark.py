@@ -0,0 +1,142 @@
+"""
+Throughput benchmark of the MSA client against the local mock server.
+
+Runs the same set of queries through run_mmseqs2 at several concurrency levels and reports
+queries per second, latency percentiles, requests sent and bytes left on disk.
+
+    python -m colabfold.mmseqs.benchmark --queries 64 --concurrency 1,4,16 --run-time 1
+"""
+import logging
+import os
+import random
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from colabfold.mmseqs.client import MMseqs2Client, set_client
+from colabfold.mmseqs.server import AMINO_ACIDS, MockMSAServer
+
+logger = logging.getLogger(__name__)
+
+
+def disk_usage(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                total += os.path.getsize(file_path)
+    return total
+
+
+def random_queries(num_queries: int, length: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice(AMINO_ACIDS) for _ in range(length))
+        for _ in range(num_queries)
+    ]
+
+
+def run_benchmark(
+    queries: List[str],
+    concurrency: int,
+    server: MockMSAServer,
+    work_dir: Path,
+    use_templates: bool = False,
+    poll_min: float = 0.1,
+) -> Dict[str, float]:
+    from colabfold.colabfold import run_mmseqs2
+
+    # a client with a short poll interval, so the benchmark measures the client and not the sleeps
+    user_agent = "colabfold/benchmark"
+    client = MMseqs2Client(
+        server.url, user_agent, poll_min=poll_min, pool_size=max(16, concurrency)
+    )
+    set_client(server.url, user_agent, client)
+    server.requests.clear()
+    server.bytes_sent = 0
+
+    def search(job: int) -> float:
+        start = time.time()
+        run_mmseqs2(
+            queries[job],
+            str(work_dir.joinpath(f"job_{job}")),
+            use_templates=use_templates,
+            host_url=server.url,
+            user_agent=user_agent,
+        )
+        return time.time() - start
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = np.array(list(executor.map(search, range(len(queries)))))
+    wall_time = time.time() - start
+
+    return {
+        "concurrency": concurrency,
+        "qps": len(queries) / wall_time,
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+        "requests": sum(server.requests.values()),
+        "MB_received": server.bytes_sent / 1024**2,
+        "MB_on_disk": disk_usage(work_dir) / 1024**2,
+    }
+
+
+def main():
+    parser = ArgumentParser(
+        description="Measure the throughput of the MSA client against a local mock server"
+    )
+    parser.add_argument("--queries", type=int, default=32)
+    parser.add_argument("--length", type=int, default=200)
+    parser.add_argument(
+        "--concurrency",
+        default="1,4,16",
+        help="Comma separated numbers of concurrent run_mmseqs2 calls",
+    )
+    parser.add_argument("--templates", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--run-time", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--ratelimit-rate", type=float, default=0.0)
+    parser.add_argument("--msa-depth", type=int, default=256)
+    parser.add_argument("--poll-min", type=float, default=0.1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    queries = random_queries(args.queries, args.length)
+    results = []
+    for concurrency in [int(i) for i in args.concurrency.split(",")]:
+        with MockMSAServer(
+            latency=args.latency,
+            run_time=args.run_time,
+            failure_rate=args.failure_rate,
+            ratelimit_rate=args.ratelimit_rate,
+            num_templates=4 if args.templates else 0,
+            msa_depth=args.msa_depth,
+        ) as server, tempfile.TemporaryDirectory() as work_dir:
+            results.append(
+                run_benchmark(
+                    queries,
+                    concurrency,
+                    server,
+                    Path(work_dir),
+                    args.templates,
+                    args.poll_min,
+                )
+            )
+
+    columns = list(results[0])
+    print("\t".join(columns))
+    for result in results:
+        print("\t".join(f"{result[column]:.3g}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Content-addressed on-disk cache for MSA server results, shared between jobs, runs and processes.
+
+Entries are stored as one file per key in `root/<key[:2]>/<key>`. Writes go through a temporary file
+and an atomic rename, so concurrent readers never see partial entries. The least recently used entries
+are evicted once the cache grows beyond `max_size` bytes.
+"""
+import fcntl
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tarfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the cached values changes
+CACHE_FORMAT = 1
+
+
+def renumber_a3m(a3m: str, old: int, new: int) -> str:
+    """run_mmseqs2 names the query of each MSA block after its position in the submission (>101, >102, ...)"""
+    if old == new:
+        return a3m
+    return re.sub(rf"^>{old}$", f">{new}", a3m, flags=re.MULTILINE)
+
+
+class MSACache:
+    def __init__(self, root: Union[str, Path], max_size: int = 0, version: str = ""):
+        """
+        root: directory of the cache, can be shared by several processes
+        max_size: size cap in bytes, 0 disables eviction
+        version: included in every key, change it when the server databases are updated
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.version = version
+        self.size: Optional[int] = None
+        self.puts = 0
+        self._size_lock = threading.Lock()
+
+    def key(self, *fields: Any) -> str:
+        fields = (CACHE_FORMAT, self.version) + fields
+        return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root.joinpath(key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path(key)
+        try:
+            data = path.read_bytes()
+            # bump the entry for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.parent.joinpath(
+            f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        if self.max_size <= 0:
+            return
+        with self._size_lock:
+            self.puts += 1
+            if self.size is not None:
+                self.size += len(data)
+            # other processes write to the same cache, so we recount from time to time
+            needs_eviction = (
+                self.size is None or self.size > self.max_size or self.puts % 256 == 0
+            )
+        if needs_eviction:
+            self.evict()
+
+    def get_text(self, key: str) -> Optional[str]:
+        data = self.get(key)
+        return None if data is None else data.decode()
+
+    def put_text(self, key: str, text: str):
+        self.put(key, text.encode())
+
+    def get_json(self, key: str) -> Any:
+        data = self.get(key)
+        return None if data is None else json.loads(data)
+
+    def put_json(self, key: str, value: Any):
+        self.put(key, json.dumps(value).encode())
+
+    def put_dir(self, key: str, path: Union[str, Path]):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w") as tar:
+            tar.add(path, arcname=".")
+        self.put(key, data.getvalue())
+
+    @contextmanager
+    def lock(self):
+        with self.root.joinpath(".lock").open("w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is below 90% of max_size"""
+        with self.lock():
+            entries = []
+            total = 0
+            for directory in os.scandir(self.root):
+                if not directory.is_dir():
+                    continue
+                for entry in os.scandir(directory.path):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    # leftovers of crashed writers
+                    if entry.name.startswith("."):
+                        if stat.st_mtime < time.time() - 3600:
+                            os.unlink(entry.path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            if total > self.max_size:
+                entries.sort()
+                evicted = 0
+                for _, size, path in entries:
+                    if total <= 0.9 * self.max_size:
+                        break
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    evicted += 1
+                logger.info(f"Evicted {evicted} entries from MSA cache {self.root}")
+
+        with self._size_lock:
+            self.size = total
+
+    def unpaired_key(
+        self, seq: str, use_env: bool, use_filter: bool, host_url: str
+    ) -> str:
+        return self.key("unpaired", seq, use_env, use_filter, host_url)
+
+    def templates_key(
+        self, seq: str, use_env: bool, use_filter: bool, host_url: str
+    ) -> str:
+        return self.key("templates", seq, use_env, use_filter, host_url)
+
+    def has_unpaired(
+        self,
+        seq: str,
+        use_env: bool,
+        use_filter: bool,
+        use_templates: bool,
+        host_url: str,
+    ) -> bool:
+        keys = [self.unpaired_key(seq, use_env, use_filter, host_url)]
+        if use_templates:
+            keys.append(self.templates_key(seq, use_env, use_filter, host_url))
+        return all(self.path(key).is_file() for key in keys)
+
+    def wrap_run_mmseqs2(self, run_mmseqs2: Callable) -> Callable:
+        """Returns a drop-in replacement of run_mmseqs2 that consults the cache before the server
+
+        Unpaired MSAs and template hits are cached per sequence, paired MSAs per tuple of sequences.
+        Only sequences that are missing from the cache are sent to the server.
+        """
+
+        def cached_run_mmseqs2(
+            x,
+            prefix,
+            use_env=True,
+            use_filter=True,
+            use_templates=False,
+            filter=None,
+            use_pairing=False,
+            pairing_strategy="greedy",
+            host_url="https://api.colabfold.com",
+            user_agent: str = "",
+            template_store: Optional[str] = None,
+        ):
+            seqs = [x] if isinstance(x, str) else x
+            if filter is not None:
+                use_filter = filter
+            kwargs = dict(
+                use_filter=use_filter, host_url=host_url, user_agent=user_agent
+            )
+
+            if use_pairing:
+                key = self.key(
+                    "paired", seqs, use_env, use_filter, pairing_strategy, host_url
+                )
+                a3m_lines = self.get_json(key)
+                if a3m_lines is None:
+                    a3m_lines = run_mmseqs2(
+                        seqs,
+                        prefix,
+                        use_env,
+                        use_pairing=True,
+                        pairing_strategy=pairing_strategy,
+                        **kwargs,
+                    )
+                    self.put_json(key, a3m_lines)
+                return a3m_lines
+
+            seqs_unique = list(dict.fromkeys(seqs))
+            msa_keys = {
+                seq: self.unpaired_key(seq, use_env, use_filter, host_url)
+                for seq in seqs_unique
+            }
+            template_keys = {
+                seq: self.templates_key(seq, use_env, use_filter, host_url)
+                for seq in seqs_unique
+            }
+
+            # cached MSAs are stored with the query named >101
+            a3m_lines = {}
+            template_paths = {}
+            for n, seq in enumerate(seqs_unique):
+                a3m = self.get_text(msa_keys[seq])
+                if a3m is None:
+                    continue
+                if use_templates:
+                    template_path = Path(f"{prefix}_cache").joinpath(
+                        f"templates_{template_keys[seq][:16]}"
+                    )
+                    data = self.get(template_keys[seq])
+                    if data is None:
+                        continue
+                    elif len(data) == 0:
+                        # no templates found for this sequence
+                        template_paths[seq] = None
+                    else:
+                        if not template_path.is_dir():
+                            with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+                                tar.extractall(template_path)
+                        template_paths[seq] = str(template_path)
+                a3m_lines[seq] = renumber_a3m(a3m, 101, 101 + n)
+
+            missing = [seq for seq in seqs_unique if seq not in a3m_lines]
+            if len(missing) > 0:
+                logger.info(
+                    f"MSA cache: {len(seqs_unique) - len(missing)} hits, {len(missing)} misses"
+                )
+                if use_templates:
+                    kwargs["template_store"] = template_store
+                out = run_mmseqs2(
+                    missing, prefix, use_env, use_templates=use_templates, **kwargs
+                )
+                if use_templates:
+                    (missing_a3m_lines, missing_template_paths) = out
+                else:
+                    (missing_a3m_lines, missing_template_paths) = out, [None] * len(
+                        missing
+                    )
+                for n, (seq, a3m, template_path) in enumerate(
+                    zip(missing, missing_a3m_lines, missing_template_paths)
+                ):
+                    self.put_text(msa_keys[seq], renumber_a3m(a3m, 101 + n, 101))
+                    a3m_lines[seq] = renumber_a3m(
+                        a3m, 101 + n, 101 + seqs_unique.index(seq)
+                    )
+                    if use_templates:
+                        if template_path is None:
+                            self.put(template_keys[seq], b"")
+                        else:
+                            self.put_dir(template_keys[seq], template_path)
+                        template_paths[seq] = template_path
+
+            a3m_lines = [a3m_lines[seq] for seq in seqs]
+            if use_templates:
+                return a3m_lines, [template_paths[seq] for seq in seqs]
+            return a3m_lines
+
+        return cached_run_mmseqs2
@@ -0,0 +1,374 @@
+"""
+Client for the MSA server API (ticket/msa, ticket/pair, ticket/{id}, result/download/{id} and template/{ids}).
+
+A single client keeps a pooled, keep-alive `requests.Session` and can have many tickets in flight at once.
+"""
+import logging
+import random
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from colabfold.mmseqs.journal import TicketJournal
+from colabfold.mmseqs.ratelimit import HostRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# https://requests.readthedocs.io/en/latest/user/advanced/#advanced
+# "good practice to set connect timeouts to slightly larger than a multiple of 3"
+DEFAULT_TIMEOUT = 6.02
+
+# ticket states in which the server is still working on the ticket
+WAITING_STATES = ["UNKNOWN", "PENDING", "RUNNING"]
+
+
+class Ticket:
+    """A submitted search and the polling state that belongs to it"""
+
+    def __init__(
+        self,
+        seqs: List[str],
+        mode: str,
+        use_pairing: bool,
+        N: int = 101,
+        journal: Optional[TicketJournal] = None,
+        key: Optional[str] = None,
+    ):
+        self.seqs = seqs
+        self.mode = mode
+        self.use_pairing = use_pairing
+        self.N = N
+        self.journal = journal
+        self.key = key
+        self.id: Optional[str] = None
+        self.status = "UNKNOWN"
+        self.interval = 0.0
+        self.next_poll = 0.0
+        self.submitted = 0.0
+
+    @property
+    def endpoint(self) -> str:
+        return "ticket/pair" if self.use_pairing else "ticket/msa"
+
+    @property
+    def query(self) -> str:
+        return "".join(f">{self.N + i}\n{seq}\n" for i, seq in enumerate(self.seqs))
+
+
+class MMseqs2Client:
+    """Talks to an MSA server through a shared connection pool
+
+    All requests go through one retry policy (exponential backoff with jitter). Tickets are
+    polled at an interval that starts at `poll_min`, grows by `poll_factor` while the ticket
+    state doesn't change and is reset when it does. RATELIMIT replies back off separately
+    and honor the Retry-After header if the server sends one.
+    """
+
+    def __init__(
+        self,
+        host_url: str,
+        user_agent: str = "",
+        timeout: float = DEFAULT_TIMEOUT,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        poll_min: float = 1.0,
+        poll_max: float = 30.0,
+        poll_factor: float = 1.5,
+        pool_size: int = 16,
+        rate_limiter: Optional[HostRateLimiter] = None,
+    ):
+        self.host_url = host_url
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.poll_factor = poll_factor
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if user_agent != "":
+            self.session.headers["User-Agent"] = user_agent
+
+    def backoff(self, attempt: int) -> float:
+        """Exponential backoff with "equal jitter", so that clients don't retry in lockstep"""
+        delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Send a request, retrying on network errors
+
+        Timeouts are retried indefinitely as they usually mean the server is busy,
+        other errors are retried up to `max_retries` times.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        error_count = 0
+        attempt = 0
+        while True:
+            try:
+                return self.session.request(method, f"{self.host_url}/{path}", **kwargs)
+            except requests.exceptions.Timeout:
+                logger.warning(
+                    f"Timeout while requesting {path} from MSA server. Retrying..."
+                )
+            except requests.exceptions.RequestException as e:
+                error_count += 1
+                if error_count > self.max_retries:
+                    raise
+                logger.warning(
+                    f"Error while requesting {path} from MSA server. Retrying... ({error_count}/{self.max_retries})"
+                )
+                logger.warning(f"Error: {e}")
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def request_json(self, method: str, path: str, **kwargs) -> dict:
+        res = self.request(method, path, **kwargs)
+        try:
+            out = res.json()
+        except ValueError:
+            logger.error(f"Server didn't reply with json: {res.text}")
+            out = {"status": "ERROR"}
+        if out.get("status") == "RATELIMIT" and "Retry-After" in res.headers:
+            try:
+                out["retry_after"] = float(res.headers["Retry-After"])
+            except ValueError:
+                pass
+        return out
+
+    def ratelimit_delay(self, out: dict, attempt: int) -> float:
+        if "retry_after" in out:
+            return out["retry_after"] + random.uniform(0, self.poll_min)
+        return self.backoff(attempt)
+
+    def api_json(self, method: str, path: str, **kwargs) -> dict:
+        """`request_json` for the ticket endpoints, which count against the server's rate limit"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.request_json(method, path, **kwargs)
+
+    def submit(self, ticket: Ticket) -> Ticket:
+        """Submit the ticket, resubmitting until the server accepts it"""
+        attempt = 0
+        while True:
+            out = self.api_json(
+                "POST", ticket.endpoint, data={"q": ticket.query, "mode": ticket.mode}
+            )
+            status = out.get("status", "ERROR")
+            if status not in ["UNKNOWN", "RATELIMIT"]:
+                break
+            sleep_time = self.ratelimit_delay(out, attempt)
+            logger.warning(f"Sleeping for {sleep_time:.1f}s. Reason: {status}")
+            if self.rate_limiter is not None and status == "RATELIMIT":
+                # the next acquire() waits, together with all other workers of this host
+                self.rate_limiter.throttle(sleep_time)
+            else:
+                time.sleep(sleep_time)
+            attempt += 1
+
+        if status == "ERROR":
+            raise Exception(
+                f"MMseqs2 API is giving errors. Please confirm your input is a valid protein sequence. If error persists, please try again an hour later."
+            )
+        if status == "MAINTENANCE":
+            raise Exception(
+                f"MMseqs2 API is undergoing maintenance. Please try again in a few minutes."
+            )
+
+        ticket.id = out["id"]
+        ticket.status = status
+        ticket.submitted = time.time()
+        ticket.interval = self.poll_min
+        ticket.next_poll = ticket.submitted + ticket.interval
+        if ticket.journal is not None:
+            ticket.journal.submitted(ticket.key, ticket.id, ticket.mode)
+        return ticket
+
+    def resume(self, ticket: Ticket, ticket_id: str) -> bool:
+        """Continue with a ticket submitted by an earlier process, if the server still knows it"""
+        ticket.id = ticket_id
+        ticket.interval = self.poll_min
+        if self.status(ticket) in ["PENDING", "RUNNING", "COMPLETE"]:
+            logger.info(f"Resuming ticket {ticket_id} ({ticket.status})")
+            ticket.submitted = time.time()
+            return True
+        logger.info(f"Could not resume ticket {ticket_id} ({ticket.status})")
+        ticket.id = None
+        ticket.status = "UNKNOWN"
+        return False
+
+    def start(
+        self,
+        seqs: List[str],
+        mode: str,
+        use_pairing: bool = False,
+        journal: Optional[TicketJournal] = None,
+    ) -> Ticket:
+        """Submit a search, or resume it if it is in the journal"""
+        ticket = Ticket(seqs, mode, use_pairing, journal=journal)
+        if journal is not None:
+            ticket.key = journal.key(self.host_url, ticket.endpoint, mode, seqs)
+            ticket_id = journal.get(ticket.key)
+            if ticket_id is not None and self.resume(ticket, ticket_id):
+                return ticket
+        return self.submit(ticket)
+
+    def status(self, ticket: Ticket) -> str:
+        """Poll the ticket once and schedule its next poll"""
+        out = self.api_json("GET", f"ticket/{ticket.id}")
+        status = out.get("status", "ERROR")
+        if status == "RATELIMIT":
+            # keep the last known state, but wait longer before asking again
+            delay = self.ratelimit_delay(out, 1)
+            if self.rate_limiter is not None:
+                self.rate_limiter.throttle(delay)
+            ticket.interval = min(self.poll_max, max(ticket.interval * 2, delay))
+            logger.warning(f"Sleeping for {ticket.interval:.1f}s. Reason: {status}")
+        elif status != ticket.status:
+            ticket.interval = self.poll_min
+            ticket.status = status
+        else:
+            ticket.interval = min(self.poll_max, ticket.interval * self.poll_factor)
+        jitter = random.uniform(0, ticket.interval * 0.1)
+        ticket.next_poll = time.time() + ticket.interval + jitter
+        return ticket.status
+
+    def wait(
+        self,
+        tickets: List[Ticket],
+        callback: Optional[Callable[[Ticket], None]] = None,
+    ):
+        """Poll all tickets until they are complete
+
+        Tickets that end up in an unexpected state are resubmitted, a ticket in the ERROR
+        state raises. `callback` is called after every poll.
+        """
+        pending = [ticket for ticket in tickets if ticket.status != "COMPLETE"]
+        while pending:
+            ticket = min(pending, key=lambda t: t.next_poll)
+            delay = ticket.next_poll - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            status = self.status(ticket)
+            if callback is not None:
+                callback(ticket)
+            if status == "COMPLETE":
+                pending.remove(ticket)
+            elif status == "ERROR":
+                raise Exception(
+                    f"MMseqs2 API is giving errors. Please confirm your input is a valid protein sequence. If error persists, please try again an hour later."
+                )
+            elif status not in WAITING_STATES:
+                # something failed on the server side, need to resubmit
+                logger.warning(f"Resubmitting ticket {ticket.id}. Reason: {status}")
+                self.submit(ticket)
+
+    def open_download(self, ticket: Ticket) -> requests.Response:
+        """Start downloading the result tar.gz, the body is read through `response.raw`"""
+        res = self.request("GET", f"result/download/{ticket.id}", stream=True)
+        res.raw.decode_content = True
+        return res
+
+    def download(self, ticket: Ticket, path: Union[str, Path]):
+        res = self.request("GET", f"result/download/{ticket.id}")
+        with open(path, "wb") as out:
+            out.write(res.content)
+
+    def run(
+        self,
+        seqs: List[str],
+        mode: str,
+        use_pairing: bool = False,
+        callback: Optional[Callable[[Ticket], None]] = None,
+        journal: Optional[TicketJournal] = None,
+    ) -> Ticket:
+        """Submit (or resume) a search and wait until it is complete, without downloading it"""
+        ticket = self.start(seqs, mode, use_pairing, journal)
+        self.wait([ticket], callback)
+        return ticket
+
+    def search(
+        self,
+        seqs: List[str],
+        mode: str,
+        path: Union[str, Path],
+        use_pairing: bool = False,
+        callback: Optional[Callable[[Ticket], None]] = None,
+        journal: Optional[TicketJournal] = None,
+    ) -> Ticket:
+        """Submit a search, wait for it and download the resulting tar.gz to `path`"""
+        return self.search_many([(seqs, mode, path, use_pairing)], callback, journal)[0]
+
+    def search_many(
+        self,
+        searches: List[tuple],
+        callback: Optional[Callable[[Ticket], None]] = None,
+        journal: Optional[TicketJournal] = None,
+    ) -> List[Ticket]:
+        """Like `search`, but keeps all (seqs, mode, path, use_pairing) searches in flight at once"""
+        tickets = [
+            self.start(seqs, mode, use_pairing, journal)
+            for seqs, mode, _, use_pairing in searches
+        ]
+        self.wait(tickets, callback)
+        for ticket, (_, _, path, _) in zip(tickets, searches):
+            self.download(ticket, path)
+            if journal is not None:
+                journal.finished(ticket.key)
+        return tickets
+
+    def templates(self, pdb_ids: List[str], path: Union[str, Path]):
+        """Download the mmCIF files and pdb70 a3m database of the given template hits into `path`"""
+        response = self.request("GET", f"template/{','.join(pdb_ids)}", stream=True)
+        with tarfile.open(fileobj=response.raw, mode="r|gz") as tar:
+            tar.extractall(path=path)
+
+
+_clients: Dict[tuple, MMseqs2Client] = {}
+_rate_limiters: Dict[str, HostRateLimiter] = {}
+_clients_lock = threading.Lock()
+
+
+def set_rate_limit(host_url: str, rate: float, burst: float = 1.0):
+    """Limit the ticket requests of all processes on this host to `rate` per second, 0 disables the limit"""
+    with _clients_lock:
+        if rate > 0:
+            _rate_limiters[host_url] = HostRateLimiter(host_url, rate, burst)
+        else:
+            _rate_limiters.pop(host_url, None)
+        for (client_host_url, _), client in _clients.items():
+            if client_host_url == host_url:
+                client.rate_limiter = _rate_limiters.get(host_url)
+
+
+def set_client(
+    host_url: str, user_agent: str, client: Optional[MMseqs2Client]
+) -> Optional[MMseqs2Client]:
+    """Use `client` for the given server and user agent (None removes it), returns the one it replaces"""
+    with _clients_lock:
+        key = (host_url, user_agent)
+        previous = _clients.pop(key, None)
+        if client is not None:
+            _clients[key] = client
+        return previous
+
+
+def get_client(host_url: str, user_agent: str = "") -> MMseqs2Client:
+    """Returns a client shared by all callers with the same server and user agent, so connections are reused"""
+    with _clients_lock:
+        key = (host_url, user_agent)
+        if key not in _clients:
+            _clients[key] = MMseqs2Client(
+                host_url, user_agent, rate_limiter=_rate_limiters.get(host_url)
+            )
+        return _clients[key]
@@ -0,0 +1,441 @@
+"""
+Long-running local search service for the MSA server API, backed by the local databases.
+
+Answers ticket/msa, ticket/pair, ticket/{id} and result/download/{id} like the public server, so
+colabfold_batch --host-url http://localhost:8080 can use it directly. Tickets that arrive within
+--batch-wait seconds of each other are searched together (up to --batch-size sequences), with the
+mmseqs calls of colabfold_search. The databases stay mapped (and optionally paged in) for the
+lifetime of the service, so searches with --db-load-mode 2 don't read them from disk again.
+
+    colabfold_search_server /path/to/db_folder /tmp/search_server --port 8080 --threads 32
+
+Template searches are not supported, tickets with use_templates get no template hits.
+"""
+import json
+import logging
+import math
+import mmap
+import shutil
+import threading
+import time
+import uuid
+from argparse import ArgumentParser, Namespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from colabfold.mmseqs.db import MMseqsDB, data_files
+from colabfold.mmseqs.scheduler import SearchGraph
+from colabfold.mmseqs.search import (
+    mmseqs_search_monomer,
+    mmseqs_search_pair,
+    write_query_db,
+)
+from colabfold.mmseqs.server import make_tar_gz
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = mmap.PAGESIZE
+
+
+class SearchTicket:
+    def __init__(self, seqs: List[str], mode: str, use_pairing: bool):
+        self.id = uuid.uuid4().hex
+        self.seqs = seqs
+        self.mode = mode
+        self.use_pairing = use_pairing
+        self.submitted = time.time()
+        self.finished: Optional[float] = None
+        self.status = "PENDING"
+        self.result: Optional[bytes] = None
+
+    @property
+    def group(self) -> Tuple[bool, str]:
+        """Tickets in the same group can be searched together"""
+        return self.use_pairing, self.mode
+
+
+def database_files(dbbase: Path, db: Path) -> List[Path]:
+    """The files mmseqs reads for a search of db, the precomputed index if there is one"""
+    index = dbbase.joinpath(f"{db}.idx")
+    if index.is_file() or index.with_name(f"{index.name}.0").is_file():
+        return data_files(index)
+    files = []
+    for suffix in ["", "_seq", "_aln"]:
+        files += data_files(dbbase.joinpath(f"{db}{suffix}"))
+    return files
+
+
+def map_databases(files: List[Path], touch: bool = False) -> List[mmap.mmap]:
+    """Map the database files and ask the kernel to keep them in the page cache
+
+    With touch, every page is also read once, so the first searches don't wait for the disk.
+    """
+    maps = []
+    for path in files:
+        if path.stat().st_size == 0:
+            continue
+        with path.open("rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_WILLNEED"):
+            data.madvise(mmap.MADV_WILLNEED)
+        if touch:
+            for offset in range(0, len(data), PAGE_SIZE):
+                _ = data[offset]
+        maps.append(data)
+        logger.info(f"Mapped {path} ({len(data) / 1024**3:.1f} GB)")
+    return maps
+
+
+class SearchDaemon:
+    def __init__(
+        self,
+        args: Namespace,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        batch_wait: float = 1.0,
+        batch_size: int = 256,
+        result_ttl: float = 3600,
+    ):
+        """
+        args: search parameters with the names colabfold_search uses (mmseqs, dbbase, db1, db3,
+              db4, threads, max_parallel_tasks, db_load_mode, prefilter_mode, s, gpu, gpu_server,
+              expand_eval, align_eval, diff, qsc, max_accept) and base, the working directory
+        batch_wait: seconds to wait for more tickets after the first one of a batch arrived
+        batch_size: maximum number of sequences searched together
+        result_ttl: seconds that finished results are kept for download
+        """
+        self.args = args
+        self.batch_wait = batch_wait
+        self.batch_size = batch_size
+        self.result_ttl = result_ttl
+        self.tickets: Dict[str, SearchTicket] = {}
+        self.pending: List[SearchTicket] = []
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.batches = 0
+        self.maps: List[mmap.mmap] = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.threads: List[threading.Thread] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def warm(self, touch: bool = False):
+        files = []
+        for db in [self.args.db1, self.args.db3, self.args.db4]:
+            files += database_files(self.args.dbbase, db)
+        self.maps = map_databases(files, touch)
+
+    def start(self) -> "SearchDaemon":
+        self.threads = [
+            threading.Thread(target=self.httpd.serve_forever, daemon=True),
+            threading.Thread(target=self.work, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for data in self.maps:
+            data.close()
+
+    def __enter__(self) -> "SearchDaemon":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, seqs: List[str], mode: str, use_pairing: bool) -> SearchTicket:
+        ticket = SearchTicket(seqs, mode, use_pairing)
+        with self.condition:
+            self.tickets[ticket.id] = ticket
+            self.pending.append(ticket)
+            self.condition.notify_all()
+        return ticket
+
+    def next_batch(self) -> Optional[List[SearchTicket]]:
+        """Wait for tickets, then for batch_wait seconds or until a batch is full, and take the
+        oldest ticket with the tickets of its group that fit into the batch"""
+        with self.condition:
+            while not self.pending and not self.stopped:
+                self.condition.wait()
+            while not self.stopped:
+                first = self.pending[0]
+                group = [t for t in self.pending if t.group == first.group]
+                remaining = first.submitted + self.batch_wait - time.time()
+                if sum(len(t.seqs) for t in group) >= self.batch_size or remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if self.stopped:
+                return None
+            batch, num_seqs = [], 0
+            for ticket in group:
+                if batch and num_seqs + len(ticket.seqs) > self.batch_size:
+                    break
+                batch.append(ticket)
+                num_seqs += len(ticket.seqs)
+            for ticket in batch:
+                self.pending.remove(ticket)
+                ticket.status = "RUNNING"
+            return batch
+
+    def work(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            base = Path(self.args.base).joinpath(f"batch_{self.batches}")
+            self.batches += 1
+            logger.info(
+                f"Searching {sum(len(t.seqs) for t in batch)} sequences of {len(batch)} tickets"
+            )
+            try:
+                results = self.search(batch, base)
+            except Exception:
+                logger.exception(f"Search of {base} failed")
+                results = None
+            finally:
+                shutil.rmtree(base, ignore_errors=True)
+            with self.condition:
+                for ticket in batch:
+                    ticket.finished = time.time()
+                    if results is None:
+                        ticket.status = "ERROR"
+                    else:
+                        ticket.result = results[ticket.id]
+                        ticket.status = "COMPLETE"
+                self.expire()
+
+    def expire(self):
+        for ticket_id, ticket in list(self.tickets.items()):
+            if (
+                ticket.finished is not None
+                and time.time() - ticket.finished > self.result_ttl
+            ):
+                del self.tickets[ticket_id]
+
+    def search(self, batch: List[SearchTicket], base: Path) -> Dict[str, bytes]:
+        """Search the tickets of a batch and return their result tarballs"""
+        args = self.args
+        base.mkdir(parents=True)
+        # one job per ticket, the chains are named 101, 102, ... within each ticket
+        write_query_db(
+            args.mmseqs,
+            base,
+            "qdb",
+            [
+                (seq, 101 + j, ticket.id, file_number)
+                for file_number, ticket in enumerate(batch)
+                for j, seq in enumerate(ticket.seqs)
+            ],
+        )
+        use_pairing, mode = batch[0].group
+        use_env = "env" in mode
+        graph = SearchGraph()
+        if use_pairing:
+            for pair_env in [False, True] if use_env else [False]:
+                mmseqs_search_pair(
+                    mmseqs=args.mmseqs,
+                    dbbase=args.dbbase,
+                    base=base,
+                    uniref_db=args.db1,
+                    spire_db=args.db4,
+                    pair_env=pair_env,
+                    prefilter_mode=args.prefilter_mode,
+                    s=args.s,
+                    db_load_mode=args.db_load_mode,
+                    threads=args.threads,
+                    gpu=args.gpu,
+                    gpu_server=args.gpu_server,
+                    pairing_strategy=1 if mode.startswith("paircomplete") else 0,
+                    unpack=False,
+                    graph=graph,
+                )
+            result_dbs = ["pair.a3m", "pair_env.a3m"] if use_env else ["pair.a3m"]
+        else:
+            mmseqs_search_monomer(
+                mmseqs=args.mmseqs,
+                dbbase=args.dbbase,
+                base=base,
+                uniref_db=args.db1,
+                metagenomic_db=args.db3,
+                use_env=use_env,
+                use_templates=False,
+                filter="nofilter" not in mode,
+                expand_eval=args.expand_eval,
+                align_eval=args.align_eval,
+                diff=args.diff,
+                qsc=args.qsc,
+                max_accept=args.max_accept,
+                prefilter_mode=args.prefilter_mode,
+                s=args.s,
+                db_load_mode=args.db_load_mode,
+                threads=args.threads,
+                gpu=args.gpu,
+                gpu_server=args.gpu_server,
+                unpack=False,
+                graph=graph,
+            )
+            result_dbs = ["final.a3m"]
+        graph.run(args.mmseqs, args.threads, args.max_parallel_tasks)
+
+        dbs = [MMseqsDB(base.joinpath(name)) for name in result_dbs]
+        results = {}
+        key = 0
+        for ticket in batch:
+            records = []
+            for _ in ticket.seqs:
+                records.append("".join(db.get_text(key) for db in dbs) + "\x00")
+                key += 1
+            if use_pairing:
+                files = {"pair.a3m": "".join(records).encode()}
+            else:
+                # final.a3m contains the environmental hits already
+                files = {"uniref.a3m": "".join(records).encode(), "pdb70.m8": b""}
+                if use_env:
+                    files["bfd.mgnify30.metaeuk30.smag30.a3m"] = b""
+            results[ticket.id] = make_tar_gz(files)
+        for db in dbs:
+            db.close()
+        return results
+
+    def handle(self, handler: BaseHTTPRequestHandler, method: str):
+        path = handler.path.strip("/")
+        if method == "POST" and path in ["ticket/msa", "ticket/pair"]:
+            body = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+            form = parse_qs(body.decode())
+            query = form.get("q", [""])[0]
+            seqs = [
+                line for line in query.splitlines() if line and not line.startswith(">")
+            ]
+            if not seqs:
+                return self.reply_json(handler, {"status": "ERROR"})
+            ticket = self.submit(seqs, form.get("mode", [""])[0], path == "ticket/pair")
+            return self.reply_json(handler, {"id": ticket.id, "status": ticket.status})
+        elif path.startswith("ticket/"):
+            ticket = self.tickets.get(path.split("/")[1])
+            if ticket is None:
+                return self.reply_json(handler, {"status": "ERROR"})
+            return self.reply_json(handler, {"id": ticket.id, "status": ticket.status})
+        elif path.startswith("result/download/"):
+            ticket = self.tickets.get(path.split("/")[2])
+            if ticket is None or ticket.result is None:
+                return self.reply(handler, 404, b"", "text/plain")
+            return self.reply(handler, 200, ticket.result, "application/gzip")
+        return self.reply(handler, 404, b"", "text/plain")
+
+    def reply(
+        self, handler: BaseHTTPRequestHandler, code: int, data: bytes, content_type: str
+    ):
+        handler.send_response(code)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def reply_json(self, handler: BaseHTTPRequestHandler, out: dict):
+        self.reply(handler, 200, json.dumps(out).encode(), "application/json")
+
+
+def main():
+    parser = ArgumentParser(
+        description="Local MSA search service with the API of the ColabFold MSA server"
+    )
+    parser.add_argument(
+        "dbbase",
+        type=Path,
+        help="The path to the database and indices you downloaded and created with setup_databases.sh",
+    )
+    parser.add_argument(
+        "base", type=Path, help="Working directory for the searches of the service"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--batch-wait",
+        type=float,
+        default=1.0,
+        help="Seconds to wait for more tickets to search together with the first one",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="Maximum number of sequences that are searched together",
+    )
+    parser.add_argument(
+        "--result-ttl",
+        type=float,
+        default=3600,
+        help="Seconds that results are kept for download",
+    )
+    parser.add_argument(
+        "--touch",
+        action="store_true",
+        help="Read all database pages at startup, so that even the first searches don't wait for the disk",
+    )
+    parser.add_argument("--db1", type=Path, default=Path("uniref30_2302_db"))
+    parser.add_argument("--db3", type=Path, default=Path("colabfold_envdb_202108_db"))
+    parser.add_argument("--db4", type=Path, default=Path("spire_ctg10_2401_db"))
+    parser.add_argument("--mmseqs", type=Path, default=Path("mmseqs"))
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--max-parallel-tasks", type=int, default=1)
+    parser.add_argument("--db-load-mode", type=int, default=2)
+    parser.add_argument("--prefilter-mode", type=int, default=0, choices=[0, 1, 2])
+    parser.add_argument("-s", type=float, default=None)
+    parser.add_argument("--expand-eval", type=float, default=math.inf)
+    parser.add_argument("--align-eval", type=int, default=10)
+    parser.add_argument("--diff", type=int, default=3000)
+    parser.add_argument("--qsc", type=float, default=-20.0)
+    parser.add_argument("--max-accept", type=int, default=1000000)
+    parser.add_argument("--gpu", type=int, default=0, choices=[0, 1])
+    parser.add_argument("--gpu-server", type=int, default=0, choices=[0, 1])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    args.base.mkdir(parents=True, exist_ok=True)
+    daemon = SearchDaemon(
+        args,
+        args.host,
+        args.port,
+        batch_wait=args.batch_wait,
+        batch_size=args.batch_size,
+        result_ttl=args.result_ttl,
+    )
+    daemon.warm(args.touch)
+    daemon.start()
+    logger.info(f"Serving on {daemon.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
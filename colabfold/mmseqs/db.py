@@ -0,0 +1,222 @@
+"""
+Utilities for MMseqs2 databases: a data file (or data files `db.0`, `db.1`, ... that are read as one
+concatenated stream), `db.index` with `key\\toffset\\tlength` lines, `db.dbtype` and optionally
+`db.lookup` with `key\\tname\\tfile_number` lines.
+"""
+import mmap
+import shutil
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+
+def data_files(db: Union[str, Path]) -> List[Path]:
+    db = Path(db)
+    if db.is_file():
+        return [db]
+    files = []
+    while db.with_name(f"{db.name}.{len(files)}").is_file():
+        files.append(db.with_name(f"{db.name}.{len(files)}"))
+    return files
+
+
+def db_exists(db: Union[str, Path]) -> bool:
+    db = Path(db)
+    return db.with_name(f"{db.name}.dbtype").is_file()
+
+
+def read_index(db: Union[str, Path]) -> List[Tuple[int, int, int]]:
+    """(key, offset, length) of all entries, sorted by key"""
+    db = Path(db)
+    index = []
+    with db.with_name(f"{db.name}.index").open() as f:
+        for line in f:
+            key, offset, length = line.split("\t")
+            index.append((int(key), int(offset), int(length)))
+    index.sort()
+    return index
+
+
+def scan_index(data: Union[str, Path]) -> List[Tuple[int, int, int]]:
+    """(key, offset, length) of the null terminated entries of a data file that has no index,
+    numbered in file order"""
+    index = []
+    with open(data, "rb") as f:
+        size = Path(data).stat().st_size
+        if size == 0:
+            return index
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data_map:
+            start = 0
+            while start < size:
+                end = data_map.find(b"\x00", start)
+                # the last entry may lack its terminator
+                end = size - 1 if end == -1 else end
+                index.append((len(index), start, end + 1 - start))
+                start = end + 1
+    return index
+
+
+class DataReader:
+    """Reads entries by their offset in the (virtually concatenated) data files"""
+
+    def __init__(self, db: Union[str, Path]):
+        self.files = [open(path, "rb") for path in data_files(db)]
+        self.starts = []
+        start = 0
+        for f in self.files:
+            self.starts.append(start)
+            start += Path(f.name).stat().st_size
+
+    def read(self, offset: int, length: int) -> bytes:
+        for start, f in reversed(list(zip(self.starts, self.files))):
+            if offset >= start:
+                f.seek(offset - start)
+                return f.read(length)
+        raise ValueError(f"Offset {offset} is outside of the database")
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def __enter__(self) -> "DataReader":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MMseqsDB:
+    """Random access to the entries of a database by key, with the data files memory mapped
+
+    Entries are returned without the trailing null byte, i.e. as unpackdb would write them.
+    """
+
+    def __init__(
+        self,
+        db: Union[str, Path],
+        index: Optional[List[Tuple[int, int, int]]] = None,
+    ):
+        """index: (key, offset, length) of the entries, if not read from db.index"""
+        self.db = Path(db)
+        if index is None:
+            index = read_index(self.db)
+        self.index: Dict[int, Tuple[int, int]] = {
+            key: (offset, length) for key, offset, length in index
+        }
+        self.starts = []
+        self.maps = []
+        start = 0
+        for path in data_files(self.db):
+            size = path.stat().st_size
+            self.starts.append(start)
+            if size == 0:
+                self.maps.append(b"")
+            else:
+                with path.open("rb") as f:
+                    self.maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            start += size
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.index
+
+    def keys(self) -> Iterator[int]:
+        return iter(self.index)
+
+    def get(self, key: int, max_length: Optional[int] = None) -> bytes:
+        """The entry, or only its first max_length bytes"""
+        offset, length = self.index[key]
+        # an entry never spans two data files
+        file_number = bisect_right(self.starts, offset) - 1
+        start = offset - self.starts[file_number]
+        if max_length is not None and max_length < length:
+            return self.maps[file_number][start : start + max_length]
+        entry = self.maps[file_number][start : start + length]
+        if entry.endswith(b"\x00"):
+            entry = entry[:-1]
+        return entry
+
+    def get_text(self, key: int) -> str:
+        return self.get(key).decode()
+
+    def close(self):
+        for data in self.maps:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def __enter__(self) -> "MMseqsDB":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_lookup(lookup: Union[str, Path]) -> Dict[int, Tuple[str, int]]:
+    """key -> (name, file number)"""
+    entries = {}
+    with open(lookup) as f:
+        for line in f:
+            key, name, file_number = line.rstrip("\n").split("\t")
+            entries[int(key)] = (name, int(file_number))
+    return entries
+
+
+def merge_dbs(
+    dbs: List[Union[str, Path]], output: Union[str, Path], key_offsets: List[int]
+):
+    """Concatenate databases, adding key_offsets[i] to the keys of dbs[i]
+
+    Entries are written in key order, so merging the shards of a database gives the same
+    index and data as writing it in one go.
+    """
+    output = Path(output)
+    entries = []
+    with output.open("wb") as out:
+        position = 0
+        for db, key_offset in zip(dbs, key_offsets):
+            with DataReader(db) as reader:
+                for key, offset, length in read_index(db):
+                    out.write(reader.read(offset, length))
+                    entries.append(f"{key + key_offset}\t{position}\t{length}\n")
+                    position += length
+    output.with_name(f"{output.name}.index").write_text("".join(entries))
+    first = Path(dbs[0])
+    shutil.copyfile(
+        first.with_name(f"{first.name}.dbtype"),
+        output.with_name(f"{output.name}.dbtype"),
+    )
+    source = first.with_name(f"{first.name}.source")
+    if source.is_file():
+        shutil.copyfile(source, output.with_name(f"{output.name}.source"))
+
+
+def merge_lookups(
+    lookups: List[Union[str, Path]],
+    output: Union[str, Path],
+    key_offsets: List[int],
+    file_offsets: List[int],
+):
+    lines = []
+    for lookup, key_offset, file_offset in zip(lookups, key_offsets, file_offsets):
+        with open(lookup) as f:
+            for line in f:
+                key, name, file_number = line.rstrip("\n").split("\t")
+                lines.append(
+                    f"{int(key) + key_offset}\t{name}\t{int(file_number) + file_offset}\n"
+                )
+    Path(output).write_text("".join(lines))
+
+
+def merge_key_values(
+    files: List[Union[str, Path]], output: Union[str, Path], key_offsets: List[int]
+):
+    """Concatenate `key\\tvalue` files, adding key_offsets[i] to the keys of files[i]"""
+    lines = []
+    for path, key_offset in zip(files, key_offsets):
+        with open(path) as f:
+            for line in f:
+                key, value = line.rstrip("\n").split("\t", 1)
+                lines.append(f"{int(key) + key_offset}\t{value}\n")
+    Path(output).write_text("".join(lines))
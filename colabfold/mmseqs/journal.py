@@ -0,0 +1,93 @@
+"""
+Journal of the tickets submitted to the MSA server, so that a restarted process picks up its
+tickets where it left off instead of queueing the same search again.
+
+The journal is a JSON lines file that any number of processes append to under a file lock.
+Each line records the state of one search, identified by a hash of the server, endpoint, mode
+and query sequences; the last line of a search wins.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# rewrite the journal without finished searches once it has this many lines
+COMPACT_LINES = 1000
+
+
+class TicketJournal:
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    @staticmethod
+    def key(host_url: str, endpoint: str, mode: str, seqs: List[str]) -> str:
+        fields = [host_url, endpoint, mode, seqs]
+        return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+    @contextmanager
+    def lock(self):
+        with self.path.with_name(f".{self.path.name}.lock").open("w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self) -> List[dict]:
+        if not self.path.is_file():
+            return []
+        records = []
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # torn line of a killed process
+                    continue
+        return records
+
+    def _latest(self, records: List[dict]) -> Dict[str, dict]:
+        latest = {}
+        for record in records:
+            latest[record["key"]] = record
+        return latest
+
+    def _append(self, record: dict):
+        with self.lock():
+            with self.path.open("a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def get(self, key: str) -> Optional[str]:
+        """The ticket id of an unfinished search, if there is one"""
+        record = self._latest(self._read()).get(key)
+        if record is None or record["id"] is None:
+            return None
+        return record["id"]
+
+    def submitted(self, key: str, ticket_id: str, mode: str):
+        self._append(
+            {"key": key, "id": ticket_id, "mode": mode, "submitted": time.time()}
+        )
+
+    def finished(self, key: str):
+        self._append({"key": key, "id": None})
+        self.compact()
+
+    def compact(self):
+        with self.lock():
+            records = self._read()
+            if len(records) < COMPACT_LINES:
+                return
+            live = [r for r in self._latest(records).values() if r["id"] is not None]
+            tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+            tmp_path.write_text("".join(json.dumps(r) + "\n" for r in live))
+            os.replace(tmp_path, self.path)
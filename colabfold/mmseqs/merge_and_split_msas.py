@@ -7,7 +7,7 @@ from argparse import ArgumentParser
 from pathlib import Path
 from subprocess import check_call
 
-from tqdm import tqdm
+from colabfold.mmseqs.split_msas import split_msa
 
 logger = logging.getLogger(__name__)
 
@@ -27,14 +27,6 @@ def merge_msa(mmseqs: str = "mmseqs", cwd: Path = Path("..")):
     return Path(cwd).joinpath("merged.a3m")
 
 
-def split_msa(merged_msa: Path, output_folder: Path):
-    for msa in tqdm(merged_msa.read_text().split("\0")):
-        if not msa.strip():
-            continue
-        filename = msa.split("\n", 1)[0][1:].split(" ")[0] + ".a3m"
-        output_folder.joinpath(filename).write_text(msa)
-
-
 def main():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
 
@@ -48,6 +40,9 @@ def main():
     )
     parser.add_argument("output_folder", help="Will contain all the a3m files")
     parser.add_argument("--mmseqs", help="Path to the mmseqs2 binary", default="mmseqs")
+    parser.add_argument(
+        "--threads", type=int, default=1, help="Number of threads writing a3m files"
+    )
     args = parser.parse_args()
     output_folder = Path(args.output_folder)
     output_folder.mkdir(exist_ok=True)
@@ -55,7 +50,7 @@ def main():
     logger.info("Merging MSAs")
     merged_msa = merge_msa(args.mmseqs, Path(args.search_folder))
     logger.info("Splitting MSAs")
-    split_msa(merged_msa, output_folder)
+    split_msa(merged_msa, output_folder, threads=args.threads)
     logger.info("Done")
 
 
@@ -0,0 +1,82 @@
+"""
+Resource usage of the tasks of a colabfold_search run.
+
+run_mmseqs measures each mmseqs call it makes (the rusage of that one child process, so tasks
+running in parallel don't count each other), SearchGraph adds the task name and thread count,
+and search_queries writes the records to search_profile.json in its base directory together
+with a summary in the log.
+"""
+import json
+import logging
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Union
+
+from colabfold.mmseqs.db import data_files
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE = "search_profile.json"
+
+
+def max_rss_mb(ru_maxrss: int) -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == "darwin":
+        return ru_maxrss / 1024**2
+    return ru_maxrss / 1024
+
+
+def db_size(db: Union[str, Path]) -> int:
+    """Bytes of the data and index files of a database (or of a plain file)"""
+    db = Path(db)
+    files = data_files(db) + [db.with_name(f"{db.name}.index")]
+    return sum(path.stat().st_size for path in files if path.is_file())
+
+
+def summarize(records: List[Dict]) -> List[Dict]:
+    """Totals per mmseqs module (or task for the python tasks), the most expensive first"""
+    totals = defaultdict(
+        lambda: {
+            "calls": 0,
+            "skipped": 0,
+            "wall_time": 0.0,
+            "cpu_time": 0.0,
+            "max_rss_mb": 0.0,
+            "bytes_written": 0,
+        }
+    )
+    for record in records:
+        total = totals[record.get("module") or record["task"]]
+        total["calls"] += 1
+        total["skipped"] += int(record.get("skipped", False))
+        total["wall_time"] += record["wall_time"]
+        total["cpu_time"] += record.get("cpu_time") or 0.0
+        total["max_rss_mb"] = max(total["max_rss_mb"], record.get("max_rss_mb") or 0.0)
+        total["bytes_written"] += record.get("bytes_written") or 0
+    summary = [{"name": name, **total} for name, total in totals.items()]
+    summary.sort(key=lambda total: total["wall_time"], reverse=True)
+    return summary
+
+
+def format_summary(summary: List[Dict]) -> str:
+    lines = [
+        f"{'name':<16}{'calls':>6}{'skipped':>8}{'wall [s]':>10}{'cpu [s]':>10}"
+        f"{'max rss [MB]':>14}{'written [MB]':>14}"
+    ]
+    for total in summary:
+        lines.append(
+            f"{total['name']:<16}{total['calls']:>6}{total['skipped']:>8}"
+            f"{total['wall_time']:>10.1f}{total['cpu_time']:>10.1f}"
+            f"{total['max_rss_mb']:>14.0f}{total['bytes_written'] / 1024**2:>14.1f}"
+        )
+    return "\n".join(lines)
+
+
+def write_profile(records: List[Dict], base: Path):
+    summary = summarize(records)
+    with base.joinpath(PROFILE_FILE).open("w") as f:
+        json.dump({"tasks": records, "summary": summary}, f, indent=2)
+    logger.info(
+        f"Search profile (details in {base.joinpath(PROFILE_FILE)}):\n{format_summary(summary)}"
+    )
@@ -0,0 +1,116 @@
+"""
+Token bucket rate limiter shared by all processes on a host that talk to the same MSA server.
+
+The bucket lives in a small JSON file in a per-user directory of the temp directory and is updated
+under an exclusive file lock, so concurrent workers draw from one budget instead of each throttling
+on its own. If the file can't be used, the process falls back to a bucket of its own.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class HostRateLimiter:
+    def __init__(
+        self,
+        host_url: str,
+        rate: float,
+        burst: float = 1.0,
+        state_dir: Optional[Union[str, Path]] = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        rate: requests per second, summed over all processes of the host
+        burst: number of requests that may be sent at once after a quiet period
+        state_dir: directory of the shared state, by default colabfold-<uid> in the temp directory
+        """
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.clock = clock
+        self.sleep = sleep
+        if state_dir is None:
+            state_dir = Path(tempfile.gettempdir()).joinpath(f"colabfold-{os.getuid()}")
+        host_hash = hashlib.sha1(host_url.encode()).hexdigest()[:16]
+        self.path = Path(state_dir).joinpath(f"colabfold-ratelimit-{host_hash}.json")
+        # used instead of the file when it can't be opened
+        self.local_state: Optional[dict] = None
+        self.local_lock = threading.Lock()
+
+    def _refill(self, state: dict, now: float):
+        tokens = state.get("tokens", self.burst)
+        last = state.get("time", now)
+        state["tokens"] = min(self.burst, tokens + (now - last) * self.rate)
+        state["time"] = now
+        state.setdefault("not_before", 0.0)
+
+    def _update(self, update) -> float:
+        """Apply `update(state, now)` to the shared state, returns what it returns"""
+        if self.local_state is None:
+            try:
+                self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+                f = open(self.path, "a+")
+            except OSError as e:
+                logger.warning(
+                    f"Can't use {self.path} ({e}), rate limiting this process on its own"
+                )
+                self.local_state = {}
+            else:
+                with f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        f.seek(0)
+                        try:
+                            state = json.loads(f.read())
+                        except ValueError:
+                            state = {}
+                        now = self.clock()
+                        self._refill(state, now)
+                        result = update(state, now)
+                        f.seek(0)
+                        f.truncate()
+                        f.write(json.dumps(state))
+                        f.flush()
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+                return result
+        with self.local_lock:
+            now = self.clock()
+            self._refill(self.local_state, now)
+            return update(self.local_state, now)
+
+    def acquire(self):
+        """Block until the host may send one more request"""
+
+        def take(state, now) -> float:
+            if now < state["not_before"]:
+                return state["not_before"] - now
+            if state["tokens"] >= 1:
+                state["tokens"] -= 1
+                return 0.0
+            return (1 - state["tokens"]) / self.rate
+
+        while True:
+            delay = self._update(take)
+            if delay <= 0:
+                return
+            self.sleep(delay)
+
+    def throttle(self, delay: float):
+        """The server asked us to slow down, pause all workers of the host once and drain the bucket"""
+
+        def pause(state, now) -> float:
+            state["not_before"] = max(state["not_before"], now + delay)
+            state["tokens"] = 0.0
+            return 0.0
+
+        self._update(pause)
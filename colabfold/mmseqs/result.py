@@ -0,0 +1,104 @@
+"""
+Streaming reader for the result tarballs of the MSA server.
+
+The a3m members of a result are ffdata databases: one record per query, each starting with a `>{M}`
+header line and terminated by a `\\x00`. Records are parsed while the response is still being
+decompressed, so nothing needs to be extracted to disk.
+"""
+import tarfile
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+CHUNK_SIZE = 1 << 20
+
+
+class TeeReader:
+    """Copies everything that is read from `fileobj` into `out`"""
+
+    def __init__(self, fileobj: BinaryIO, out: BinaryIO):
+        self.fileobj = fileobj
+        self.out = out
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.out.write(data)
+        return data
+
+    def drain(self):
+        """tarfile stops reading before the end of the stream, copy the remainder"""
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def iter_a3m_records(fileobj: BinaryIO) -> Iterator[Tuple[int, str]]:
+    """Yields (M, a3m) for every `\\x00`-separated record of an a3m ffdata file"""
+    rest = b""
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        records = (rest + chunk).split(b"\x00")
+        # the last piece may continue in the next chunk
+        rest = records.pop() if chunk else b""
+        for record in records:
+            if record.strip() == b"":
+                continue
+            text = record.decode()
+            yield int(text[1 : text.index("\n")].rstrip()), text
+        if not chunk:
+            break
+
+
+def read_result(
+    fileobj: BinaryIO, a3m_names: List[str], keep: Optional[Union[str, Path]] = None
+) -> Tuple[Dict[int, str], Optional[str]]:
+    """Parse a result tar.gz stream into the a3m of each query and the template hits (pdb70.m8)
+
+    The a3m records of a query are concatenated in the order of `a3m_names`. If `keep` is set,
+    the compressed stream is also written to that path.
+    """
+    a3m_records = {name: {} for name in a3m_names}
+    m8 = None
+
+    out = None
+    if keep is not None:
+        keep = Path(keep)
+        tmp_path = keep.with_name(f".{keep.name}.tmp")
+        out = tmp_path.open("wb")
+        fileobj = TeeReader(fileobj, out)
+
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|gz") as tar:
+            for member in tar:
+                name = Path(member.name).name
+                if not member.isfile():
+                    continue
+                if name in a3m_records:
+                    records = a3m_records[name]
+                    for M, a3m in iter_a3m_records(tar.extractfile(member)):
+                        records[M] = records.get(M, "") + a3m
+                elif name == "pdb70.m8":
+                    m8 = tar.extractfile(member).read().decode()
+        if out is not None:
+            fileobj.drain()
+            out.close()
+            tmp_path.replace(keep)
+    finally:
+        if out is not None and not out.closed:
+            out.close()
+            tmp_path.unlink()
+
+    a3m_lines = {}
+    for name in a3m_names:
+        for M, a3m in a3m_records[name].items():
+            a3m_lines[M] = a3m_lines.get(M, "") + a3m
+    return a3m_lines, m8
+
+
+def parse_m8(m8: str) -> Dict[int, List[str]]:
+    """Template hits per query in the order of the file"""
+    templates = {}
+    for line in m8.splitlines():
+        p = line.rstrip().split()
+        if len(p) == 0:
+            continue
+        templates.setdefault(int(p[0]), []).append(p[1])
+    return templates
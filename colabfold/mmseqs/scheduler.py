@@ -0,0 +1,150 @@
+"""
+Dependency graph of the mmseqs calls of colabfold_search.
+
+Tasks are added in an order in which they could run one after another. Running the graph with
+max_parallel=1 reproduces exactly that order; with more slots, tasks whose dependencies are done
+run concurrently and the thread budget is split between the compute heavy ones.
+
+The resources used by each task are collected in SearchGraph.records.
+"""
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
+
+logger = logging.getLogger(__name__)
+
+
+class _Threads:
+    def __repr__(self):
+        return "THREADS"
+
+
+# placeholder in mmseqs parameters for the number of threads a task gets when it is started
+THREADS = _Threads()
+
+
+class Task:
+    def __init__(
+        self,
+        name: str,
+        params: Optional[List] = None,
+        function: Optional[Callable[[], None]] = None,
+        deps: Iterable[str] = (),
+    ):
+        self.name = name
+        self.params = params
+        self.function = function
+        self.deps = list(deps)
+
+    @property
+    def heavy(self) -> bool:
+        """Tasks that take --threads get a share of the thread budget, the others need (about) one"""
+        return self.params is not None and any(p is THREADS for p in self.params)
+
+
+class SearchGraph:
+    def __init__(self):
+        self.tasks: Dict[str, Task] = {}
+        self.skipped: Set[str] = set()
+        self.records: List[Dict[str, Any]] = []
+
+    def mmseqs(
+        self, name: str, params: List[Union[str, Path]], deps: Iterable[str] = ()
+    ) -> str:
+        """Add an mmseqs call, `THREADS` in params is replaced when the task starts"""
+        return self._add(Task(name, params=params, deps=deps))
+
+    def call(
+        self, name: str, function: Callable[[], None], deps: Iterable[str] = ()
+    ) -> str:
+        return self._add(Task(name, function=function, deps=deps))
+
+    def skip(self, name: str, tasks: Iterable[str] = ()):
+        """Record a stage that was not added because its results already exist
+
+        The stage and the given names of its tasks count as done for the tasks that depend on them.
+        """
+        self.skipped.update([name, *tasks])
+        self.records.append({"task": name, "skipped": True, "wall_time": 0.0})
+
+    def _add(self, task: Task) -> str:
+        if task.name in self.tasks:
+            raise ValueError(f"Duplicate task {task.name}")
+        self.tasks[task.name] = task
+        return task.name
+
+    def check(self):
+        """Raise if a task depends on a task that was neither added nor skipped"""
+        for task in self.tasks.values():
+            unknown = [
+                d for d in task.deps if d not in self.tasks and d not in self.skipped
+            ]
+            if unknown:
+                raise ValueError(f"{task.name} depends on unknown tasks {unknown}")
+
+    def run(self, mmseqs: Path, threads: int, max_parallel: int = 1):
+        """Run all tasks, dependencies on skipped stages count as done
+
+        A failing task stops new tasks from being started, the error is raised after the
+        tasks that are already running have finished.
+        """
+        from colabfold.mmseqs.search import run_mmseqs
+
+        self.check()
+
+        def execute(task: Task, task_threads: int) -> Dict[str, Any]:
+            start = time.time()
+            if task.function is not None:
+                task.function()
+                usage = {}
+            else:
+                params = [str(task_threads) if p is THREADS else p for p in task.params]
+                usage = run_mmseqs(mmseqs, params) or {}
+            return {
+                "task": task.name,
+                "threads": task_threads,
+                "wall_time": time.time() - start,
+                **usage,
+            }
+
+        pending = list(self.tasks.values())
+        done = set()
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+            while (pending and error is None) or running:
+                ready = [
+                    task
+                    for task in pending
+                    if all(d in done or d in self.skipped for d in task.deps)
+                ]
+                if error is None:
+                    # tasks started now share the budget with the heavy tasks already running
+                    heavy = sum(t.heavy for t in running.values()) + sum(
+                        t.heavy for t in ready
+                    )
+                    share = max(1, threads // max(1, min(max_parallel, heavy)))
+                    for task in ready[: max_parallel - len(running)]:
+                        pending.remove(task)
+                        task_threads = share if task.heavy else 1
+                        if max_parallel > 1:
+                            logger.info(
+                                f"Starting {task.name} with {task_threads} threads"
+                            )
+                        running[executor.submit(execute, task, task_threads)] = task
+                if not running:
+                    raise RuntimeError(
+                        f"Unsatisfiable dependencies: {[task.name for task in pending]}"
+                    )
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                    else:
+                        done.add(task.name)
+                        self.records.append(future.result())
+        if error is not None:
+            raise error
@@ -2,16 +2,24 @@
 Functionality for running mmseqs locally. Takes in a fasta file, outputs final.a3m
 """
 
+import hashlib
+import json
 import logging
 import math
 import os
 import shutil
 import subprocess
+import time
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from pathlib import Path
-from typing import List, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from colabfold.input import get_queries, msa_to_str, safe_filename
+from colabfold.input import SEARCH_DONE, get_queries, msa_to_str, safe_filename
+from colabfold.mmseqs.cache import renumber_a3m
+from colabfold.mmseqs.db import MMseqsDB, db_exists, merge_dbs, merge_key_values, merge_lookups
+from colabfold.mmseqs.profile import PROFILE_FILE, db_size, max_rss_mb, write_profile
+from colabfold.mmseqs.scheduler import THREADS, SearchGraph
+from colabfold.mmseqs.store import SearchStore, renumber_m8
 
 logger = logging.getLogger(__name__)
 
@@ -28,20 +36,35 @@ MODULE_OUTPUT_POS = {
     "search":       3,
 }
 
-def run_mmseqs(mmseqs: Path, params: List[Union[str, Path]]):
+def run_mmseqs(mmseqs: Path, params: List[Union[str, Path]]) -> Dict:
+    """Run an mmseqs module and return the resources it used"""
     module = params[0]
     if module in MODULE_OUTPUT_POS:
         output_pos = MODULE_OUTPUT_POS[module]
         output_path = Path(params[output_pos]).with_suffix('.dbtype')
         if output_path.exists():
             logger.info(f"Skipping {module} because {output_path} already exists")
-            return
+            return {"module": module, "skipped": True, "wall_time": 0.0}
 
     params_log = " ".join(str(i) for i in params)
     logger.info(f"Running {mmseqs} {params_log}")
     # hide MMseqs2 verbose paramters list that clogs up the log
     os.environ["MMSEQS_CALL_DEPTH"] = "1"
-    subprocess.check_call([mmseqs] + params)
+    start = time.time()
+    process = subprocess.Popen([mmseqs] + params)
+    # wait4 gives the usage of this process alone, even with other mmseqs calls running in parallel
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, [mmseqs] + params)
+    return {
+        "module": module,
+        "skipped": False,
+        "wall_time": time.time() - start,
+        "cpu_time": usage.ru_utime + usage.ru_stime,
+        "max_rss_mb": max_rss_mb(usage.ru_maxrss),
+        "bytes_written": db_size(params[MODULE_OUTPUT_POS[module]]) if module in MODULE_OUTPUT_POS else 0,
+    }
 
 
 def mmseqs_search_monomer(
@@ -66,12 +89,17 @@ def mmseqs_search_monomer(
     gpu: int = 0,
     gpu_server: int = 0,
     unpack: bool = True,
+    graph: Optional[SearchGraph] = None,
+    max_parallel: int = 1,
 ):
     """Run mmseqs with a local colabfold database set
 
     db1: uniprot db (UniRef30)
     db2: Template (unused by default)
     db3: metagenomic db (colabfold_envdb_202108 or bfd_mgy_colabfold, the former is preferred)
+
+    If graph is given, the mmseqs calls are only added to it and the caller runs the graph.
+    Otherwise they are run here, up to max_parallel at a time, sharing the threads.
     """
     if filter:
         # 0.1 was not used in benchmarks due to POSIX shell bug in line above
@@ -121,87 +149,105 @@ def mmseqs_search_monomer(
     filter_param = ["--filter-msa", str(filter), "--filter-min-enable", "1000", "--diff", str(diff), "--qid", "0.0,0.2,0.4,0.6,0.8,1.0", "--qsc", "0", "--max-seq-id", "0.95",]
     expand_param = ["--expansion-mode", "0", "-e", str(expand_eval), "--expand-filter-clusters", str(filter), "--max-seq-id", "0.95",]
 
+    run_graph = graph is None
+    if graph is None:
+        graph = SearchGraph()
+    T = THREADS
+    u, e, t = "uniref/", "env/", "templates/"
+
     if not base.joinpath("uniref.a3m").with_suffix('.a3m.dbtype').exists():
-        run_mmseqs(mmseqs, ["search", base.joinpath("qdb"), dbbase.joinpath(uniref_db), base.joinpath("res"), base.joinpath("tmp"), "--threads", str(threads)] + search_param)
-        run_mmseqs(mmseqs, ["mvdb", base.joinpath("tmp/latest/profile_1"), base.joinpath("prof_res")])
-        run_mmseqs(mmseqs, ["lndb", base.joinpath("qdb_h"), base.joinpath("prof_res_h")])
-        run_mmseqs(mmseqs, ["expandaln", base.joinpath("qdb"), dbbase.joinpath(f"{uniref_db}{dbSuffix1}"), base.joinpath("res"), dbbase.joinpath(f"{uniref_db}{dbSuffix2}"), base.joinpath("res_exp"), "--db-load-mode", str(db_load_mode), "--threads", str(threads)] + expand_param)
-        run_mmseqs(mmseqs, ["align", base.joinpath("prof_res"), dbbase.joinpath(f"{uniref_db}{dbSuffix1}"), base.joinpath("res_exp"), base.joinpath("res_exp_realign"), "--db-load-mode", str(db_load_mode), "-e", str(align_eval), "--max-accept", str(max_accept), "--threads", str(threads), "--alt-ali", "10", "-a"])
-        run_mmseqs(mmseqs, ["filterresult", base.joinpath("qdb"), dbbase.joinpath(f"{uniref_db}{dbSuffix1}"),
+        graph.mmseqs(u + "search", ["search", base.joinpath("qdb"), dbbase.joinpath(uniref_db), base.joinpath("res"), base.joinpath("tmp"), "--threads", T] + search_param)
+        graph.mmseqs(u + "prof_res", ["mvdb", base.joinpath("tmp/latest/profile_1"), base.joinpath("prof_res")], [u + "search"])
+        graph.mmseqs(u + "prof_res_h", ["lndb", base.joinpath("qdb_h"), base.joinpath("prof_res_h")], [u + "prof_res"])
+        graph.mmseqs(u + "expandaln", ["expandaln", base.joinpath("qdb"), dbbase.joinpath(f"{uniref_db}{dbSuffix1}"), base.joinpath("res"), dbbase.joinpath(f"{uniref_db}{dbSuffix2}"), base.joinpath("res_exp"), "--db-load-mode", str(db_load_mode), "--threads", T] + expand_param, [u + "search"])
+        graph.mmseqs(u + "align", ["align", base.joinpath("prof_res"), dbbase.joinpath(f"{uniref_db}{dbSuffix1}"), base.joinpath("res_exp"), base.joinpath("res_exp_realign"), "--db-load-mode", str(db_load_mode), "-e", str(align_eval), "--max-accept", str(max_accept), "--threads", T, "--alt-ali", "10", "-a"], [u + "prof_res", u + "expandaln"])
+        graph.mmseqs(u + "filterresult", ["filterresult", base.joinpath("qdb"), dbbase.joinpath(f"{uniref_db}{dbSuffix1}"),
                             base.joinpath("res_exp_realign"), base.joinpath("res_exp_realign_filter"), "--db-load-mode",
                             str(db_load_mode), "--qid", "0", "--qsc", str(qsc), "--diff", "0", "--threads",
-                            str(threads), "--max-seq-id", "1.0", "--filter-min-enable", "100"])
-        run_mmseqs(mmseqs, ["result2msa", base.joinpath("qdb"), dbbase.joinpath(f"{uniref_db}{dbSuffix1}"),
+                            T, "--max-seq-id", "1.0", "--filter-min-enable", "100"], [u + "align"])
+        graph.mmseqs(u + "result2msa", ["result2msa", base.joinpath("qdb"), dbbase.joinpath(f"{uniref_db}{dbSuffix1}"),
                             base.joinpath("res_exp_realign_filter"), base.joinpath("uniref.a3m"), "--msa-format-mode",
-                            "6", "--db-load-mode", str(db_load_mode), "--threads", str(threads)] + filter_param)
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_exp_realign_filter")])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_exp_realign")])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_exp")])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("res")])
+                            "6", "--db-load-mode", str(db_load_mode), "--threads", T] + filter_param, [u + "filterresult"])
+        for db in ["res_exp_realign_filter", "res_exp_realign", "res_exp", "res"]:
+            graph.mmseqs(u + f"rmdb_{db}", ["rmdb", base.joinpath(db)], [u + "result2msa"])
     else:
         logger.info(f"Skipping {uniref_db} search because uniref.a3m already exists")
+        graph.skip(u + "search", [u + "prof_res", u + "prof_res_h", u + "align", u + "result2msa"])
 
+    # the environmental and template searches only need the profile of the uniref search
     if use_env and not base.joinpath("bfd.mgnify30.metaeuk30.smag30.a3m").with_suffix('.a3m.dbtype').exists():
-        run_mmseqs(mmseqs, ["search", base.joinpath("prof_res"), dbbase.joinpath(metagenomic_db), base.joinpath("res_env"),
-                            base.joinpath("tmp3"), "--threads", str(threads)] + search_param)
-        run_mmseqs(mmseqs, ["expandaln", base.joinpath("prof_res"), dbbase.joinpath(f"{metagenomic_db}{dbSuffix1}"), base.joinpath("res_env"),
+        graph.mmseqs(e + "search", ["search", base.joinpath("prof_res"), dbbase.joinpath(metagenomic_db), base.joinpath("res_env"),
+                            base.joinpath("tmp3"), "--threads", T] + search_param, [u + "prof_res", u + "prof_res_h"])
+        graph.mmseqs(e + "expandaln", ["expandaln", base.joinpath("prof_res"), dbbase.joinpath(f"{metagenomic_db}{dbSuffix1}"), base.joinpath("res_env"),
                             dbbase.joinpath(f"{metagenomic_db}{dbSuffix2}"), base.joinpath("res_env_exp"), "-e", str(expand_eval),
-                            "--expansion-mode", "0", "--db-load-mode", str(db_load_mode), "--threads", str(threads)])
-        run_mmseqs(mmseqs, ["align", base.joinpath("tmp3/latest/profile_1"), dbbase.joinpath(f"{metagenomic_db}{dbSuffix1}"),
+                            "--expansion-mode", "0", "--db-load-mode", str(db_load_mode), "--threads", T], [e + "search"])
+        graph.mmseqs(e + "align", ["align", base.joinpath("tmp3/latest/profile_1"), dbbase.joinpath(f"{metagenomic_db}{dbSuffix1}"),
                             base.joinpath("res_env_exp"), base.joinpath("res_env_exp_realign"), "--db-load-mode",
                             str(db_load_mode), "-e", str(align_eval), "--max-accept", str(max_accept), "--threads",
-                            str(threads), "--alt-ali", "10", "-a"])
-        run_mmseqs(mmseqs, ["filterresult", base.joinpath("qdb"), dbbase.joinpath(f"{metagenomic_db}{dbSuffix1}"),
+                            T, "--alt-ali", "10", "-a"], [e + "expandaln"])
+        graph.mmseqs(e + "filterresult", ["filterresult", base.joinpath("qdb"), dbbase.joinpath(f"{metagenomic_db}{dbSuffix1}"),
                             base.joinpath("res_env_exp_realign"), base.joinpath("res_env_exp_realign_filter"),
                             "--db-load-mode", str(db_load_mode), "--qid", "0", "--qsc", str(qsc), "--diff", "0",
-                            "--max-seq-id", "1.0", "--threads", str(threads), "--filter-min-enable", "100"])
-        run_mmseqs(mmseqs, ["result2msa", base.joinpath("qdb"), dbbase.joinpath(f"{metagenomic_db}{dbSuffix1}"),
+                            "--max-seq-id", "1.0", "--threads", T, "--filter-min-enable", "100"], [e + "align"])
+        graph.mmseqs(e + "result2msa", ["result2msa", base.joinpath("qdb"), dbbase.joinpath(f"{metagenomic_db}{dbSuffix1}"),
                             base.joinpath("res_env_exp_realign_filter"),
                             base.joinpath("bfd.mgnify30.metaeuk30.smag30.a3m"), "--msa-format-mode", "6",
-                            "--db-load-mode", str(db_load_mode), "--threads", str(threads)] + filter_param)
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_env_exp_realign_filter")])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_env_exp_realign")])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_env_exp")])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_env")])
+                            "--db-load-mode", str(db_load_mode), "--threads", T] + filter_param, [e + "filterresult"])
+        for db in ["res_env_exp_realign_filter", "res_env_exp_realign", "res_env_exp", "res_env"]:
+            graph.mmseqs(e + f"rmdb_{db}", ["rmdb", base.joinpath(db)], [e + "result2msa"])
     elif use_env:
         logger.info(f"Skipping {metagenomic_db} search because bfd.mgnify30.metaeuk30.smag30.a3m already exists")
+        graph.skip(e + "search", [e + "expandaln", e + "align", e + "result2msa"])
 
     if use_templates and not base.joinpath(f"{template_db}.m8").with_suffix('.m8.dbtype').exists():
-        run_mmseqs(mmseqs, ["search", base.joinpath("prof_res"), dbbase.joinpath(template_db), base.joinpath("res_pdb"),
-                            base.joinpath("tmp2"), "--db-load-mode", str(db_load_mode), "--threads", str(threads), "-s", "7.5", "-a", "-e", "0.1", "--prefilter-mode", str(prefilter_mode)])
-        run_mmseqs(mmseqs, ["convertalis", base.joinpath("prof_res"), dbbase.joinpath(f"{template_db}{dbSuffix3}"), base.joinpath("res_pdb"),
+        graph.mmseqs(t + "search", ["search", base.joinpath("prof_res"), dbbase.joinpath(template_db), base.joinpath("res_pdb"),
+                            base.joinpath("tmp2"), "--db-load-mode", str(db_load_mode), "--threads", T, "-s", "7.5", "-a", "-e", "0.1", "--prefilter-mode", str(prefilter_mode)],
+                            [u + "prof_res", u + "prof_res_h"])
+        graph.mmseqs(t + "convertalis", ["convertalis", base.joinpath("prof_res"), dbbase.joinpath(f"{template_db}{dbSuffix3}"), base.joinpath("res_pdb"),
                             base.joinpath(f"{template_db}"), "--format-output",
                             "query,target,fident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,evalue,bits,cigar",
                             "--db-output", "1",
-                            "--db-load-mode", str(db_load_mode), "--threads", str(threads)])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_pdb")])
+                            "--db-load-mode", str(db_load_mode), "--threads", T], [t + "search"])
+        graph.mmseqs(t + "rmdb_res_pdb", ["rmdb", base.joinpath("res_pdb")], [t + "convertalis"])
     elif use_templates:
         logger.info(f"Skipping {template_db} search because {template_db}.m8 already exists")
+        graph.skip(t + "search", [t + "convertalis"])
 
     if use_env:
-        run_mmseqs(mmseqs, ["mergedbs", base.joinpath("qdb"), base.joinpath("final.a3m"), base.joinpath("uniref.a3m"), base.joinpath("bfd.mgnify30.metaeuk30.smag30.a3m")])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("bfd.mgnify30.metaeuk30.smag30.a3m")])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("uniref.a3m")])
+        graph.mmseqs("final", ["mergedbs", base.joinpath("qdb"), base.joinpath("final.a3m"), base.joinpath("uniref.a3m"), base.joinpath("bfd.mgnify30.metaeuk30.smag30.a3m")], [u + "result2msa", e + "result2msa"])
+        graph.mmseqs(e + "rmdb_a3m", ["rmdb", base.joinpath("bfd.mgnify30.metaeuk30.smag30.a3m")], ["final"])
+        graph.mmseqs(u + "rmdb_a3m", ["rmdb", base.joinpath("uniref.a3m")], ["final"])
     else:
-        run_mmseqs(mmseqs, ["mvdb", base.joinpath("uniref.a3m"), base.joinpath("final.a3m")])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("uniref.a3m")])
+        graph.mmseqs("final", ["mvdb", base.joinpath("uniref.a3m"), base.joinpath("final.a3m")], [u + "result2msa"])
+        graph.mmseqs(u + "rmdb_a3m", ["rmdb", base.joinpath("uniref.a3m")], ["final"])
 
     if unpack:
-        run_mmseqs(mmseqs, ["unpackdb", base.joinpath("final.a3m"), base.joinpath("."), "--unpack-name-mode", "0", "--unpack-suffix", ".a3m"])
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("final.a3m")])
+        graph.mmseqs("unpack", ["unpackdb", base.joinpath("final.a3m"), base.joinpath("."), "--unpack-name-mode", "0", "--unpack-suffix", ".a3m"], ["final"])
+        graph.mmseqs("rmdb_final", ["rmdb", base.joinpath("final.a3m")], ["unpack"])
 
         if use_templates:
-            run_mmseqs(mmseqs, ["unpackdb", base.joinpath(f"{template_db}"), base.joinpath("."), "--unpack-name-mode", "0", "--unpack-suffix", ".m8"])
-            if base.joinpath(f"{template_db}").exists():
-                run_mmseqs(mmseqs, ["rmdb", base.joinpath(f"{template_db}")])
+            graph.mmseqs(t + "unpack", ["unpackdb", base.joinpath(f"{template_db}"), base.joinpath("."), "--unpack-name-mode", "0", "--unpack-suffix", ".m8"], [t + "convertalis"])
+
+            def rmdb_templates():
+                if base.joinpath(f"{template_db}").exists():
+                    run_mmseqs(mmseqs, ["rmdb", base.joinpath(f"{template_db}")])
+            graph.call(t + "rmdb_m8", rmdb_templates, [t + "unpack"])
 
-    run_mmseqs(mmseqs, ["rmdb", base.joinpath("prof_res")])
-    run_mmseqs(mmseqs, ["rmdb", base.joinpath("prof_res_h")])
-    shutil.rmtree(base.joinpath("tmp"))
+    profile_users = [u + "align"]
+    if use_env:
+        profile_users += [e + "search", e + "expandaln"]
+    if use_templates:
+        profile_users += [t + "search", t + "convertalis"]
+    graph.mmseqs("rmdb_prof_res", ["rmdb", base.joinpath("prof_res")], profile_users)
+    graph.mmseqs("rmdb_prof_res_h", ["rmdb", base.joinpath("prof_res_h")], profile_users)
+    graph.call("rm_tmp", lambda: shutil.rmtree(base.joinpath("tmp")), [u + "prof_res"])
     if use_templates:
-        shutil.rmtree(base.joinpath("tmp2"))
+        graph.call(t + "rm_tmp", lambda: shutil.rmtree(base.joinpath("tmp2")), [t + "search"])
     if use_env:
-        shutil.rmtree(base.joinpath("tmp3"))
+        graph.call(e + "rm_tmp", lambda: shutil.rmtree(base.joinpath("tmp3")), [e + "align"])
+
+    if run_graph:
+        graph.run(mmseqs, threads, max_parallel)
 
 def mmseqs_search_pair(
     dbbase: Path,
@@ -218,7 +264,11 @@ def mmseqs_search_pair(
     db_load_mode: int = 2,
     pairing_strategy: int = 0,
     unpack: bool = True,
+    graph: Optional[SearchGraph] = None,
+    max_parallel: int = 1,
+    query_db: str = "qdb",
 ):
+    """Run the pairing searches for the chains in query_db, grouped into complexes by its lookup file"""
     if not dbbase.joinpath(f"{uniref_db}.dbtype").is_file():
         raise FileNotFoundError(f"Database {uniref_db} does not exist")
     if (
@@ -257,26 +307,349 @@ def mmseqs_search_pair(
     if gpu_server:
         search_param += ["--gpu-server", str(gpu_server)]
     expand_param = ["--expansion-mode", "0", "-e", "inf", "--expand-filter-clusters", "0", "--max-seq-id", "0.95",]
-    run_mmseqs(mmseqs, ["search", base.joinpath("qdb"), dbbase.joinpath(db), base.joinpath("res"), base.joinpath("tmp"), "--threads", str(threads),] + search_param,)
-    run_mmseqs(mmseqs, ["expandaln", base.joinpath("qdb"), dbbase.joinpath(f"{db}{dbSuffix1}"), base.joinpath("res"), dbbase.joinpath(f"{db}{dbSuffix2}"), base.joinpath("res_exp"), "--db-load-mode", str(db_load_mode), "--threads", str(threads),] + expand_param,)
-    run_mmseqs(mmseqs, ["align", base.joinpath("qdb"), dbbase.joinpath(f"{db}{dbSuffix1}"), base.joinpath("res_exp"), base.joinpath("res_exp_realign"), "--db-load-mode", str(db_load_mode), "-e", "0.001", "--max-accept", "1000000", "--threads", str(threads), "-c", "0.5", "--cov-mode", "1",],)
-    run_mmseqs(mmseqs, ["pairaln", base.joinpath("qdb"), dbbase.joinpath(f"{db}"), base.joinpath("res_exp_realign"), base.joinpath("res_exp_realign_pair"), "--db-load-mode", str(db_load_mode), "--pairing-mode", str(pairing_strategy), "--pairing-dummy-mode", "0", "--threads", str(threads), ],)
-    run_mmseqs(mmseqs, ["align", base.joinpath("qdb"), dbbase.joinpath(f"{db}{dbSuffix1}"), base.joinpath("res_exp_realign_pair"), base.joinpath("res_exp_realign_pair_bt"), "--db-load-mode", str(db_load_mode), "-e", "inf", "-a", "--threads", str(threads), ],)
-    run_mmseqs(mmseqs, ["pairaln", base.joinpath("qdb"), dbbase.joinpath(f"{db}"), base.joinpath("res_exp_realign_pair_bt"), base.joinpath("res_final"), "--db-load-mode", str(db_load_mode), "--pairing-mode", str(pairing_strategy), "--pairing-dummy-mode", "1", "--threads", str(threads),],)
-    run_mmseqs(mmseqs, ["result2msa", base.joinpath("qdb"), dbbase.joinpath(f"{db}{dbSuffix1}"), base.joinpath("res_final"), base.joinpath("pair.a3m"), "--db-load-mode", str(db_load_mode), "--msa-format-mode", "5", "--threads", str(threads),],)
+    # intermediates are named after the pairing database, so both pairing searches and the monomer search can run at the same time
+    run_graph = graph is None
+    if graph is None:
+        graph = SearchGraph()
+    T = THREADS
+    name = "pair_env" if pair_env else "pair"
+    n = f"{name}/"
+    res, tmp, pair_a3m = f"{name}_res", f"{name}_tmp", f"{name}.a3m"
+    graph.mmseqs(n + "search", ["search", base.joinpath(query_db), dbbase.joinpath(db), base.joinpath(res), base.joinpath(tmp), "--threads", T,] + search_param,)
+    graph.mmseqs(n + "expandaln", ["expandaln", base.joinpath(query_db), dbbase.joinpath(f"{db}{dbSuffix1}"), base.joinpath(res), dbbase.joinpath(f"{db}{dbSuffix2}"), base.joinpath(f"{res}_exp"), "--db-load-mode", str(db_load_mode), "--threads", T,] + expand_param, [n + "search"])
+    graph.mmseqs(n + "align", ["align", base.joinpath(query_db), dbbase.joinpath(f"{db}{dbSuffix1}"), base.joinpath(f"{res}_exp"), base.joinpath(f"{res}_exp_realign"), "--db-load-mode", str(db_load_mode), "-e", "0.001", "--max-accept", "1000000", "--threads", T, "-c", "0.5", "--cov-mode", "1",], [n + "expandaln"])
+    graph.mmseqs(n + "pairaln", ["pairaln", base.joinpath(query_db), dbbase.joinpath(f"{db}"), base.joinpath(f"{res}_exp_realign"), base.joinpath(f"{res}_exp_realign_pair"), "--db-load-mode", str(db_load_mode), "--pairing-mode", str(pairing_strategy), "--pairing-dummy-mode", "0", "--threads", T, ], [n + "align"])
+    graph.mmseqs(n + "align_bt", ["align", base.joinpath(query_db), dbbase.joinpath(f"{db}{dbSuffix1}"), base.joinpath(f"{res}_exp_realign_pair"), base.joinpath(f"{res}_exp_realign_pair_bt"), "--db-load-mode", str(db_load_mode), "-e", "inf", "-a", "--threads", T, ], [n + "pairaln"])
+    graph.mmseqs(n + "pairaln_dummy", ["pairaln", base.joinpath(query_db), dbbase.joinpath(f"{db}"), base.joinpath(f"{res}_exp_realign_pair_bt"), base.joinpath(f"{res}_final"), "--db-load-mode", str(db_load_mode), "--pairing-mode", str(pairing_strategy), "--pairing-dummy-mode", "1", "--threads", T,], [n + "align_bt"])
+    graph.mmseqs(n + "result2msa", ["result2msa", base.joinpath(query_db), dbbase.joinpath(f"{db}{dbSuffix1}"), base.joinpath(f"{res}_final"), base.joinpath(pair_a3m), "--db-load-mode", str(db_load_mode), "--msa-format-mode", "5", "--threads", T,], [n + "pairaln_dummy"])
     if unpack:
-        run_mmseqs(mmseqs, ["unpackdb", base.joinpath("pair.a3m"), base.joinpath("."), "--unpack-name-mode", "0", "--unpack-suffix", output,],)
-        run_mmseqs(mmseqs, ["rmdb", base.joinpath("pair.a3m")])
-    run_mmseqs(mmseqs, ["rmdb", base.joinpath("res")])
-    run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_exp")])
-    run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_exp_realign")])
-    run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_exp_realign_pair")])
-    run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_exp_realign_pair_bt")])
-    run_mmseqs(mmseqs, ["rmdb", base.joinpath("res_final")])
-    shutil.rmtree(base.joinpath("tmp"))
+        graph.mmseqs(n + "unpack", ["unpackdb", base.joinpath(pair_a3m), base.joinpath("."), "--unpack-name-mode", "0", "--unpack-suffix", output,], [n + "result2msa"])
+        graph.mmseqs(n + "rmdb_a3m", ["rmdb", base.joinpath(pair_a3m)], [n + "unpack"])
+    for db_name in [res, f"{res}_exp", f"{res}_exp_realign", f"{res}_exp_realign_pair", f"{res}_exp_realign_pair_bt", f"{res}_final"]:
+        graph.mmseqs(n + f"rmdb_{db_name}", ["rmdb", base.joinpath(db_name)], [n + "result2msa"])
+    graph.call(n + "rm_tmp", lambda: shutil.rmtree(base.joinpath(tmp)), [n + "search"])
+
+    if run_graph:
+        graph.run(mmseqs, threads, max_parallel)
     # @formatter:on
     # fmt: on
 
+def chain_layout(queries_unique: List, dedup: bool) -> Tuple[List[Tuple[str, int]], List[List[int]]]:
+    """Assign the chains of all jobs to entries of the query database
+
+    Returns (sequence, header number) of each entry and the entry of each chain of each job. With
+    dedup, a sequence that occurs in several jobs is searched once, under the header it had where
+    it occurred first. Otherwise every chain gets its own entry, named 101, 102, ... within its job.
+    """
+    entries, job_entries, seen = [], [], {}
+    for raw_jobname, query_sequences, query_seqs_cardinality in queries_unique:
+        job_entries.append([])
+        for j, seq in enumerate(query_sequences):
+            if not dedup or seq not in seen:
+                seen[seq] = len(entries)
+                entries.append((seq, 101 + j))
+            job_entries[-1].append(seen[seq])
+    return entries, job_entries
+
+
+def pair_layout(queries_unique: List) -> Tuple[List[List[str]], List[Optional[int]]]:
+    """Distinct chain combinations that need a paired MSA and the combination of each job"""
+    pair_jobs, job_pairs, seen = [], [], {}
+    for raw_jobname, query_sequences, query_seqs_cardinality in queries_unique:
+        if len(query_sequences) < 2:
+            job_pairs.append(None)
+            continue
+        if tuple(query_sequences) not in seen:
+            seen[tuple(query_sequences)] = len(pair_jobs)
+            pair_jobs.append(query_sequences)
+        job_pairs.append(seen[tuple(query_sequences)])
+    return pair_jobs, job_pairs
+
+
+def write_atomic(path: Path, text: str):
+    """Write a result so that readers of the directory never see a partial file"""
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def write_query_db(mmseqs: Path, base: Path, name: str, entries: List[Tuple[str, int, str, int]]):
+    """createdb from (sequence, header number, job name, file number) entries, with a lookup file
+    that groups the entries of a job for pairaln"""
+    query_file = base.joinpath(f"{name}.fas")
+    with query_file.open("w") as f:
+        for seq, header, raw_jobname, file_number in entries:
+            f.write(f">{header}\n{seq}\n")
+    run_mmseqs(
+        mmseqs,
+        ["createdb", query_file, base.joinpath(name), "--shuffle", "0"],
+    )
+    with base.joinpath(f"{name}.lookup").open("w") as f:
+        for id, (seq, header, raw_jobname, file_number) in enumerate(entries):
+            raw_jobname_first = raw_jobname.split()[0]
+            f.write(f"{id}\t{raw_jobname_first}\t{file_number}\n")
+    query_file.unlink()
+
+
+def search_queries(args, queries_unique: List, is_complex: bool, base: Path, store: Optional[SearchStore] = None):
+    """Search the queries of colabfold_search with all results and intermediate files in base
+
+    When the results are unpacked, a chain that occurs in several jobs is searched only once and
+    its results are copied to each job. The pairing searches get their own query database with
+    each distinct multi-chain combination, unless that would be the same as the monomer one.
+    With a store, the unpacked per-sequence results are also saved in it.
+    """
+    base.mkdir(exist_ok=True, parents=True)
+    entries, job_entries = chain_layout(queries_unique, dedup=bool(args.unpack))
+    first_job = {}
+    for job_number, chains in enumerate(job_entries):
+        for entry in chains:
+            first_job.setdefault(entry, job_number)
+    write_query_db(
+        args.mmseqs,
+        base,
+        "qdb",
+        [
+            (seq, header, queries_unique[first_job[entry]][0], first_job[entry])
+            for entry, (seq, header) in enumerate(entries)
+        ],
+    )
+    if len(entries) < sum(len(chains) for chains in job_entries):
+        logger.info(f"Searching {len(entries)} distinct chains of {sum(len(chains) for chains in job_entries)}")
+
+    pair_jobs, job_pairs = [], []
+    pair_db = "qdb"
+    if is_complex is True:
+        pair_jobs, job_pairs = pair_layout(queries_unique)
+        pair_entries = job_entries
+        if not args.unpack or (
+            [query_sequences for _, query_sequences, _ in queries_unique] == pair_jobs
+            and len(entries) == sum(len(chains) for chains in job_entries)
+        ):
+            # pair the jobs as they are in the monomer query database
+            job_pairs = [job_number if pair is not None else None for job_number, pair in enumerate(job_pairs)]
+        else:
+            pair_db = "pair_qdb"
+            pair_entries, pair_db_entries = [], []
+            for file_number, query_sequences in enumerate(pair_jobs):
+                pair_entries.append(list(range(len(pair_db_entries), len(pair_db_entries) + len(query_sequences))))
+                job_name = queries_unique[job_pairs.index(file_number)][0]
+                pair_db_entries += [(seq, 101 + j, job_name, file_number) for j, seq in enumerate(query_sequences)]
+            if len(pair_jobs) > 0:
+                write_query_db(args.mmseqs, base, pair_db, pair_db_entries)
+
+    # all searches go into one graph, so that independent branches can overlap
+    graph = SearchGraph()
+    mmseqs_search_monomer(
+        mmseqs=args.mmseqs,
+        dbbase=args.dbbase,
+        base=base,
+        uniref_db=args.db1,
+        template_db=args.db2,
+        metagenomic_db=args.db3,
+        use_env=args.use_env,
+        use_templates=args.use_templates,
+        filter=args.filter,
+        expand_eval=args.expand_eval,
+        align_eval=args.align_eval,
+        diff=args.diff,
+        qsc=args.qsc,
+        max_accept=args.max_accept,
+        prefilter_mode=args.prefilter_mode,
+        s=args.s,
+        db_load_mode=args.db_load_mode,
+        threads=args.threads,
+        gpu=args.gpu,
+        gpu_server=args.gpu_server,
+        unpack=False,
+        graph=graph,
+    )
+    if is_complex is True and (pair_db == "qdb" or len(pair_jobs) > 0):
+        mmseqs_search_pair(
+            mmseqs=args.mmseqs,
+            dbbase=args.dbbase,
+            base=base,
+            uniref_db=args.db1,
+            prefilter_mode=args.prefilter_mode,
+            s=args.s,
+            db_load_mode=args.db_load_mode,
+            threads=args.threads,
+            gpu=args.gpu,
+            gpu_server=args.gpu_server,
+            pairing_strategy=args.pairing_strategy,
+            pair_env=False,
+            unpack=False,
+            graph=graph,
+            query_db=pair_db,
+        )
+        if args.use_env_pairing:
+            mmseqs_search_pair(
+                mmseqs=args.mmseqs,
+                dbbase=args.dbbase,
+                base=base,
+                uniref_db=args.db1,
+                spire_db=args.db4,
+                prefilter_mode=args.prefilter_mode,
+                s=args.s,
+                db_load_mode=args.db_load_mode,
+                threads=args.threads,
+                gpu=args.gpu,
+                gpu_server=args.gpu_server,
+                pairing_strategy=args.pairing_strategy,
+                pair_env=True,
+                unpack=False,
+                graph=graph,
+                query_db=pair_db,
+            )
+    graph.run(args.mmseqs, args.threads, args.max_parallel_tasks)
+    write_profile(graph.records, base)
+
+    if args.unpack:
+        # read the results from the databases instead of unpacking a file per entry, and copy
+        # them to the jobs they belong to, renamed to the position of the chain in the job
+        result_dbs = ["final.a3m"]
+        if args.use_templates:
+            result_dbs.append(str(args.db2))
+        if is_complex is True and (pair_db == "qdb" or len(pair_jobs) > 0):
+            result_dbs.append("pair.a3m")
+            if args.use_env_pairing:
+                result_dbs.append("pair_env.a3m")
+        dbs = {name: MMseqsDB(base.joinpath(name)) for name in result_dbs}
+        for job_number, (raw_jobname, query_sequences, query_seqs_cardinality) in enumerate(queries_unique):
+            unpaired_msa = []
+            for j, (seq, entry) in enumerate(zip(query_sequences, job_entries[job_number])):
+                unpaired_msa.append(renumber_a3m(dbs["final.a3m"].get_text(entry), entries[entry][1], 101 + j))
+                if store is not None:
+                    store.put_unpaired(seq, unpaired_msa[-1], 101 + j)
+
+            if is_complex is True:
+                paired_msa = None
+                if job_pairs[job_number] is not None:
+                    paired_msa = []
+                    for entry in pair_entries[job_pairs[job_number]]:
+                        paired_msa.append(dbs["pair.a3m"].get_text(entry))
+                        if args.use_env_pairing:
+                            paired_msa[-1] += dbs["pair_env.a3m"].get_text(entry)
+                    if store is not None:
+                        store.put_paired(query_sequences, paired_msa)
+                msa = msa_to_str(
+                    unpaired_msa, paired_msa, query_sequences, query_seqs_cardinality
+                )
+            else:
+                msa = unpaired_msa[0]
+
+            # the a3m comes last, so a colabfold_batch --watch that sees it finds the m8 too
+            if args.use_templates:
+                with base.joinpath(f"{safe_filename(raw_jobname)}_{args.db2}.m8").open(
+                    "w"
+                ) as f:
+                    for j, (seq, entry) in enumerate(zip(query_sequences, job_entries[job_number])):
+                        m8 = ""
+                        if entry in dbs[str(args.db2)]:
+                            m8 = renumber_m8(dbs[str(args.db2)].get_text(entry), entries[entry][1], 101 + j)
+                        f.write(m8)
+                        if store is not None:
+                            store.put_m8(seq, m8, 101 + j)
+            write_atomic(base.joinpath(f"{safe_filename(raw_jobname)}.a3m"), msa)
+
+        for name, db in dbs.items():
+            db.close()
+            run_mmseqs(args.mmseqs, ["rmdb", base.joinpath(name)])
+        run_mmseqs(args.mmseqs, ["rmdb", base.joinpath("qdb")])
+        run_mmseqs(args.mmseqs, ["rmdb", base.joinpath("qdb_h")])
+    else:
+        # the copy number of each chain, which colabfold_batch needs to read the databases
+        with base.joinpath("qdb.cardinality").open("w") as f:
+            for job_number, (raw_jobname, query_sequences, query_seqs_cardinality) in enumerate(queries_unique):
+                for entry, cardinality in zip(job_entries[job_number], query_seqs_cardinality):
+                    f.write(f"{entry}\t{cardinality}\n")
+    if pair_db != "qdb" and len(pair_jobs) > 0:
+        run_mmseqs(args.mmseqs, ["rmdb", base.joinpath(pair_db)])
+        run_mmseqs(args.mmseqs, ["rmdb", base.joinpath(f"{pair_db}_h")])
+
+
+def search_fingerprint(args) -> str:
+    """Identifies the databases and parameters that the results of a search depend on"""
+    dbs = {}
+    for db in [args.db1, args.db2, args.db3, args.db4]:
+        index = args.dbbase.joinpath(f"{db}.index")
+        dbs[str(db)] = [index.stat().st_size, int(index.stat().st_mtime)] if index.is_file() else None
+    params = {key: getattr(args, key) for key in [
+        "use_env", "use_env_pairing", "use_templates", "filter", "expand_eval", "align_eval", "diff",
+        "qsc", "max_accept", "pairing_strategy", "prefilter_mode", "s", "gpu",
+    ]}
+    return hashlib.sha256(json.dumps([dbs, params], sort_keys=True).encode()).hexdigest()
+
+
+def write_stored_query(args, store: SearchStore, query: List, is_complex: bool):
+    """Write the results of a query from the store, as search_queries would have written them"""
+    raw_jobname, query_sequences, query_seqs_cardinality = query
+    unpaired_msa = [store.get_unpaired(seq, 101 + j) for j, seq in enumerate(query_sequences)]
+    if is_complex:
+        paired_msa = None
+        if len(query_seqs_cardinality) > 1:
+            paired_msa = store.get_paired(query_sequences)
+        msa = msa_to_str(unpaired_msa, paired_msa, query_sequences, query_seqs_cardinality)
+    else:
+        msa = unpaired_msa[0]
+    if args.use_templates:
+        args.base.joinpath(f"{safe_filename(raw_jobname)}_{args.db2}.m8").write_text(
+            "".join(store.get_m8(seq, 101 + j) for j, seq in enumerate(query_sequences))
+        )
+    write_atomic(args.base.joinpath(f"{safe_filename(raw_jobname)}.a3m"), msa)
+
+
+def search_shards(args, queries_unique: List, is_complex: bool, store: Optional[SearchStore] = None):
+    """Search the queries in shards of --shard-size jobs, each in its own directory under base/shards
+
+    Finished shards are skipped when the search is restarted. The outputs are the same as those of a
+    search of all queries at once: unpacked a3m/m8 files are moved to base, databases are merged with
+    their keys (and lookup file numbers) continuing where the previous shard ended.
+    """
+    shards_dir = args.base.joinpath("shards")
+    shard_bases, key_offsets, file_offsets = [], [], []
+    num_seqs = 0
+    for shard_number, start in enumerate(range(0, len(queries_unique), args.shard_size)):
+        shard = queries_unique[start:start + args.shard_size]
+        shard_base = shards_dir.joinpath(f"shard_{shard_number}")
+        shard_bases.append(shard_base)
+        key_offsets.append(num_seqs)
+        file_offsets.append(start)
+        num_seqs += sum(len(query_sequences) for _, query_sequences, _ in shard)
+
+        done_marker = shard_base.joinpath("shard.done")
+        if done_marker.is_file():
+            logger.info(f"Skipping shard {shard_number} because it is already done")
+            continue
+        logger.info(f"Searching shard {shard_number} ({len(shard)} queries)")
+        search_queries(args, shard, is_complex, shard_base, store)
+        if shard_base.joinpath(PROFILE_FILE).is_file():
+            os.replace(shard_base.joinpath(PROFILE_FILE), args.base.joinpath(f"search_profile_shard_{shard_number}.json"))
+        if args.unpack:
+            # in query order, each m8 before its a3m
+            for raw_jobname, _, _ in shard:
+                names = [f"{safe_filename(raw_jobname)}.a3m"]
+                if args.use_templates:
+                    names.insert(0, f"{safe_filename(raw_jobname)}_{args.db2}.m8")
+                for name in names:
+                    if shard_base.joinpath(name).is_file():
+                        os.replace(shard_base.joinpath(name), args.base.joinpath(name))
+        done_marker.touch()
+
+    if not args.unpack:
+        dbs = ["qdb", "qdb_h", "final.a3m", "pair.a3m", "pair_env.a3m"]
+        if args.use_templates:
+            dbs.append(str(args.db2))
+        for db in dbs:
+            if not db_exists(shard_bases[0].joinpath(db)):
+                continue
+            merge_dbs([shard_base.joinpath(db) for shard_base in shard_bases], args.base.joinpath(db), key_offsets)
+        merge_lookups([shard_base.joinpath("qdb.lookup") for shard_base in shard_bases],
+                      args.base.joinpath("qdb.lookup"), key_offsets, file_offsets)
+        merge_key_values([shard_base.joinpath("qdb.cardinality") for shard_base in shard_bases],
+                         args.base.joinpath("qdb.cardinality"), key_offsets)
+    shutil.rmtree(shards_dir)
+
 def main():
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument(
@@ -381,11 +754,33 @@ def main():
         help="Database preload mode 0: auto, 1: fread, 2: mmap, 3: mmap+touch",
     )
     parser.add_argument(
-        "--unpack", type=int, default=1, choices=[0, 1], help="Unpack results to loose files or keep MMseqs2 databases."
+        "--unpack", type=int, default=1, choices=[0, 1], help="Unpack results to loose files or keep MMseqs2 databases. colabfold_batch reads the databases if given final.a3m as input."
     )
     parser.add_argument(
         "--threads", type=int, default=64, help="Number of threads to use."
     )
+    parser.add_argument(
+        "--store",
+        type=Path,
+        default=None,
+        help="Directory of a persistent store of finished results. Queries whose results are in the store are not searched again, "
+        "the results of new queries are added to it. Results are only reused for the same databases and search parameters. Requires --unpack 1.",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=0,
+        help="Search the queries in shards of this many jobs, one after another, to bound the tmp space and memory use. "
+        "Finished shards are skipped when the search is restarted. 0 searches all queries at once. "
+        "The results of each shard appear in base as soon as it is done, in query order, so colabfold_batch --watch can predict them while the search continues.",
+    )
+    parser.add_argument(
+        "--max-parallel-tasks",
+        type=int,
+        default=1,
+        help="Number of independent mmseqs calls (e.g. the environmental, template and pairing searches) that may run at the same time. "
+        "--threads is split between the concurrently running searches.",
+    )
     parser.add_argument(
         "--gpu", type=int, default=0, choices=[0, 1], help="Whether to use GPU (1) or not (0). Control number of GPUs with CUDA_VISIBLE_DEVICES env var."
     )
@@ -416,150 +811,34 @@ def main():
         queries_unique.append([raw_jobname, query_seqs_unique, query_seqs_cardinality])
 
     args.base.mkdir(exist_ok=True, parents=True)
-    query_file = args.base.joinpath("query.fas")
-    with query_file.open("w") as f:
-        for job_number, (
-            raw_jobname,
-            query_sequences,
-            query_seqs_cardinality,
-        ) in enumerate(queries_unique):
-            for j, seq in enumerate(query_sequences):
-                # The header of first sequence set as 101
-                query_seq_headername = 101 + j
-                f.write(f">{query_seq_headername}\n{seq}\n")
-
-    run_mmseqs(
-        args.mmseqs,
-        ["createdb", query_file, args.base.joinpath("qdb"), "--shuffle", "0"],
-    )
-    with args.base.joinpath("qdb.lookup").open("w") as f:
-        id = 0
-        file_number = 0
-        for job_number, (
-            raw_jobname,
-            query_sequences,
-            query_seqs_cardinality,
-        ) in enumerate(queries_unique):
-            for seq in query_sequences:
-                raw_jobname_first = raw_jobname.split()[0]
-                f.write(f"{id}\t{raw_jobname_first}\t{file_number}\n")
-                id += 1
-            file_number += 1
-
-    mmseqs_search_monomer(
-        mmseqs=args.mmseqs,
-        dbbase=args.dbbase,
-        base=args.base,
-        uniref_db=args.db1,
-        template_db=args.db2,
-        metagenomic_db=args.db3,
-        use_env=args.use_env,
-        use_templates=args.use_templates,
-        filter=args.filter,
-        expand_eval=args.expand_eval,
-        align_eval=args.align_eval,
-        diff=args.diff,
-        qsc=args.qsc,
-        max_accept=args.max_accept,
-        prefilter_mode=args.prefilter_mode,
-        s=args.s,
-        db_load_mode=args.db_load_mode,
-        threads=args.threads,
-        gpu=args.gpu,
-        gpu_server=args.gpu_server,
-        unpack=args.unpack,
-    )
-    if is_complex is True:
-        mmseqs_search_pair(
-            mmseqs=args.mmseqs,
-            dbbase=args.dbbase,
-            base=args.base,
-            uniref_db=args.db1,
-            prefilter_mode=args.prefilter_mode,
-            s=args.s,
-            db_load_mode=args.db_load_mode,
-            threads=args.threads,
-            gpu=args.gpu,
-            gpu_server=args.gpu_server,
-            pairing_strategy=args.pairing_strategy,
-            pair_env=False,
-            unpack=args.unpack,
-        )
-        if args.use_env_pairing:
-            mmseqs_search_pair(
-                mmseqs=args.mmseqs,
-                dbbase=args.dbbase,
-                base=args.base,
-                uniref_db=args.db1,
-                spire_db=args.db4,
-                prefilter_mode=args.prefilter_mode,
-                s=args.s,
-                db_load_mode=args.db_load_mode,
-                threads=args.threads,
-                gpu=args.gpu,
-                gpu_server=args.gpu_server,
-                pairing_strategy=args.pairing_strategy,
-                pair_env=True,
-                unpack=args.unpack,
-            )
-
-        if args.unpack:
-            id = 0
-            for job_number, (
-                raw_jobname,
-                query_sequences,
-                query_seqs_cardinality,
-            ) in enumerate(queries_unique):
-                unpaired_msa = []
-                paired_msa = None
-                if len(query_seqs_cardinality) > 1:
-                    paired_msa = []
-                for seq in query_sequences:
-                    with args.base.joinpath(f"{id}.a3m").open("r") as f:
-                        unpaired_msa.append(f.read())
-                    args.base.joinpath(f"{id}.a3m").unlink()
-
-                    if args.use_env_pairing:
-                        with open(args.base.joinpath(f"{id}.paired.a3m"), 'a') as file_pair:
-                            with open(args.base.joinpath(f"{id}.env.paired.a3m"), 'r') as file_pair_env:
-                                while chunk := file_pair_env.read(10 * 1024 * 1024):
-                                    file_pair.write(chunk)
-                        args.base.joinpath(f"{id}.env.paired.a3m").unlink()
-
-                    if len(query_seqs_cardinality) > 1:
-                        with args.base.joinpath(f"{id}.paired.a3m").open("r") as f:
-                            paired_msa.append(f.read())
-                    args.base.joinpath(f"{id}.paired.a3m").unlink()
-                    id += 1
-                msa = msa_to_str(
-                    unpaired_msa, paired_msa, query_sequences, query_seqs_cardinality
-                )
-                args.base.joinpath(f"{job_number}.a3m").write_text(msa)
-
-    if args.unpack:
-        # rename a3m files
-        for job_number, (raw_jobname, query_sequences, query_seqs_cardinality) in enumerate(queries_unique):
-            os.rename(
-                args.base.joinpath(f"{job_number}.a3m"),
-                args.base.joinpath(f"{safe_filename(raw_jobname)}.a3m"),
-            )
-
-        # rename m8 files
-        if args.use_templates:
-            id = 0
-            for raw_jobname, query_sequences, query_seqs_cardinality in queries_unique:
-                with args.base.joinpath(f"{safe_filename(raw_jobname)}_{args.db2}.m8").open(
-                    "w"
-                ) as f:
-                    for _ in range(len(query_seqs_cardinality)):
-                        with args.base.joinpath(f"{id}.m8").open("r") as g:
-                            f.write(g.read())
-                        os.remove(args.base.joinpath(f"{id}.m8"))
-                        id += 1
-        run_mmseqs(args.mmseqs, ["rmdb", args.base.joinpath("qdb")])
-        run_mmseqs(args.mmseqs, ["rmdb", args.base.joinpath("qdb_h")])
+    args.base.joinpath(SEARCH_DONE).unlink(missing_ok=True)
+
+    store = None
+    stored_queries = []
+    if args.store is not None:
+        if not args.unpack:
+            raise ValueError("--store requires --unpack 1")
+        store = SearchStore(args.store, search_fingerprint(args))
+        missing_queries = []
+        for query in queries_unique:
+            use_pairing = is_complex and len(query[1]) > 1
+            if store.has_job(query[1], use_pairing, args.use_templates):
+                stored_queries.append(query)
+            else:
+                missing_queries.append(query)
+        logger.info(f"{len(stored_queries)} queries are in the store, searching {len(missing_queries)}")
+        queries_unique = missing_queries
+
+    if len(queries_unique) > 0:
+        if args.shard_size > 0:
+            search_shards(args, queries_unique, is_complex, store)
+        else:
+            search_queries(args, queries_unique, is_complex, args.base, store)
 
-    query_file.unlink()
+    for query in stored_queries:
+        write_stored_query(args, store, query, is_complex)
+    # tells colabfold_batch --watch that no more results will appear
+    args.base.joinpath(SEARCH_DONE).touch()
 
 
 if __name__ == "__main__":
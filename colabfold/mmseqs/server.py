@@ -0,0 +1,342 @@
+"""
+Local stand-in for the MSA server API, for testing and load testing the client offline.
+
+Implements ticket/msa, ticket/pair, ticket/{id}, result/download/{id} and template/{ids}. Known
+queries are answered with the canned responses in test-data/mmseqs-api-reponses, other queries
+get a small synthetic MSA. Latency, ticket run time, dropped connections and RATELIMIT replies
+can be configured.
+
+    python -m colabfold.mmseqs.server --port 8080 --run-time 2 --ratelimit-rate 0.1
+"""
+import hashlib
+import io
+import json
+import logging
+import random
+import tarfile
+import threading
+import time
+import uuid
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs
+
+from colabfold.mmseqs.cache import renumber_a3m
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_DIR = (
+    Path(__file__).parents[2].joinpath("test-data", "mmseqs-api-reponses")
+)
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def load_canned_responses(
+    data_dir: Union[str, Path]
+) -> Tuple[Dict[tuple, str], Dict[tuple, List[str]]]:
+    """Unpaired MSAs by (sequence, use_env) and paired MSAs by (sequences, use_env), with the query named >101"""
+    unpaired, paired = {}, {}
+    data_dir = Path(data_dir)
+    if not data_dir.is_dir():
+        return unpaired, paired
+    for data_file in sorted(data_dir.glob("*.json")):
+        for saved in json.loads(data_file.read_text()):
+            config = saved["config"]
+            if config.get("use_templates"):
+                continue
+            a3ms = [
+                "\n".join(lines) + "\n" if isinstance(lines, list) else lines
+                for lines in saved["response"]
+            ]
+            use_env = config["use_env"] or len(config["query"]) > 1
+            if config["use_pairing"]:
+                paired[(tuple(config["query"]), use_env)] = [
+                    renumber_a3m(a3m, 101 + i, 101) for i, a3m in enumerate(a3ms)
+                ]
+            else:
+                for i, (seq, a3m) in enumerate(zip(config["query"], a3ms)):
+                    unpaired[(seq, use_env)] = renumber_a3m(a3m, 101 + i, 101)
+    return unpaired, paired
+
+
+def synthetic_a3m(seq: str, depth: int, seed: str) -> str:
+    """The query and `depth` deterministic point mutants of it"""
+    rng = random.Random(hashlib.sha1(f"{seed}{seq}".encode()).hexdigest())
+    lines = [f">101\n{seq}\n"]
+    for i in range(depth):
+        hit = [aa if rng.random() > 0.3 else rng.choice(AMINO_ACIDS) for aa in seq]
+        lines.append(f">mock_{i}\n{''.join(hit)}\n")
+    return "".join(lines)
+
+
+def template_hits(seq: str, num_templates: int) -> List[str]:
+    seq_hash = hashlib.sha1(seq.encode()).hexdigest()
+    return [f"{i}{seq_hash[:3]}_A" for i in range(1, num_templates + 1)]
+
+
+def make_tar_gz(files: Dict[str, bytes]) -> bytes:
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:gz") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+class MockTicket:
+    def __init__(self, seqs: List[str], mode: str, use_pairing: bool, run_time: float):
+        self.id = uuid.uuid4().hex
+        self.seqs = seqs
+        self.mode = mode
+        self.use_pairing = use_pairing
+        self.done = time.time() + run_time
+
+
+class MockMSAServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        data_dir: Union[str, Path] = DEFAULT_DATA_DIR,
+        latency: float = 0.0,
+        run_time: float = 0.0,
+        failure_rate: float = 0.0,
+        ratelimit_rate: float = 0.0,
+        retry_after: Optional[float] = None,
+        num_templates: int = 0,
+        msa_depth: int = 16,
+        seed: int = 0,
+    ):
+        """
+        latency: seconds before each reply
+        run_time: seconds a ticket stays RUNNING
+        failure_rate: fraction of requests whose connection is dropped without a reply
+        ratelimit_rate: fraction of ticket submissions and polls answered with RATELIMIT
+        retry_after: Retry-After header sent with RATELIMIT replies
+        num_templates: template hits reported per query
+        """
+        self.latency = latency
+        self.run_time = run_time
+        self.failure_rate = failure_rate
+        self.ratelimit_rate = ratelimit_rate
+        self.retry_after = retry_after
+        self.num_templates = num_templates
+        self.msa_depth = msa_depth
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.unpaired, self.paired = load_canned_responses(data_dir)
+        self.tickets: Dict[str, MockTicket] = {}
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.bytes_sent = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockMSAServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "MockMSAServer":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def chance(self, rate: float) -> bool:
+        with self.lock:
+            return self.rng.random() < rate
+
+    def handle(self, handler: BaseHTTPRequestHandler, method: str):
+        path = handler.path.strip("/")
+        body = b""
+        if method == "POST":
+            body = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+        if path in ["ticket/msa", "ticket/pair"]:
+            endpoint = "submit"
+        elif path.startswith("ticket/"):
+            endpoint = "status"
+        else:
+            endpoint = path.split("/")[0]
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if self.chance(self.failure_rate):
+            # the client sees a dropped connection
+            handler.close_connection = True
+            return
+
+        if path in ["ticket/msa", "ticket/pair"]:
+            if self.chance(self.ratelimit_rate):
+                return self.reply_ratelimit(handler)
+            form = parse_qs(body.decode())
+            query = form.get("q", [""])[0]
+            seqs = [line for line in query.splitlines() if not line.startswith(">")]
+            ticket = MockTicket(
+                seqs, form.get("mode", [""])[0], path == "ticket/pair", self.run_time
+            )
+            with self.lock:
+                self.tickets[ticket.id] = ticket
+            return self.reply_json(handler, {"id": ticket.id, "status": "PENDING"})
+        elif path.startswith("ticket/"):
+            if self.chance(self.ratelimit_rate):
+                return self.reply_ratelimit(handler)
+            ticket = self.tickets.get(path.split("/")[1])
+            if ticket is None:
+                return self.reply_json(handler, {"status": "ERROR"})
+            status = "COMPLETE" if time.time() >= ticket.done else "RUNNING"
+            return self.reply_json(handler, {"id": ticket.id, "status": status})
+        elif path.startswith("result/download/"):
+            ticket = self.tickets.get(path.split("/")[2])
+            if ticket is None:
+                return self.reply(handler, 404, b"", "text/plain")
+            return self.reply(handler, 200, self.result(ticket), "application/gzip")
+        elif path.startswith("template/"):
+            hits = [hit for hit in path.split("/", 1)[1].split(",") if hit]
+            return self.reply(handler, 200, self.templates(hits), "application/gzip")
+        return self.reply(handler, 404, b"", "text/plain")
+
+    def reply(
+        self,
+        handler: BaseHTTPRequestHandler,
+        code: int,
+        data: bytes,
+        content_type: str,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        handler.send_response(code)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+        with self.lock:
+            self.bytes_sent += len(data)
+
+    def reply_json(self, handler: BaseHTTPRequestHandler, out: dict, headers=None):
+        self.reply(handler, 200, json.dumps(out).encode(), "application/json", headers)
+
+    def reply_ratelimit(self, handler: BaseHTTPRequestHandler):
+        headers = {}
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        self.reply_json(handler, {"status": "RATELIMIT"}, headers)
+
+    def unpaired_a3m(self, seq: str, use_env: bool) -> str:
+        a3m = self.unpaired.get((seq, use_env))
+        if a3m is None:
+            a3m = synthetic_a3m(seq, self.msa_depth, f"{self.seed}{use_env}")
+        return a3m
+
+    def result(self, ticket: MockTicket) -> bytes:
+        """The result tarball, with one \\x00 terminated a3m record per query"""
+        use_env = "env" in ticket.mode
+        if ticket.use_pairing:
+            a3ms = self.paired.get((tuple(ticket.seqs), use_env))
+            if a3ms is None:
+                a3ms = [f">101\n{seq}\n" for seq in ticket.seqs]
+            records = [
+                renumber_a3m(a3m, 101, 101 + i) + "\x00" for i, a3m in enumerate(a3ms)
+            ]
+            return make_tar_gz({"pair.a3m": "".join(records).encode()})
+
+        files = {}
+        records = [
+            renumber_a3m(self.unpaired_a3m(seq, use_env), 101, 101 + i) + "\x00"
+            for i, seq in enumerate(ticket.seqs)
+        ]
+        files["uniref.a3m"] = "".join(records).encode()
+        if use_env:
+            # canned responses contain the environmental hits already
+            files["bfd.mgnify30.metaeuk30.smag30.a3m"] = b""
+        m8 = []
+        for i, seq in enumerate(ticket.seqs):
+            for hit in template_hits(seq, self.num_templates):
+                m8.append(
+                    f"{101 + i}\t{hit}\t0.9\t{len(seq)}\t0\t0\t1\t{len(seq)}\t1\t{len(seq)}\t1e-20\t100\n"
+                )
+        files["pdb70.m8"] = "".join(m8).encode()
+        return make_tar_gz(files)
+
+    def templates(self, hits: List[str]) -> bytes:
+        files = {}
+        data, index = b"", []
+        for hit in sorted(hits):
+            pdb = hit.split("_")[0].lower()
+            files[f"{pdb}.cif"] = f"data_{pdb}\n#\n".encode()
+            record = f">{hit}\n{AMINO_ACIDS}\n".encode() + b"\x00"
+            index.append(f"{hit}\t{len(data)}\t{len(record)}\n")
+            data += record
+        files["pdb70_a3m.ffdata"] = data
+        files["pdb70_a3m.ffindex"] = "".join(index).encode()
+        return make_tar_gz(files)
+
+
+def main():
+    parser = ArgumentParser(description="Local mock of the MSA server API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--data-dir", default=str(DEFAULT_DATA_DIR))
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--run-time", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--ratelimit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--num-templates", type=int, default=0)
+    parser.add_argument("--msa-depth", type=int, default=16)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = MockMSAServer(
+        args.host,
+        args.port,
+        args.data_dir,
+        latency=args.latency,
+        run_time=args.run_time,
+        failure_rate=args.failure_rate,
+        ratelimit_rate=args.ratelimit_rate,
+        retry_after=args.retry_after,
+        num_templates=args.num_templates,
+        msa_depth=args.msa_depth,
+    )
+    logger.info(f"Serving on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
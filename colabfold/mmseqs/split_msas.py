@@ -4,30 +4,67 @@ We merge the two searches and then split into one a3m file per msa.
 """
 import logging
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, List, Optional
 
 from tqdm import tqdm
 
+from colabfold.mmseqs.db import MMseqsDB, scan_index
+
 logger = logging.getLogger(__name__)
 
 
-def split_msa(merged_msa: Path, output_folder: Path):
+def msa_filename(msa: bytes) -> str:
+    """File name from the first word of the first header of an msa"""
+    first_line = msa.split(b"\n", 1)[0].decode()
+    name = first_line[1:].split(" ")[0].strip().replace("/", "_").replace(">", "")
+    return name + ".a3m"
+
+
+def split_msa(
+    merged_msa: Path,
+    output_folder: Path,
+    keys: Optional[Iterable[int]] = None,
+    threads: int = 1,
+):
+    """Write every msa of a database (or only those with the given keys) to its own file
 
-    # We need to split the a3m file into one a3m file per msa, for large files we don't want to load the whole thing into the memory
-    with merged_msa.open("r") as f:
-        line = f.readline()
-        msa = [line.strip().replace('\0', '')]
-        progress = tqdm()
-        while line:
-            if line.count('\0') > 0:
-                filename = msa[0][1:].split(" ")[0].strip().replace("/", "_").replace('>','') + ".a3m"
-                output_folder.joinpath(filename).write_text("\n".join(msa))
-                msa = []
+    The msas are read from a memory map at their offsets in the database index, so memory use
+    doesn't grow with the size of the msas. A data file without an index is scanned once for the
+    null bytes that end the entries, which are then numbered in file order.
+    """
+    index = None
+    if not merged_msa.with_name(f"{merged_msa.name}.index").is_file():
+        logger.info(f"{merged_msa} has no index, scanning it for the msas")
+        index = scan_index(merged_msa)
+    with MMseqsDB(merged_msa, index) as db:
+        if keys is None:
+            keys = sorted(db.keys())
+        else:
+            keys = list(keys)
+            missing = [key for key in keys if key not in db]
+            if missing:
+                logger.warning(f"{len(missing)} keys are not in {merged_msa}")
+            keys = [key for key in keys if key in db]
+        progress = tqdm(total=len(keys))
+
+        def write_msas(worker: int):
+            for key in keys[worker::threads]:
+                msa = db.get(key)
+                if msa.strip():
+                    output_folder.joinpath(msa_filename(msa)).write_bytes(msa)
                 progress.update(1)
-                line = line.replace('\0','')
 
-            msa.append(line.strip())
-            line = f.readline()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            # list() re-raises the exceptions of the workers
+            list(executor.map(write_msas, range(threads)))
+        progress.close()
+
+
+def read_keys(keys_file: Path) -> List[int]:
+    with keys_file.open() as f:
+        return [int(line) for line in f if line.strip()]
 
 
 def main():
@@ -42,12 +79,26 @@ def main():
     )
     parser.add_argument("output_folder", help="Will contain all the a3m files")
     parser.add_argument("--mmseqs", help="Path to the mmseqs2 binary", default="mmseqs")
+    parser.add_argument(
+        "--keys",
+        type=Path,
+        default=None,
+        help="File with the database keys of the msas to write, one per line. By default all are written.",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1, help="Number of threads writing a3m files"
+    )
     args = parser.parse_args()
     output_folder = Path(args.output_folder)
     output_folder.mkdir(exist_ok=True)
 
     logger.info("Splitting MSAs")
-    split_msa(Path(args.search_folder).joinpath("final.a3m"), output_folder)
+    split_msa(
+        Path(args.search_folder).joinpath("final.a3m"),
+        output_folder,
+        read_keys(args.keys) if args.keys else None,
+        args.threads,
+    )
     logger.info("Done")
 
 
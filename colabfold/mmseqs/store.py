@@ -0,0 +1,56 @@
+"""
+Persistent store of finished colabfold_search results, so that a search only needs to run for the
+sequences it hasn't seen before.
+
+Unpaired MSAs and template hits are stored per sequence, paired MSAs per combination of chains. All
+keys contain a fingerprint of the databases and search parameters. Entries are kept in an MSACache
+directory with the query named >101 (or 101 in the m8), and renumbered for the chain they are used for.
+"""
+import re
+from pathlib import Path
+from typing import List, Optional, Union
+
+from colabfold.mmseqs.cache import MSACache, renumber_a3m
+
+
+def renumber_m8(m8: str, old: int, new: int) -> str:
+    if old == new:
+        return m8
+    return re.sub(rf"^{old}\t", f"{new}\t", m8, flags=re.MULTILINE)
+
+
+class SearchStore:
+    def __init__(self, root: Union[str, Path], fingerprint: str):
+        self.cache = MSACache(root)
+        self.fingerprint = fingerprint
+
+    def key(self, kind: str, value) -> str:
+        return self.cache.key("search", kind, self.fingerprint, value)
+
+    def get_unpaired(self, seq: str, n: int = 101) -> Optional[str]:
+        a3m = self.cache.get_text(self.key("unpaired", seq))
+        return None if a3m is None else renumber_a3m(a3m, 101, n)
+
+    def put_unpaired(self, seq: str, a3m: str, n: int = 101):
+        self.cache.put_text(self.key("unpaired", seq), renumber_a3m(a3m, n, 101))
+
+    def get_paired(self, seqs: List[str]) -> Optional[List[str]]:
+        return self.cache.get_json(self.key("paired", seqs))
+
+    def put_paired(self, seqs: List[str], a3ms: List[str]):
+        self.cache.put_json(self.key("paired", seqs), a3ms)
+
+    def get_m8(self, seq: str, n: int = 101) -> Optional[str]:
+        m8 = self.cache.get_text(self.key("m8", seq))
+        return None if m8 is None else renumber_m8(m8, 101, n)
+
+    def put_m8(self, seq: str, m8: str, n: int = 101):
+        self.cache.put_text(self.key("m8", seq), renumber_m8(m8, n, 101))
+
+    def has_job(self, seqs: List[str], use_pairing: bool, use_templates: bool) -> bool:
+        keys = [self.key("unpaired", seq) for seq in seqs]
+        if use_pairing:
+            keys.append(self.key("paired", seqs))
+        if use_templates:
+            keys += [self.key("m8", seq) for seq in seqs]
+        return all(self.cache.path(key).is_file() for key in keys)
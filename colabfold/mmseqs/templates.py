@@ -0,0 +1,155 @@
+"""
+Store of template structures fetched from the MSA server, shared by all queries.
+
+Template hits are stored once: `cif/{pdb}.cif` for the structures, and a single append-only
+`pdb70_a3m.ffdata`/`.ffindex` pair for the hit MSAs, whose index doubles as the record of
+which hits were already fetched. The per-query template directory that hhsearch and
+HhsearchHitFeaturizer expect is assembled from the store with hard links.
+"""
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# number of template hits requested from the server at once
+FETCH_SIZE = 20
+
+
+def read_ffindex(path: Union[str, Path]) -> Dict[str, Tuple[int, int]]:
+    index = {}
+    with open(path) as f:
+        for line in f:
+            p = line.rstrip("\n").split("\t")
+            # skip a line that is still being written by another process
+            if len(p) != 3:
+                continue
+            index[p[0]] = (int(p[1]), int(p[2]))
+    return index
+
+
+def link_or_copy(src: Path, dst: Path):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. a store on another filesystem
+        shutil.copyfile(src, dst)
+
+
+class TemplateStore:
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.cif_dir = self.root.joinpath("cif")
+        self.cif_dir.mkdir(parents=True, exist_ok=True)
+        self.ffdata = self.root.joinpath("pdb70_a3m.ffdata")
+        self.ffindex = self.root.joinpath("pdb70_a3m.ffindex")
+        self.ffdata.touch()
+        self.ffindex.touch()
+
+    @contextmanager
+    def lock(self, operation: int = fcntl.LOCK_EX):
+        with self.root.joinpath(".lock").open("w") as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def index(self) -> Dict[str, Tuple[int, int]]:
+        with self.lock(fcntl.LOCK_SH):
+            return read_ffindex(self.ffindex)
+
+    def missing(self, hits: List[str]) -> List[str]:
+        index = self.index()
+        return [hit for hit in dict.fromkeys(hits) if hit not in index]
+
+    def add(self, path: Union[str, Path], hits: List[str]):
+        """Ingest an extracted template tarball of the server
+
+        All requested `hits` are recorded in the index, also those the server had no MSA for,
+        so they are not requested again.
+        """
+        path = Path(path)
+        new_data = {}
+        ffindex_path = path.joinpath("pdb70_a3m.ffindex")
+        if ffindex_path.is_file():
+            with path.joinpath("pdb70_a3m.ffdata").open("rb") as f:
+                for hit, (offset, length) in read_ffindex(ffindex_path).items():
+                    f.seek(offset)
+                    new_data[hit] = f.read(length)
+        with self.lock():
+            for cif in path.glob("*.cif"):
+                # the featurizer looks up lower case PDB ids
+                if not self.cif_dir.joinpath(cif.name.lower()).is_file():
+                    os.replace(cif, self.cif_dir.joinpath(cif.name.lower()))
+
+            index = read_ffindex(self.ffindex)
+            entries = []
+            with self.ffdata.open("ab") as f:
+                offset = f.tell()
+                for hit in dict.fromkeys(list(new_data) + hits):
+                    if hit in index:
+                        continue
+                    data = new_data.get(hit, b"\x00")
+                    f.write(data)
+                    entries.append(f"{hit}\t{offset}\t{len(data)}\n")
+                    offset += len(data)
+            # the data is complete before the index points to it
+            with self.ffindex.open("a") as f:
+                f.write("".join(entries))
+
+    def fetch(self, client, hits: List[str]):
+        """Download the hits that are not in the store yet"""
+        missing = self.missing(hits)
+        if len(missing) == 0:
+            return
+        logger.debug(f"Fetching {len(missing)} of {len(set(hits))} templates")
+        for start in range(0, len(missing), FETCH_SIZE):
+            chunk = missing[start : start + FETCH_SIZE]
+            tmp_dir = tempfile.mkdtemp(prefix=".fetch_", dir=self.root)
+            try:
+                client.templates(chunk, tmp_dir)
+                self.add(tmp_dir, chunk)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def assemble(self, hits: List[str], path: Union[str, Path]):
+        """Create the template directory of a query with the given hits"""
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir()
+
+        index = self.index()
+        entries = []
+        offset = 0
+        with self.ffdata.open("rb") as src, tmp_path.joinpath("pdb70_a3m.ffdata").open(
+            "wb"
+        ) as dst:
+            # ffindex lookups are a binary search, so the index must be sorted
+            for hit in sorted(set(hits)):
+                if hit not in index or index[hit][1] <= 1:
+                    continue
+                src.seek(index[hit][0])
+                data = src.read(index[hit][1])
+                dst.write(data)
+                entries.append(f"{hit}\t{offset}\t{len(data)}\n")
+                offset += len(data)
+
+                cif_name = f"{hit.split('_')[0].lower()}.cif"
+                cif = self.cif_dir.joinpath(cif_name)
+                if cif.is_file() and not tmp_path.joinpath(cif_name).exists():
+                    link_or_copy(cif, tmp_path.joinpath(cif_name))
+        tmp_path.joinpath("pdb70_a3m.ffindex").write_text("".join(entries))
+        os.symlink("pdb70_a3m.ffindex", tmp_path.joinpath("pdb70_cs219.ffindex"))
+        tmp_path.joinpath("pdb70_cs219.ffdata").write_text("")
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # assembled concurrently by another process
+            shutil.rmtree(tmp_path, ignore_errors=True)
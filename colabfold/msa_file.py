@@ -0,0 +1,314 @@
+"""
+Binary container for the MSAs and template features of a job, written by colabfold_batch --msa-only
+and read back when the job is predicted (e.g. on another machine).
+
+Layout: an 8 byte magic with the format version, the length of a JSON manifest, the manifest, and
+the arrays, each starting at a multiple of 64 bytes. The manifest has the block layout of the
+complex (unique chains, their cardinality, which of the paired and unpaired MSAs exist) and the
+dtype, shape and position of every array. The chain MSAs are stored as a uint8 matrix of their
+match columns with the insertions (the lowercase residues) stored sparsely, their row descriptions
+as text. Template features are stored as plain arrays. Without compression the arrays are read
+from a memory map of the file, with compression ("zstd" or "lz4", which need the zstandard or lz4
+package) every array is compressed on its own. The chain MSAs are decoded back into a3m text when
+they are loaded, the rest of the pipeline (and the .a3m file written for every job) works on text.
+"""
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from colabfold.a3m import IS_INSERTION
+
+MAGIC = b"CFMSA\x00\x00"
+VERSION = 1
+ALIGNMENT = 64
+SUFFIX = ".cfmsa"
+
+MsaAndTemplates = Tuple[
+    Optional[List[str]], Optional[List[str]], List[str], List[int], List[Dict[str, Any]]
+]
+
+
+def compressors(compression: Optional[str]) -> Tuple[Callable, Callable]:
+    if compression is None:
+        return (lambda data: data), (lambda data: data)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ModuleNotFoundError:
+            raise RuntimeError(
+                "zstd compression needs the zstandard package: pip install zstandard"
+            )
+        return (
+            zstandard.ZstdCompressor().compress,
+            zstandard.ZstdDecompressor().decompress,
+        )
+    if compression == "lz4":
+        try:
+            import lz4.frame
+        except ModuleNotFoundError:
+            raise RuntimeError("lz4 compression needs the lz4 package: pip install lz4")
+        return lz4.frame.compress, lz4.frame.decompress
+    raise ValueError(f"Unknown compression {compression}")
+
+
+def split_records(a3m: str) -> Optional[Tuple[List[str], List[str]]]:
+    """Descriptions and sequences of an a3m with one line per header and sequence, or None if the
+    a3m can't be written back exactly from them"""
+    lines = a3m.split("\n")
+    if lines[-1] != "" or len(lines) % 2 != 1:
+        return None
+    descriptions = lines[0:-1:2]
+    sequences = lines[1:-1:2]
+    if not all(description.startswith(">") for description in descriptions):
+        return None
+    if any(sequence.startswith(">") for sequence in sequences):
+        return None
+    return [description[1:] for description in descriptions], sequences
+
+
+def encode_a3m(a3m: str) -> Dict[str, np.ndarray]:
+    """The arrays of a chain MSA: the match columns as a (rows, columns) matrix, and each run of
+    insertions with its row, the column it comes before and its text"""
+    records = split_records(a3m)
+    if records is not None and "".join(records[1]).isascii() and records[1]:
+        descriptions, sequences = records
+        buffer = np.frombuffer("".join(sequences).encode(), dtype=np.uint8)
+        starts = np.zeros(len(sequences) + 1, dtype=np.int64)
+        np.cumsum([len(sequence) for sequence in sequences], out=starts[1:])
+        is_insertion = np.take(IS_INSERTION, buffer)
+        columns_before = np.zeros(len(buffer) + 1, dtype=np.int64)
+        np.cumsum(~is_insertion, out=columns_before[1:])
+        row_columns = np.diff(columns_before[starts])
+        if np.all(row_columns == row_columns[0]):
+            positions = np.flatnonzero(is_insertion)
+            rows = np.searchsorted(starts, positions, side="right") - 1
+            columns = columns_before[positions] - columns_before[starts[rows]]
+            # a run of insertions is a maximal stretch of them before the same column of a row
+            run_starts = np.flatnonzero(
+                (np.diff(positions, prepend=-2) != 1) | (np.diff(rows, prepend=-1) != 0)
+            )
+            arrays = {
+                "descriptions": np.frombuffer(
+                    "\n".join(descriptions).encode(), dtype=np.uint8
+                ),
+                "columns": buffer[~is_insertion].reshape(
+                    len(sequences), int(row_columns[0])
+                ),
+                "insertion_rows": rows[run_starts].astype(np.int32),
+                "insertion_columns": columns[run_starts].astype(np.int32),
+                "insertion_offsets": np.append(run_starts, len(positions)).astype(
+                    np.int64
+                ),
+                "insertions": buffer[positions],
+            }
+            if decode_a3m(arrays) == a3m:
+                return arrays
+    return {"text": np.frombuffer(a3m.encode(), dtype=np.uint8)}
+
+
+def decode_a3m(arrays: Dict[str, np.ndarray]) -> str:
+    if "text" in arrays:
+        return arrays["text"].tobytes().decode()
+    descriptions = arrays["descriptions"].tobytes().decode().split("\n")
+    columns = arrays["columns"]
+    rows = [row.tobytes() for row in columns]
+    insertions = arrays["insertions"].tobytes()
+    offsets = arrays["insertion_offsets"].tolist()
+    # the runs are in file order, so splicing them into a row from the back keeps the positions
+    # of the earlier ones
+    runs = list(
+        zip(
+            arrays["insertion_rows"].tolist(),
+            arrays["insertion_columns"].tolist(),
+            offsets[:-1],
+            offsets[1:],
+        )
+    )
+    for row, column, start, end in reversed(runs):
+        rows[row] = rows[row][:column] + insertions[start:end] + rows[row][column:]
+    return "".join(
+        f">{description}\n{row.decode()}\n"
+        for description, row in zip(descriptions, rows)
+    )
+
+
+def encode_features(features: Dict[str, Any]) -> Tuple[Dict[str, str], Dict]:
+    """Arrays of a template feature dict and how to restore the original value types"""
+    kinds, arrays = {}, {}
+    for key, value in features.items():
+        if isinstance(value, list):
+            kinds[key] = "list"
+            arrays[key] = np.array(value, dtype=bytes)
+        elif value.dtype == np.object_:
+            kinds[key] = "object"
+            arrays[key] = value.astype(bytes)
+        else:
+            kinds[key] = "array"
+            arrays[key] = value
+    return kinds, arrays
+
+
+def decode_features(kinds: Dict[str, str], arrays: Dict[str, np.ndarray]) -> Dict:
+    features = {}
+    for key, kind in kinds.items():
+        if kind == "list":
+            features[key] = arrays[key].tolist()
+        elif kind == "object":
+            features[key] = arrays[key].astype(np.object_)
+        else:
+            features[key] = arrays[key]
+    return features
+
+
+class ArrayWriter:
+    """Collects the arrays of a container file, add() returns the manifest entry of an array"""
+
+    def __init__(self, compression: Optional[str] = None):
+        self.compression = compression
+        self.compress, _ = compressors(compression)
+        self.blobs = []
+        self.position = 0
+
+    def add(self, array: np.ndarray) -> Dict:
+        array = np.ascontiguousarray(array)
+        data = self.compress(array.tobytes())
+        entry = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": self.position,
+            "size": len(data),
+        }
+        self.blobs.append(data)
+        self.position += -(-len(data) // ALIGNMENT) * ALIGNMENT
+        return entry
+
+    def write(self, path: Path, magic: bytes, version: int, manifest: Dict):
+        """Writes the file through a temporary file, so readers never see a partial one"""
+        manifest = json.dumps(
+            {"version": version, "compression": self.compression, **manifest}
+        ).encode()
+        header = magic + struct.pack("<BQ", version, len(manifest)) + manifest
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            f.write(header)
+            data_start = -(-len(header) // ALIGNMENT) * ALIGNMENT
+            for blob in self.blobs:
+                f.write(b"\x00" * (data_start - f.tell()))
+                f.write(blob)
+                data_start += -(-len(blob) // ALIGNMENT) * ALIGNMENT
+        tmp.replace(path)
+
+
+def read_container(
+    path: Union[str, Path],
+    magic: bytes,
+    version: int,
+    kind: str,
+    access: int = mmap.ACCESS_READ,
+) -> Tuple[Dict, Callable[[Dict], np.ndarray]]:
+    """The manifest of a container file and a function that reads an array from its entry
+
+    Uncompressed arrays are views of a memory map of the file, opened with the given access
+    (with mmap.ACCESS_COPY they can be written to without changing the file).
+    """
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=access)
+    if data[: len(magic)] != magic:
+        raise ValueError(f"{path} is not a {kind} file")
+    file_version, manifest_size = struct.unpack_from("<BQ", data, len(magic))
+    if file_version > version:
+        raise ValueError(
+            f"{path} has format version {file_version}, this ColabFold reads up to {version}"
+        )
+    manifest_start = len(magic) + struct.calcsize("<BQ")
+    manifest = json.loads(data[manifest_start : manifest_start + manifest_size])
+    data_start = -(-(manifest_start + manifest_size) // ALIGNMENT) * ALIGNMENT
+    _, decompress = compressors(manifest["compression"])
+
+    def get(entry: Dict) -> np.ndarray:
+        start = data_start + entry["offset"]
+        dtype = np.dtype(entry["dtype"])
+        if manifest["compression"] is None:
+            count = int(np.prod(entry["shape"]))
+            array = np.frombuffer(data, dtype=dtype, count=count, offset=start)
+        else:
+            array = np.frombuffer(
+                decompress(data[start : start + entry["size"]]), dtype=dtype
+            )
+        return array.reshape(entry["shape"])
+
+    return manifest, get
+
+
+def save_msa_and_templates(
+    path: Union[str, Path],
+    msa_and_templates: MsaAndTemplates,
+    compression: Optional[str] = None,
+):
+    (
+        unpaired_msa,
+        paired_msa,
+        query_seqs_unique,
+        query_seqs_cardinality,
+        template_features,
+    ) = msa_and_templates
+    writer = ArrayWriter(compression)
+
+    def add_msas(msas: Optional[List[str]]) -> Optional[List[Dict]]:
+        if msas is None:
+            return None
+        return [
+            {name: writer.add(array) for name, array in encode_a3m(a3m).items()}
+            for a3m in msas
+        ]
+
+    templates = []
+    for features in template_features:
+        kinds, arrays = encode_features(features)
+        templates.append(
+            {
+                "kinds": kinds,
+                "arrays": {key: writer.add(array) for key, array in arrays.items()},
+            }
+        )
+    manifest = {
+        "query_seqs_unique": query_seqs_unique,
+        "query_seqs_cardinality": query_seqs_cardinality,
+        "unpaired_msa": add_msas(unpaired_msa),
+        "paired_msa": add_msas(paired_msa),
+        "template_features": templates,
+    }
+    writer.write(Path(path), MAGIC, VERSION, manifest)
+
+
+def load_msa_and_templates(path: Union[str, Path]) -> MsaAndTemplates:
+    manifest, get = read_container(path, MAGIC, VERSION, "ColabFold MSA")
+
+    def get_msas(entries: Optional[List[Dict]]) -> Optional[List[str]]:
+        if entries is None:
+            return None
+        return [
+            decode_a3m({name: get(entry) for name, entry in arrays.items()})
+            for arrays in entries
+        ]
+
+    # template features are copied out of the (read-only) map, the model pipeline may change them
+    template_features = [
+        decode_features(
+            template["kinds"],
+            {key: np.array(get(entry)) for key, entry in template["arrays"].items()},
+        )
+        for template in manifest["template_features"]
+    ]
+    return (
+        get_msas(manifest["unpaired_msa"]),
+        get_msas(manifest["paired_msa"]),
+        manifest["query_seqs_unique"],
+        manifest["query_seqs_cardinality"],
+        template_features,
+    )
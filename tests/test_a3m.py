@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+from alphafold.data import pipeline
+
+from colabfold.a3m import (
+    A3M,
+    MSAFilter,
+    complex_msa_features,
+    make_msa_features,
+    split_row,
+    split_rows,
+)
+from colabfold.input import ComplexMSA
+
+A3M_STRING = """>101 query
+MKV-LA
+>tr|A0A146SKV9|A0A146SKV9_FUNHE 0.5
+mkKVqq
+IL-Add
+>hit2
+-KVaL-Acc
+
+>hit3
+MKV-LA
+"""
+
+
+def assert_same_features(a3m: str):
+    expected = pipeline.make_msa_features([pipeline.parsers.parse_a3m(a3m)])
+    actual = make_msa_features(a3m)
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        assert actual[key].dtype == value.dtype, key
+        np.testing.assert_array_equal(actual[key], value, err_msg=key)
+
+
+def test_same_features_as_alphafold(pytestconfig):
+    assert_same_features(A3M_STRING)
+    for name in ["5AWL1.a3m", "6A5J.a3m"]:
+        a3m = pytestconfig.rootpath.joinpath("test-data/a3m", name).read_text()
+        assert_same_features(a3m)
+
+
+def test_unique_mask_and_errors():
+    a3m = A3M.parse(A3M_STRING)
+    assert a3m.unique_mask().tolist() == [True, True, True, False]
+    with pytest.raises(ValueError, match="has 6 aligned columns"):
+        A3M.parse(">q\nMKVL\n>hit\nMKV-La\nA\n")
+    with pytest.raises(ValueError, match="invalid character '.'"):
+        A3M.parse(">q\nMKVL\n>hit\nMK.L\n")
+
+
+def test_split_rows_like_split_row():
+    chain_lengths = [3, 2, 4]
+    seqs = [
+        "MKVLAGGAS",
+        "aMK-qq-LA--Gcc",
+        "---LA----",
+        "MKV-----sA",
+        "MKVL",  # too short
+        "MKVLAGGASAA",  # too long
+        "",
+    ]
+    rows, has_residue = split_rows(seqs, chain_lengths)
+    expected = [split_row(seq, chain_lengths) for seq in seqs]
+    assert rows == [chains for chains, _ in expected]
+    assert has_residue.tolist() == [residues for _, residues in expected]
+    assert rows[1] == ["aMK-", "qq-L", "A--G"]
+    assert has_residue[2].tolist() == [False, True, False]
+
+
+def test_complex_msa_features_like_text():
+    query_seqs_unique = ["MKVL", "GGA"]
+    query_seqs_cardinality = [2, 1]
+    paired_msa = [
+        ">101\nMKVL\n>tr|A0A146SKV9|A0A146SKV9_FUNHE\nMK-aLcc\n",
+        ">102\nGGA\n>hit2\naG-A\n",
+    ]
+    unpaired_msa = [">101\nMKVL\n>hit3\n-KVLa\n", ">102\nGGA\n>hit4\nGqqGA\n"]
+    msa = ComplexMSA(
+        query_seqs_unique, query_seqs_cardinality, paired_msa, unpaired_msa
+    )
+    full_sequence = "MKVLMKVLGGA"
+    text = f">0\n{full_sequence}\n" + msa.to_str()
+    expected = pipeline.make_msa_features([pipeline.parsers.parse_a3m(text)])
+    actual = complex_msa_features(msa, full_sequence)
+    for key, value in expected.items():
+        assert actual[key].dtype == value.dtype, key
+        np.testing.assert_array_equal(actual[key], value, err_msg=key)
+
+
+def reference_filter(msa: np.ndarray, max_seq_id: float) -> list:
+    """Row by row greedy identity filter"""
+    kept = [0]
+    for i in range(1, len(msa)):
+        for j in kept:
+            same = np.sum((msa[i] == msa[j]) & (msa[i] != 21))
+            residues = min(np.sum(msa[i] != 21), np.sum(msa[j] != 21))
+            if same / max(residues, 1) > max_seq_id:
+                break
+        else:
+            kept.append(i)
+    return kept
+
+
+def test_msa_filter():
+    rng = np.random.default_rng(0)
+    query = rng.integers(0, 20, 40)
+    rows = [query]
+    for _ in range(700):
+        row = rows[rng.integers(len(rows))].copy()
+        mutated = rng.random(40) < rng.uniform(0.05, 0.6)
+        row[mutated] = rng.integers(0, 21, mutated.sum())
+        rows.append(row)
+    letters = np.array(list("ARNDCQEGHILKMFPSTWYVX-"))
+    a3m_string = "".join(
+        f">{i}\n{''.join(letters[row])}\n" for i, row in enumerate(rows)
+    )
+    a3m = A3M.parse(a3m_string)
+
+    mask = MSAFilter(max_seq_id=0.8).mask(a3m)
+    assert np.flatnonzero(mask).tolist() == reference_filter(a3m.msa, 0.8)
+
+    coverage = (a3m.msa != 21).mean(axis=1)
+    mask = MSAFilter(min_coverage=0.97).mask(a3m)
+    assert mask[0] and mask.tolist()[1:] == (coverage >= 0.97).tolist()[1:]
+
+    mask = MSAFilter(max_seq_id=0.9, diff=50).mask(a3m)
+    assert mask[0] and mask.sum() == 50
+
+    filtered = MSAFilter(max_seq_id=0.8)(a3m_string)
+    assert A3M.parse(filtered).descriptions == [
+        str(i) for i in reference_filter(a3m.msa, 0.8)
+    ]
+    assert MSAFilter(max_seq_id=1.0)(a3m_string) == a3m_string
@@ -10,9 +10,10 @@ from zipfile import ZipFile
 
 from alphafold.model.data import get_model_haiku_params
 from alphafold.model.tf import utils
-from colabfold.batch import msa_to_str, unserialize_msa, get_queries
+from colabfold.batch import unserialize_msa, get_queries
 from colabfold.batch import run
 from colabfold.download import download_alphafold_params
+from colabfold.input import msa_to_str
 from tests.mock import MockRunModel, MMseqs2Mock
 
 
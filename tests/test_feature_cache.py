@@ -0,0 +1,57 @@
+import numpy as np
+
+from colabfold.batch import generate_input_feature, mk_mock_template
+from colabfold.feature_cache import FeatureCache
+
+
+def test_feature_cache(tmp_path):
+    query_seqs_unique = ["MKVLAG", "GGAA"]
+    query_seqs_cardinality = [2, 1]
+    unpaired_msa = [">101\nMKVLAG\n>hit\nMK-aLAG\n", ">102\nGGAA\n"]
+    paired_msa = [">101\nMKVLAG\n", ">102\nGGAA\n"]
+    template_features = [mk_mock_template(seq) for seq in query_seqs_unique]
+    msa_and_templates = (
+        unpaired_msa,
+        paired_msa,
+        query_seqs_unique,
+        query_seqs_cardinality,
+        template_features,
+    )
+    feature_dict, domain_names = generate_input_feature(
+        query_seqs_unique,
+        query_seqs_cardinality,
+        unpaired_msa,
+        paired_msa,
+        template_features,
+        True,
+        "alphafold2_ptm",
+        max_seq=508,
+    )
+
+    cache = FeatureCache(tmp_path)
+    key = cache.key(msa_and_templates, True, "alphafold2_ptm", 508)
+    assert cache.get(key) is None
+    cache.put(key, feature_dict, domain_names)
+    cached_features, cached_domain_names = cache.get(key)
+    assert cached_domain_names == domain_names
+    assert cached_features.keys() == feature_dict.keys()
+    for name, value in feature_dict.items():
+        if isinstance(value, list):
+            assert cached_features[name] == value, name
+        else:
+            assert cached_features[name].dtype == value.dtype, name
+            np.testing.assert_array_equal(cached_features[name], value, err_msg=name)
+
+    # the arrays can be changed without changing the cache
+    cached_features["msa"][:] = 0
+    np.testing.assert_array_equal(cache.get(key)[0]["msa"], feature_dict["msa"])
+
+    assert key != cache.key(msa_and_templates, True, "alphafold2_ptm", 512)
+    assert key != cache.key(msa_and_templates, True, "alphafold2_multimer_v3", 508)
+    changed_msa = (
+        unpaired_msa[:1] + [">102\nGGAA\n>hit\nGG-A\n"],
+    ) + msa_and_templates[1:]
+    assert key != cache.key(changed_msa, True, "alphafold2_ptm", 508)
+    assert key == FeatureCache(tmp_path).key(
+        msa_and_templates, True, "alphafold2_ptm", 508
+    )
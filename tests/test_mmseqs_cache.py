@@ -0,0 +1,60 @@
+import os
+
+from colabfold.mmseqs.cache import MSACache
+
+
+def test_lru_eviction(tmp_path):
+    cache = MSACache(tmp_path)
+    keys = [cache.key("entry", i) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, b"x" * 100)
+        # make the access order deterministic
+        os.utime(cache.path(key), (i, i))
+    # reading the oldest entry makes it the most recently used one
+    assert cache.get(keys[0]) == b"x" * 100
+
+    cache.max_size = 250
+    cache.put(cache.key("entry", 3), b"x" * 100)
+
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is None
+    assert cache.get(cache.key("entry", 3)) is not None
+
+
+def test_keys_depend_on_version(tmp_path):
+    assert MSACache(tmp_path, version="a").key("x") != MSACache(
+        tmp_path, version="b"
+    ).key("x")
+
+
+def test_wrap_run_mmseqs2(tmp_path):
+    calls = []
+
+    def server(x, use_pairing=False):
+        if use_pairing:
+            return [f">101\n{x[0]}\n", f">102\n{x[1]}\n"]
+        return [f">{101 + i}\n{seq}\n>hit\n{seq.lower()}\n" for i, seq in enumerate(x)]
+
+    def run_mmseqs2(x, prefix, use_env=True, use_pairing=False, **kwargs):
+        calls.append((x, use_pairing))
+        return server(x, use_pairing)
+
+    cache = MSACache(tmp_path.joinpath("cache"))
+    cached_run_mmseqs2 = cache.wrap_run_mmseqs2(run_mmseqs2)
+    prefix = str(tmp_path.joinpath("job"))
+
+    first = cached_run_mmseqs2(["AAA", "CCC"], prefix, True)
+    assert first == server(["AAA", "CCC"])
+    # only the new sequence is sent to the server, but numbered as without the cache
+    second = cached_run_mmseqs2(["CCC", "DDD"], prefix, True)
+    assert second == server(["CCC", "DDD"])
+    assert calls[-1] == (["DDD"], False)
+    # other settings are cached separately
+    cached_run_mmseqs2(["AAA"], prefix, False)
+    assert calls[-1] == (["AAA"], False)
+
+    calls.clear()
+    paired = cached_run_mmseqs2(["AAA", "CCC"], prefix, True, use_pairing=True)
+    assert cached_run_mmseqs2(["AAA", "CCC"], prefix, True, use_pairing=True) == paired
+    assert calls == [(["AAA", "CCC"], True)]
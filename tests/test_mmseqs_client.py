@@ -0,0 +1,142 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from colabfold.mmseqs.client import MMseqs2Client, Ticket
+from colabfold.mmseqs.journal import TicketJournal
+
+
+class FakeResponse:
+    def __init__(self, json=None, content=b"", headers=None):
+        self._json = json
+        self.content = content
+        self.text = str(json)
+        self.headers = headers or {}
+
+    def json(self):
+        if self._json is None:
+            raise ValueError("no json")
+        return self._json
+
+
+class FakeSession:
+    """Replays a list of responses (or exceptions) and records the requested paths"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.paths = []
+        self.headers = {}
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def request(self, method, url, **kwargs):
+        self.paths.append(url.split("/", 3)[-1])
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def make_client(responses):
+    client = MMseqs2Client(
+        "http://msa.test", "colabfold/test", poll_min=0.01, backoff_base=0.01
+    )
+    client.session = FakeSession(responses)
+    return client
+
+
+def test_search_polls_until_complete(tmp_path):
+    client = make_client(
+        [
+            FakeResponse({"status": "RATELIMIT"}),
+            FakeResponse({"status": "PENDING", "id": "abc"}),
+            FakeResponse({"status": "PENDING"}),
+            requests.exceptions.ConnectionError("reset"),
+            FakeResponse({"status": "RUNNING"}),
+            FakeResponse({"status": "COMPLETE"}),
+            FakeResponse(content=b"tarball"),
+        ]
+    )
+    statuses = []
+    with mock.patch("time.sleep"):
+        ticket = client.search(
+            ["PIAQIHILEGRSDEQKETLIREVSEAISRSLDAPLTSVRVIITEMAKGHFGIGGELASK"],
+            "env",
+            tmp_path.joinpath("out.tar.gz"),
+            callback=lambda t: statuses.append(t.status),
+        )
+
+    assert ticket.id == "abc"
+    assert statuses == ["PENDING", "RUNNING", "COMPLETE"]
+    assert client.session.paths == ["ticket/msa", "ticket/msa"] + ["ticket/abc"] * 4 + [
+        "result/download/abc"
+    ]
+    assert tmp_path.joinpath("out.tar.gz").read_bytes() == b"tarball"
+
+
+def test_poll_interval_adapts():
+    client = make_client(
+        [FakeResponse({"status": "PENDING"})] * 3
+        + [FakeResponse({"status": "RATELIMIT"}, headers={"Retry-After": "0.5"})]
+        + [FakeResponse({"status": "RUNNING"})]
+    )
+    ticket = Ticket(["MKV"], "env", False)
+    ticket.id, ticket.status, ticket.interval = "abc", "PENDING", client.poll_min
+
+    intervals = []
+    for _ in range(5):
+        client.status(ticket)
+        intervals.append(ticket.interval)
+
+    # unchanged state backs off geometrically
+    assert intervals[0] < intervals[1] < intervals[2]
+    # RATELIMIT waits at least as long as the server asks for
+    assert intervals[3] >= 0.5
+    # a state change resets the interval
+    assert intervals[4] == client.poll_min
+    assert ticket.status == "RUNNING"
+
+
+def test_submit_errors():
+    client = make_client([FakeResponse({"status": "MAINTENANCE"})])
+    with pytest.raises(Exception, match="maintenance"):
+        client.submit(Ticket(["MKV"], "env", False))
+
+    client = make_client([requests.exceptions.ConnectionError("down")] * 6)
+    with mock.patch("time.sleep"), pytest.raises(requests.exceptions.ConnectionError):
+        client.submit(Ticket(["MKV"], "env", False))
+
+
+def test_resume_from_journal(tmp_path):
+    journal = TicketJournal(tmp_path.joinpath("tickets.jsonl"))
+    seqs = ["MKV"]
+
+    # the first process submits and is killed while polling
+    client = make_client([FakeResponse({"status": "PENDING", "id": "abc"})])
+    ticket = client.start(seqs, "env", journal=journal)
+    assert journal.get(ticket.key) == "abc"
+
+    # the restarted process polls the same ticket instead of submitting again
+    client = make_client(
+        [FakeResponse({"status": "RUNNING"}), FakeResponse({"status": "COMPLETE"})]
+    )
+    with mock.patch("time.sleep"):
+        ticket = client.run(seqs, "env", journal=journal)
+    assert ticket.id == "abc"
+    assert client.session.paths == ["ticket/abc"] * 2
+    journal.finished(ticket.key)
+    assert journal.get(ticket.key) is None
+
+    # tickets the server doesn't know anymore are submitted again
+    journal.submitted(ticket.key, "old", "env")
+    client = make_client(
+        [
+            FakeResponse({"status": "ERROR"}),
+            FakeResponse({"status": "PENDING", "id": "new"}),
+        ]
+    )
+    ticket = client.start(seqs, "env", journal=journal)
+    assert ticket.id == "new"
+    assert journal.get(ticket.key) == "new"
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from colabfold.colabfold import run_mmseqs2
+from colabfold.mmseqs import search
+from colabfold.mmseqs.client import MMseqs2Client, set_client
+from colabfold.mmseqs.daemon import SearchDaemon
+from tests.test_mmseqs_search import FakeSearch, make_dbs, search_args
+
+
+def test_tickets_are_searched_together(tmp_path, monkeypatch, request):
+    dbbase, base = make_dbs(tmp_path)
+    dbbase.joinpath("spire_ctg10_2401_db.dbtype").touch()
+    fake = FakeSearch()
+    monkeypatch.setattr(search, "run_mmseqs", fake)
+    args = search_args(dbbase, unpack=0)
+    args.base = base
+
+    with SearchDaemon(args, port=0, batch_wait=0.5) as daemon:
+        client = MMseqs2Client(daemon.url, "colabfold/test", poll_min=0.01)
+        set_client(daemon.url, "colabfold/test", client)
+        request.addfinalizer(lambda: set_client(daemon.url, "colabfold/test", None))
+
+        def search_msa(job):
+            seqs, use_pairing = job
+            return run_mmseqs2(
+                seqs,
+                str(tmp_path.joinpath("_".join(seqs))),
+                use_pairing=use_pairing,
+                host_url=daemon.url,
+                user_agent="colabfold/test",
+            )
+
+        jobs = [(["MKV", "GGA"], False), (["PPL"], False), (["MKV", "PPL"], True)]
+        with ThreadPoolExecutor(3) as executor:
+            results = list(executor.map(search_msa, jobs))
+
+    # the two unpaired tickets in one batch, the pairing ticket in another
+    created = [call for call in fake.calls if call[0] == "createdb"]
+    assert len(created) == 2
+    for (seqs, use_pairing), a3m_lines in zip(jobs, results):
+        for j, (seq, a3m) in enumerate(zip(seqs, a3m_lines)):
+            if use_pairing:
+                expected = [">pair.a3m", ">pair_env.a3m"]
+            else:
+                expected = [">uniref.a3m", ">bfd.mgnify30.metaeuk30.smag30.a3m"]
+            assert a3m == "".join(
+                f">{101 + j}\n{seq}\n{hit}\n{seq}\n" for hit in expected
+            )
+    assert not any(base.iterdir())
@@ -0,0 +1,158 @@
+from argparse import Namespace
+
+from colabfold.mmseqs import search
+from colabfold.mmseqs.db import (
+    DataReader,
+    MMseqsDB,
+    merge_dbs,
+    merge_lookups,
+    read_index,
+    scan_index,
+)
+from colabfold.mmseqs.split_msas import split_msa
+
+
+def write_db(db, entries, split=False, reverse=False):
+    """entries: {key: bytes}, with split the data is spread over db.0 and db.1 like mmseqs does"""
+    index, data = [], b""
+    for key, entry in sorted(entries.items()):
+        index.append(f"{key}\t{len(data)}\t{len(entry)}\n")
+        data += entry
+    if split:
+        middle = index[len(index) // 2].split("\t")[1]
+        db.with_name(f"{db.name}.0").write_bytes(data[: int(middle)])
+        db.with_name(f"{db.name}.1").write_bytes(data[int(middle) :])
+    else:
+        db.write_bytes(data)
+    if reverse:
+        index.reverse()
+    db.with_name(f"{db.name}.index").write_text("".join(index))
+    db.with_name(f"{db.name}.dbtype").write_bytes(b"\x0b\x00\x00\x00")
+
+
+def test_merge_dbs(tmp_path):
+    write_db(tmp_path.joinpath("a"), {0: b"AA\x00", 1: b"B\x00"}, reverse=True)
+    write_db(tmp_path.joinpath("b"), {0: b"C\x00", 1: b"DD\x00", 2: b"E\x00"}, True)
+    merge_dbs(
+        [tmp_path.joinpath("a"), tmp_path.joinpath("b")], tmp_path.joinpath("m"), [0, 2]
+    )
+
+    assert read_index(tmp_path.joinpath("m")) == [
+        (0, 0, 3),
+        (1, 3, 2),
+        (2, 5, 2),
+        (3, 7, 3),
+        (4, 10, 2),
+    ]
+    with DataReader(tmp_path.joinpath("b")) as reader:
+        assert reader.read(2, 3) == b"DD\x00"
+    assert tmp_path.joinpath("m").read_bytes() == b"AA\x00B\x00C\x00DD\x00E\x00"
+
+    tmp_path.joinpath("a.lookup").write_text("0\tx\t0\n1\tx\t0\n")
+    tmp_path.joinpath("b.lookup").write_text("0\ty\t0\n1\tz\t1\n")
+    merge_lookups(
+        [tmp_path.joinpath("a.lookup"), tmp_path.joinpath("b.lookup")],
+        tmp_path.joinpath("m.lookup"),
+        [0, 2],
+        [0, 1],
+    )
+    assert tmp_path.joinpath("m.lookup").read_text() == (
+        "0\tx\t0\n1\tx\t0\n2\ty\t1\n3\tz\t2\n"
+    )
+
+
+def test_mmseqs_db(tmp_path):
+    entries = {0: b">101\nAA\n\x00", 1: b"\x00", 5: b">101\nCCC\n\x00"}
+    write_db(tmp_path.joinpath("split"), entries, split=True, reverse=True)
+    with MMseqsDB(tmp_path.joinpath("split")) as db:
+        assert sorted(db.keys()) == [0, 1, 5]
+        assert db.get_text(5) == ">101\nCCC\n"
+        assert db.get(1) == b""
+        assert db.get_text(0) == ">101\nAA\n"
+        assert 2 not in db
+
+
+def fake_search_queries(args, queries_unique, is_complex, base, store=None):
+    """Writes the outputs of colabfold_search with the keys it would use"""
+    base.mkdir(parents=True, exist_ok=True)
+    qdb, final, lookup = {}, {}, []
+    for file_number, (jobname, seqs, _) in enumerate(queries_unique):
+        for j, seq in enumerate(seqs):
+            key = len(qdb)
+            qdb[key] = f"{seq}\n\x00".encode()
+            final[key] = f">{101 + j}\n{seq}\n\x00".encode()
+            lookup.append(f"{key}\t{jobname}\t{file_number}\n")
+        if args.unpack:
+            base.joinpath(f"{jobname}.a3m").write_text("".join(seqs))
+    if not args.unpack:
+        write_db(base.joinpath("qdb"), qdb)
+        write_db(base.joinpath("final.a3m"), final)
+        base.joinpath("qdb.lookup").write_text("".join(lookup))
+        base.joinpath("qdb.cardinality").write_text(
+            "".join(f"{key}\t1\n" for key in qdb)
+        )
+
+
+def test_shards_match_unsharded_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(search, "search_queries", fake_search_queries)
+    queries = [
+        ["job1", ["MKV", "GGA"], [1, 1]],
+        ["job2", ["PPL"], [1]],
+        ["job3", ["AAA", "CCC"], [1, 2]],
+    ]
+    for unpack in [0, 1]:
+        args = Namespace(
+            base=tmp_path.joinpath(f"sharded_{unpack}"),
+            shard_size=2,
+            unpack=unpack,
+            use_templates=0,
+        )
+        args.base.mkdir()
+        search.search_shards(args, queries, True)
+        fake_search_queries(args, queries, True, tmp_path.joinpath(f"all_{unpack}"))
+
+        for name in ["qdb", "qdb.index", "final.a3m", "final.a3m.index", "qdb.lookup"]:
+            if not unpack:
+                assert (
+                    args.base.joinpath(name).read_bytes()
+                    == tmp_path.joinpath(f"all_{unpack}", name).read_bytes()
+                )
+        if unpack:
+            assert sorted(p.name for p in args.base.iterdir()) == [
+                "job1.a3m",
+                "job2.a3m",
+                "job3.a3m",
+            ]
+        assert not args.base.joinpath("shards").exists()
+
+
+def test_split_msa(tmp_path):
+    entries = {
+        0: b">101 query\nMKV\n>hit\nMKI\n\x00",
+        1: b">sp/102\nGGA\n\x00",
+        2: b"\n\x00",
+        3: b">103\nPPL\n\x00",
+    }
+    write_db(tmp_path.joinpath("final.a3m"), entries, split=True)
+    output = tmp_path.joinpath("all")
+    output.mkdir()
+    split_msa(tmp_path.joinpath("final.a3m"), output, threads=2)
+    assert sorted(path.name for path in output.iterdir()) == [
+        "101.a3m",
+        "103.a3m",
+        "sp_102.a3m",
+    ]
+    assert output.joinpath("101.a3m").read_text() == ">101 query\nMKV\n>hit\nMKI\n"
+
+    # without an index, the entries are numbered in file order
+    tmp_path.joinpath("merged.a3m").write_bytes(b"".join(entries.values()))
+    assert scan_index(tmp_path.joinpath("merged.a3m")) == [
+        (0, 0, 25),
+        (1, 25, 13),
+        (2, 38, 2),
+        (3, 40, 10),
+    ]
+    subset = tmp_path.joinpath("subset")
+    subset.mkdir()
+    split_msa(tmp_path.joinpath("merged.a3m"), subset, keys=[3, 7])
+    assert [path.name for path in subset.iterdir()] == ["103.a3m"]
@@ -0,0 +1,58 @@
+from colabfold.mmseqs.ratelimit import HostRateLimiter
+
+
+class FakeClock:
+    """Time that only passes when a limiter sleeps"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, delay: float):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+def test_budget_is_shared(tmp_path):
+    clock = FakeClock()
+
+    def limiter(host_url, burst):
+        return HostRateLimiter(
+            host_url, 16, burst, tmp_path, clock=clock.time, sleep=clock.sleep
+        )
+
+    # two workers of the same host
+    a = limiter("http://msa.test", 2)
+    b = limiter("http://msa.test", 2)
+    other = limiter("http://other.test", 1)
+
+    a.acquire()
+    b.acquire()
+    other.acquire()
+    assert clock.sleeps == []
+    # the burst is used up by both workers together
+    b.acquire()
+    assert clock.sleeps == [1 / 16]
+
+    # a RATELIMIT seen by one worker pauses the others too
+    clock.sleeps.clear()
+    a.throttle(0.25)
+    b.acquire()
+    assert sum(clock.sleeps) >= 0.25
+
+
+def test_unusable_state_file(tmp_path):
+    # e.g. a file in the shared temp directory that belongs to another user
+    state_dir = tmp_path.joinpath("state")
+    state_dir.mkdir()
+    limiter = HostRateLimiter("http://msa.test", 16, 1, state_dir)
+    limiter.path.mkdir()
+    clock = FakeClock()
+    limiter.clock, limiter.sleep = clock.time, clock.sleep
+
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == [1 / 16]
@@ -0,0 +1,45 @@
+import io
+import tarfile
+
+from colabfold.mmseqs import result
+from colabfold.mmseqs.result import parse_m8, read_result
+
+
+def make_tar_gz(files):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:gz") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+UNIREF = b">101\nMKV\n>UniRef100_A\nMKI\n\x00>102\nGGA\n\x00"
+BFD = b">101\nMKV\n>bfd\nMRV\n\x00>102\nGGA\n>mgy\nG-A\n\x00"
+
+
+def test_read_result(tmp_path, monkeypatch):
+    # records must survive being split across read chunks
+    monkeypatch.setattr(result, "CHUNK_SIZE", 7)
+    tar_gz = make_tar_gz(
+        {
+            "bfd.mgnify30.metaeuk30.smag30.a3m": BFD,
+            "uniref.a3m": UNIREF,
+            "pdb70.m8": b"101\t1abc_A\t0.9\n101\t2def_B\t0.8\n",
+        }
+    )
+    keep = tmp_path.joinpath("out.tar.gz")
+    a3m_lines, m8 = read_result(
+        io.BytesIO(tar_gz),
+        ["uniref.a3m", "bfd.mgnify30.metaeuk30.smag30.a3m"],
+        keep=keep,
+    )
+
+    assert a3m_lines == {
+        101: ">101\nMKV\n>UniRef100_A\nMKI\n>101\nMKV\n>bfd\nMRV\n",
+        102: ">102\nGGA\n>102\nGGA\n>mgy\nG-A\n",
+    }
+    assert parse_m8(m8) == {101: ["1abc_A", "2def_B"]}
+    assert keep.read_bytes() == tar_gz
+    assert list(tmp_path.iterdir()) == [keep]
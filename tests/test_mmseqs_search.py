@@ -0,0 +1,304 @@
+import json
+import math
+import subprocess
+import threading
+import time
+from argparse import Namespace
+from pathlib import Path
+
+import pytest
+
+from colabfold.input import get_queries, msa_to_str
+from colabfold.mmseqs import search
+from colabfold.mmseqs.scheduler import THREADS, SearchGraph
+
+
+class FakeMMseqs:
+    """Records the mmseqs calls instead of running them"""
+
+    def __init__(self, delay=0.0):
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def __call__(self, mmseqs, params):
+        with self.lock:
+            self.calls.append([str(p) for p in params])
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        if params[0] == "search":
+            Path(params[4]).mkdir(exist_ok=True)
+            time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+
+
+def make_dbs(tmp_path):
+    dbbase = tmp_path.joinpath("db")
+    dbbase.mkdir()
+    for db in ["uniref30_2302_db", "colabfold_envdb_202108_db", "pdb100_230517"]:
+        dbbase.joinpath(f"{db}.dbtype").touch()
+    base = tmp_path.joinpath("out")
+    base.mkdir()
+    return dbbase, base
+
+
+def test_sequential_graph_keeps_order(tmp_path, monkeypatch):
+    fake = FakeMMseqs()
+    monkeypatch.setattr(search, "run_mmseqs", fake)
+    graph = SearchGraph()
+    graph.mmseqs("b", ["rmdb", "b"], ["a"])
+    graph.mmseqs("a", ["search", "q", "db", "a", str(tmp_path), "--threads", THREADS])
+    graph.mmseqs("c", ["rmdb", "c"], ["skipped"])
+    graph.skip("skipped")
+    graph.run(Path("mmseqs"), threads=8)
+    assert [call[1] for call in fake.calls] == ["q", "b", "c"]
+    assert fake.calls[0][-1] == "8"
+
+    # e.g. a misspelled task name
+    graph.mmseqs("d", ["rmdb", "d"], ["not_in_graph"])
+    with pytest.raises(ValueError, match="d depends on unknown tasks"):
+        graph.run(Path("mmseqs"), threads=8)
+
+
+def test_independent_searches_overlap(tmp_path, monkeypatch):
+    dbbase, base = make_dbs(tmp_path)
+    kwargs = dict(
+        dbbase=dbbase,
+        base=base,
+        template_db=Path("pdb100_230517"),
+        use_env=True,
+        use_templates=True,
+        threads=8,
+    )
+
+    sequential = FakeMMseqs()
+    monkeypatch.setattr(search, "run_mmseqs", sequential)
+    search.mmseqs_search_monomer(**kwargs)
+
+    parallel = FakeMMseqs(delay=0.2)
+    monkeypatch.setattr(search, "run_mmseqs", parallel)
+    search.mmseqs_search_monomer(max_parallel=4, **kwargs)
+
+    assert sorted(parallel.calls) != sorted(sequential.calls)
+    assert parallel.max_active >= 2
+    # the environmental and template searches share the thread budget with the uniref branch
+    searches = [call for call in parallel.calls if call[0] == "search"]
+    threads = [int(call[call.index("--threads") + 1]) for call in searches]
+    assert threads[0] == 8
+    assert all(1 <= i <= 4 for i in threads[1:])
+
+
+def test_pair_searches_do_not_clash(tmp_path, monkeypatch):
+    dbbase, base = make_dbs(tmp_path)
+    dbbase.joinpath("spire_ctg10_2401_db.dbtype").touch()
+    fake = FakeMMseqs()
+    monkeypatch.setattr(search, "run_mmseqs", fake)
+
+    graph = SearchGraph()
+    search.mmseqs_search_monomer(dbbase, base, graph=graph)
+    search.mmseqs_search_pair(dbbase, base, pair_env=False, graph=graph)
+    search.mmseqs_search_pair(dbbase, base, pair_env=True, graph=graph)
+    graph.run(Path("mmseqs"), threads=8, max_parallel=3)
+
+    outputs = [
+        call[search.MODULE_OUTPUT_POS[call[0]]]
+        for call in fake.calls
+        if call[0] in search.MODULE_OUTPUT_POS and call[0] not in ["mvdb", "lndb"]
+    ]
+    assert len(outputs) == len(set(outputs))
+    assert str(base.joinpath("pair.a3m")) in outputs
+
+
+class FakeSearch(FakeMMseqs):
+    """Also writes the query and result databases, the MSAs contain the query header and sequence"""
+
+    def __init__(self):
+        super().__init__()
+        self.dbs = {}
+
+    def write_db(self, db, entries):
+        self.dbs[db] = entries
+        index, data = [], ""
+        for key, entry in enumerate(entries):
+            index.append(f"{key}\t{len(data)}\t{len(entry) + 1}\n")
+            data += entry + "\x00"
+        Path(db).write_text(data)
+        Path(f"{db}.index").write_text("".join(index))
+        Path(f"{db}.dbtype").touch()
+
+    def __call__(self, mmseqs, params):
+        super().__call__(mmseqs, params)
+        params = [str(p) for p in params]
+        if params[0] == "createdb":
+            lines = Path(params[1]).read_text().splitlines()
+            self.dbs[params[2]] = list(zip(lines[::2], lines[1::2]))
+        elif params[0] == "result2msa":
+            name = Path(params[4]).name
+            self.write_db(
+                params[4],
+                [f"{h}\n{seq}\n>{name}\n{seq}\n" for h, seq in self.dbs[params[1]]],
+            )
+        elif params[0] == "convertalis":
+            # the query is the profile of qdb
+            qdb = self.dbs[str(Path(params[1]).with_name("qdb"))]
+            self.write_db(params[4], [f"{h[1:]}\thit_{seq}\n" for h, seq in qdb])
+        elif params[0] == "mergedbs":
+            merged = [
+                "".join(entries)
+                for entries in zip(*[self.dbs[db] for db in params[3:]])
+            ]
+            self.write_db(params[2], merged)
+        elif params[0] == "mvdb" and params[1] in self.dbs:
+            self.write_db(params[2], self.dbs.pop(params[1]))
+        elif params[0] == "rmdb":
+            # like mmseqs, also removes the lookup
+            for suffix in ["", ".index", ".dbtype", ".lookup"]:
+                Path(f"{params[1]}{suffix}").unlink(missing_ok=True)
+
+
+def search_args(dbbase, unpack):
+    return Namespace(
+        mmseqs=Path("mmseqs"),
+        dbbase=dbbase,
+        db1=Path("uniref30_2302_db"),
+        db2=Path("pdb100_230517"),
+        db3=Path("colabfold_envdb_202108_db"),
+        db4=Path("spire_ctg10_2401_db"),
+        use_env=True,
+        use_env_pairing=True,
+        use_templates=True,
+        filter=True,
+        expand_eval=math.inf,
+        align_eval=10,
+        diff=3000,
+        qsc=-20.0,
+        max_accept=1000000,
+        pairing_strategy=0,
+        prefilter_mode=0,
+        s=8,
+        db_load_mode=0,
+        threads=8,
+        gpu=0,
+        gpu_server=0,
+        unpack=unpack,
+        max_parallel_tasks=1,
+    )
+
+
+def test_chains_are_searched_once(tmp_path, monkeypatch):
+    dbbase, base = make_dbs(tmp_path)
+    dbbase.joinpath("spire_ctg10_2401_db.dbtype").touch()
+    fake = FakeSearch()
+    monkeypatch.setattr(search, "run_mmseqs", fake)
+    args = search_args(dbbase, unpack=1)
+    queries = [
+        ["bait_prey1", ["BAIT", "PREYA"], [1, 1]],
+        ["bait_prey2", ["BAIT", "PREYB"], [1, 1]],
+        ["prey1_bait", ["PREYA", "BAIT"], [1, 1]],
+        ["bait_prey1_again", ["BAIT", "PREYA"], [1, 1]],
+        ["bait_dimer", ["BAIT"], [2]],
+    ]
+    search.search_queries(args, queries, True, base)
+
+    assert [seq for _, seq in fake.dbs[str(base.joinpath("qdb"))]] == [
+        "BAIT",
+        "PREYA",
+        "PREYB",
+    ]
+    pair_db = [entry for entry in fake.dbs[str(base.joinpath("pair_qdb"))]]
+    assert pair_db == [
+        (">101", "BAIT"),
+        (">102", "PREYA"),
+        (">101", "BAIT"),
+        (">102", "PREYB"),
+        (">101", "PREYA"),
+        (">102", "BAIT"),
+    ]
+
+    for raw_jobname, seqs, cardinality in queries:
+        unpaired = [
+            f">{101 + j}\n{seq}\n>uniref.a3m\n{seq}\n"
+            f">{101 + j}\n{seq}\n>bfd.mgnify30.metaeuk30.smag30.a3m\n{seq}\n"
+            for j, seq in enumerate(seqs)
+        ]
+        paired = None
+        if len(seqs) > 1:
+            paired = [
+                f">{101 + j}\n{seq}\n>pair.a3m\n{seq}\n"
+                f">{101 + j}\n{seq}\n>pair_env.a3m\n{seq}\n"
+                for j, seq in enumerate(seqs)
+            ]
+        assert base.joinpath(f"{raw_jobname}.a3m").read_text() == msa_to_str(
+            unpaired, paired, seqs, cardinality
+        )
+        assert base.joinpath(f"{raw_jobname}_pdb100_230517.m8").read_text() == "".join(
+            f"{101 + j}\thit_{seq}\n" for j, seq in enumerate(seqs)
+        )
+    assert sorted(path.name for path in base.iterdir()) == sorted(
+        [f"{raw_jobname}.a3m" for raw_jobname, _, _ in queries]
+        + [f"{raw_jobname}_pdb100_230517.m8" for raw_jobname, _, _ in queries]
+        + ["search_profile.json"]
+    )
+
+
+def test_read_search_db(tmp_path, monkeypatch):
+    dbbase, _ = make_dbs(tmp_path)
+    dbbase.joinpath("spire_ctg10_2401_db.dbtype").touch()
+    monkeypatch.setattr(search, "run_mmseqs", FakeSearch())
+    queries = [
+        ["complex", ["PREYA", "BAIT"], [1, 1]],
+        ["monomer", ["PREYB"], [1]],
+        ["trimer", ["BAIT", "PREYB"], [2, 1]],
+    ]
+    for unpack in [0, 1]:
+        args = search_args(dbbase, unpack)
+        args.use_templates = False
+        search.search_queries(
+            args, queries, True, tmp_path.joinpath(f"unpack_{unpack}")
+        )
+
+    from_db, is_complex = get_queries(tmp_path.joinpath("unpack_0", "final.a3m"), None)
+    from_files, _ = get_queries(tmp_path.joinpath("unpack_1"), None)
+    assert is_complex
+    assert sorted(from_db) == sorted(from_files)
+
+
+def test_search_profile(tmp_path, monkeypatch):
+    dbbase, base = make_dbs(tmp_path)
+    fake = FakeSearch()
+    monkeypatch.setattr(search, "run_mmseqs", fake)
+    args = search_args(dbbase, unpack=1)
+    args.use_env = False
+    args.use_templates = False
+    # finished stages are recorded as skipped
+    base.joinpath("uniref.a3m.dbtype").touch()
+    base.joinpath("tmp").mkdir()
+    fake.write_db(str(base.joinpath("uniref.a3m")), [">101\nMKV\n"])
+    search.search_queries(args, [["job", ["MKV"], [1]]], False, base)
+
+    with base.joinpath("search_profile.json").open() as f:
+        profile = json.load(f)
+    tasks = {record["task"]: record for record in profile["tasks"]}
+    assert tasks["uniref/search"]["skipped"]
+    assert tasks["final"]["threads"] == 1
+    assert tasks["rm_tmp"]["wall_time"] >= 0
+    assert "final" in [total["name"] for total in profile["summary"]]
+
+
+def test_run_mmseqs_usage(tmp_path):
+    mmseqs = tmp_path.joinpath("mmseqs")
+    mmseqs.write_text(
+        '#!/bin/sh\nprintf "AAA" > "$3"\nprintf "0\\t0\\t3\\n" > "$3.index"\n'
+    )
+    mmseqs.chmod(0o755)
+    usage = search.run_mmseqs(mmseqs, ["mvdb", "in", tmp_path.joinpath("out")])
+    assert usage["module"] == "mvdb" and not usage["skipped"]
+    assert usage["bytes_written"] == 9
+    assert usage["cpu_time"] >= 0 and usage["max_rss_mb"] > 0
+
+    mmseqs.write_text("#!/bin/sh\nexit 3\n")
+    with pytest.raises(subprocess.CalledProcessError):
+        search.run_mmseqs(mmseqs, ["rmdb", "x"])
@@ -0,0 +1,36 @@
+import os
+
+from colabfold.colabfold import run_mmseqs2
+from colabfold.mmseqs.client import MMseqs2Client, set_client
+from colabfold.mmseqs.server import MockMSAServer
+
+Q60262 = "MEIIALLIEEGIIIIKDKKVAERFLKDLESSQGMDWKEIRERAERAKKQLEEGIEWAKKTKL"
+
+
+def fast_client(request, server):
+    client = MMseqs2Client(
+        server.url, "colabfold/test", poll_min=0.01, backoff_base=0.01
+    )
+    set_client(server.url, "colabfold/test", client)
+    request.addfinalizer(lambda: set_client(server.url, "colabfold/test", None))
+
+
+def test_run_mmseqs2_against_mock_server(tmp_path, request):
+    with MockMSAServer(
+        run_time=0.05, ratelimit_rate=0.2, failure_rate=0.1, num_templates=2
+    ) as server:
+        fast_client(request, server)
+        a3m_lines, template_paths = run_mmseqs2(
+            [Q60262, "YYDPETGTWY", Q60262],
+            str(tmp_path.joinpath("job")),
+            use_templates=True,
+            host_url=server.url,
+            user_agent="colabfold/test",
+        )
+
+    # canned response of test-data/mmseqs-api-reponses/get_msa_uniref_env.json
+    assert a3m_lines[0] == a3m_lines[2]
+    assert a3m_lines[0].startswith(f">101\n{Q60262}\n>UniRef100_Q60262")
+    assert a3m_lines[1] == ">102\nYYDPETGTWY\n"
+    assert len(os.listdir(template_paths[0])) == 6
+    assert server.requests["submit"] >= 1
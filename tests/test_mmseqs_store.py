@@ -0,0 +1,72 @@
+import sys
+
+from colabfold.input import msa_to_str, safe_filename
+from colabfold.mmseqs import search
+from colabfold.mmseqs.store import SearchStore
+
+
+def test_store_renumbers_chains(tmp_path):
+    store = SearchStore(tmp_path, "fingerprint")
+    store.put_unpaired("MKV", ">102\nMKV\n>hit\nMKI\n", 102)
+    store.put_m8("MKV", "102\thit\t0.9\n", 102)
+    assert store.get_unpaired("MKV") == ">101\nMKV\n>hit\nMKI\n"
+    assert store.get_unpaired("MKV", 103) == ">103\nMKV\n>hit\nMKI\n"
+    assert store.get_m8("MKV", 101) == "101\thit\t0.9\n"
+    assert store.has_job(["MKV"], False, True)
+    assert not store.has_job(["MKV", "GGA"], False, False)
+    assert not SearchStore(tmp_path, "other").has_job(["MKV"], False, False)
+
+
+def test_search_only_new_queries(tmp_path, monkeypatch):
+    searched = []
+
+    def fake_search_queries(args, queries_unique, is_complex, base, store=None):
+        """Writes the unpacked outputs of colabfold_search and adds them to the store"""
+        for raw_jobname, seqs, cardinality in queries_unique:
+            searched.append(raw_jobname)
+            unpaired = [f">{101 + j}\n{seq}\n>u\n{seq}\n" for j, seq in enumerate(seqs)]
+            paired = [f">{101 + j}\n{seq}\n>p\n{seq}\n" for j, seq in enumerate(seqs)]
+            for j, seq in enumerate(seqs):
+                store.put_unpaired(seq, unpaired[j], 101 + j)
+            if len(seqs) > 1:
+                store.put_paired(seqs, paired)
+            else:
+                paired = None
+            msa = msa_to_str(unpaired, paired, seqs, cardinality)
+            base.joinpath(f"{safe_filename(raw_jobname)}.a3m").write_text(msa)
+
+    monkeypatch.setattr(search, "search_queries", fake_search_queries)
+    dbbase = tmp_path.joinpath("db")
+    dbbase.mkdir()
+    fasta = tmp_path.joinpath("queries.fasta")
+
+    def run(base):
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            ["colabfold_search", str(fasta), str(dbbase), str(base)]
+            + ["--store", str(tmp_path.joinpath("store"))],
+        )
+        search.main()
+
+    fasta.write_text(">job1\nMKVL:GGAS\n>job2\nPPLE\n")
+    run(tmp_path.joinpath("first"))
+    assert searched == ["job1", "job2"]
+
+    fasta.write_text(">job1\nMKVL:GGAS\n>job3\nGGAS:MKVL:MKVL\n>job2\nPPLE\n")
+    run(tmp_path.joinpath("second"))
+    assert searched == ["job1", "job2", "job3"]
+    for name in ["job1.a3m", "job2.a3m"]:
+        assert (
+            tmp_path.joinpath("second", name).read_text()
+            == tmp_path.joinpath("first", name).read_text()
+        )
+
+    # reusing only the stored results gives the same output as searching
+    run(tmp_path.joinpath("third"))
+    assert searched == ["job1", "job2", "job3"]
+    for name in ["job1.a3m", "job2.a3m", "job3.a3m"]:
+        assert (
+            tmp_path.joinpath("third", name).read_text()
+            == tmp_path.joinpath("second", name).read_text()
+        )
@@ -0,0 +1,49 @@
+import os
+
+from colabfold.mmseqs.templates import TemplateStore, read_ffindex
+
+
+class FakeClient:
+    def __init__(self):
+        self.requested = []
+
+    def templates(self, pdb_ids, path):
+        self.requested.append(list(pdb_ids))
+        data, index = b"", ""
+        for hit in pdb_ids:
+            with open(os.path.join(path, f"{hit.split('_')[0]}.cif"), "w") as f:
+                f.write(f"data_{hit}\n")
+            record = f">{hit}\nMKV\n".encode() + b"\x00"
+            index += f"{hit}\t{len(data)}\t{len(record)}\n"
+            data += record
+        with open(os.path.join(path, "pdb70_a3m.ffdata"), "wb") as f:
+            f.write(data)
+        with open(os.path.join(path, "pdb70_a3m.ffindex"), "w") as f:
+            f.write(index)
+
+
+def test_template_store(tmp_path):
+    client = FakeClient()
+    store = TemplateStore(tmp_path.joinpath("store"))
+
+    store.fetch(client, ["2def_B", "1abc_A"])
+    # only hits that are not in the store yet are requested
+    store.fetch(client, ["1abc_A", "3ghi_C"])
+    assert client.requested == [["2def_B", "1abc_A"], ["3ghi_C"]]
+
+    query = tmp_path.joinpath("templates_101")
+    store.assemble(["2def_B", "1abc_A"], query)
+    index = read_ffindex(query.joinpath("pdb70_a3m.ffindex"))
+    assert list(index) == ["1abc_A", "2def_B"]
+    data = query.joinpath("pdb70_a3m.ffdata").read_bytes()
+    offset, length = index["2def_B"]
+    assert data[offset : offset + length] == b">2def_B\nMKV\n\x00"
+    assert sorted(os.listdir(query)) == [
+        "1abc.cif",
+        "2def.cif",
+        "pdb70_a3m.ffdata",
+        "pdb70_a3m.ffindex",
+        "pdb70_cs219.ffdata",
+        "pdb70_cs219.ffindex",
+    ]
+    assert query.joinpath("1abc.cif").samefile(store.cif_dir.joinpath("1abc.cif"))
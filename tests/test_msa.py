@@ -1,6 +1,7 @@
 from unittest import mock
 
-from colabfold.batch import get_msa_and_templates
+from colabfold.batch import get_msa_and_templates, run
+from colabfold.msa_file import load_msa_and_templates
 from tests.mock import MMseqs2Mock
 
 
@@ -37,4 +38,42 @@ def test_get_msa_and_templates(pytestconfig, caplog, tmp_path):
         assert query_seqs_unique == [Q60262]
         assert query_seqs_cardinality == [1]
 
-    assert caplog.messages == []
\ No newline at end of file
+    assert caplog.messages == []
+
+def test_msa_prefetch(pytestconfig, tmp_path):
+    queries = [("5AWL_1", "YYDPETGTWY", None), ("6A5J", "IKKILSKIKKLLK", None)]
+
+    mmseqs2mock = MMseqs2Mock(pytestconfig.rootpath, "batch")
+    for msa_prefetch in [0, 2]:
+        with mock.patch("colabfold.colabfold.run_mmseqs2", mmseqs2mock.mock_run_mmseqs2):
+            run(
+                queries,
+                tmp_path.joinpath(str(msa_prefetch)),
+                num_models=0,
+                is_complex=False,
+                msa_prefetch=msa_prefetch,
+            )
+
+    for jobname, _, _ in queries:
+        serial = tmp_path.joinpath("0", f"{jobname}.a3m").read_text()
+        prefetched = tmp_path.joinpath("2", f"{jobname}.a3m").read_text()
+        assert serial == prefetched
+        assert load_msa_and_templates(tmp_path.joinpath("2", f"{jobname}.cfmsa"))[0] \
+            == load_msa_and_templates(tmp_path.joinpath("0", f"{jobname}.cfmsa"))[0]
+
+def test_msa_batching(tmp_path):
+    queries = [("A", "YYDPETGTWY", None), ("B", "IKKILSKIKKLLK", None), ("C", "YYDPETGTWY", None)]
+    calls = []
+
+    def run_mmseqs2(x, prefix, use_env=True, use_filter=True, use_templates=False, filter=None,
+                    use_pairing=False, pairing_strategy="greedy", host_url="", user_agent=""):
+        calls.append(list(x))
+        return [f">{101 + i}\n{seq}\n>hit\n{seq}\n" for i, seq in enumerate(x)]
+
+    with mock.patch("colabfold.colabfold.run_mmseqs2", run_mmseqs2):
+        run(queries, tmp_path, num_models=0, is_complex=False, msa_batch_size=10)
+
+    # all distinct sequences in one ticket, the jobs are served from the cache
+    assert calls == [["YYDPETGTWY", "IKKILSKIKKLLK"]]
+    for jobname, seq, _ in queries:
+        assert f">hit\n{seq}" in tmp_path.joinpath(f"{jobname}.a3m").read_text()
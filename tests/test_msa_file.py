@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from colabfold.msa_file import (
+    encode_a3m,
+    load_msa_and_templates,
+    save_msa_and_templates,
+)
+
+UNPAIRED = ">101\nMKVLA\n>hit1 é\nMaaK-LAc\n>hit2\nbM-VLA\n>hit3\nMKVLAcc\n"
+
+
+def msa_and_templates():
+    template_features = {
+        "template_aatype": np.arange(2 * 5 * 22, dtype=np.float32).reshape(2, 5, 22),
+        "template_domain_names": np.array([b"1abc_A", b"2def_B"], dtype=object),
+        "template_sum_probs": np.ones((2, 1)),
+        "template_sequence": [b"none", b"none"],
+    }
+    return (
+        [UNPAIRED, ">102\nGG\n\n>multi\nG\nG\n"],
+        [">101\nMKVLA\n>p\nM-VkLA\n", ">102\nGG\n>p\nGG\n"],
+        ["MKVLA", "GG"],
+        [1, 2],
+        [template_features, dict(template_features)],
+    )
+
+
+def assert_same(loaded, expected):
+    assert loaded[:4] == expected[:4]
+    for loaded_features, features in zip(loaded[4], expected[4]):
+        assert loaded_features.keys() == features.keys()
+        for key, value in features.items():
+            if isinstance(value, list):
+                assert loaded_features[key] == value
+            else:
+                assert loaded_features[key].dtype == value.dtype, key
+                np.testing.assert_array_equal(loaded_features[key], value)
+
+
+def test_msa_file_round_trip(tmp_path):
+    expected = msa_and_templates()
+    save_msa_and_templates(tmp_path.joinpath("job.cfmsa"), expected)
+    assert_same(load_msa_and_templates(tmp_path.joinpath("job.cfmsa")), expected)
+
+    arrays = encode_a3m(UNPAIRED)
+    assert arrays["columns"].shape == (4, 5)
+    assert arrays["insertions"].tobytes() == b"aacbcc"
+    # an a3m with a multi-line sequence is stored as text
+    assert list(encode_a3m(expected[0][1])) == ["text"]
+
+    unpaired_only = (None, None, ["MKVLA"], [1], [])
+    save_msa_and_templates(tmp_path.joinpath("single.cfmsa"), unpaired_only)
+    assert load_msa_and_templates(tmp_path.joinpath("single.cfmsa")) == unpaired_only
+
+
+@pytest.mark.parametrize("compression,module", [("zstd", "zstandard"), ("lz4", "lz4")])
+def test_msa_file_compressed(tmp_path, compression, module):
+    pytest.importorskip(module)
+    expected = msa_and_templates()
+    save_msa_and_templates(tmp_path.joinpath("job.cfmsa"), expected, compression)
+    assert_same(load_msa_and_templates(tmp_path.joinpath("job.cfmsa")), expected)
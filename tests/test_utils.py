@@ -60,6 +60,39 @@ def test_a3m_input(pytestconfig, caplog, tmp_path):
     ]
 
 
+def test_a3m_input_is_read_when_used(tmp_path):
+    complex_a3m = "#3,2\t1,1\n>101\t102\nMKVGG\n>hit\tx\nMKVGA\n"
+    tmp_path.joinpath("complex.a3m").write_text(complex_a3m)
+    tmp_path.joinpath("monomer.a3m").write_text(">101\nPPLE\n")
+    queries, is_complex = get_queries(tmp_path)
+
+    assert is_complex
+    assert queries == [
+        ("monomer", "PPLE", [">101\nPPLE\n"]),
+        ("complex", "MKVGG", [complex_a3m]),
+    ]
+    tmp_path.joinpath("monomer.a3m").write_text(">101\nPPLE\n>hit\nPPLA\n")
+    assert queries[0][2][0] == ">101\nPPLE\n>hit\nPPLA\n"
+
+
+def test_a3m_lines_load_once_per_use():
+    from colabfold.input import A3MLines
+
+    loads = []
+
+    def load():
+        loads.append(1)
+        return ">101\nPPLE\n"
+
+    a3m_lines = A3MLines(load, ">101")
+    assert list(a3m_lines) == [">101\nPPLE\n"]
+    assert a3m_lines == [">101\nPPLE\n"]
+    assert a3m_lines[-1] == ">101\nPPLE\n"
+    with pytest.raises(IndexError):
+        a3m_lines[1]
+    assert len(loads) == 3
+
+
 def test_convert_pdb_to_mmcif(pytestconfig, tmp_path):
     base_name = "ERR550519_2213899_unrelaxed_model_1"
     tmp_path.joinpath(f"{base_name}.pdb").write_text(
@@ -138,3 +171,47 @@ def test_convert_pdb_to_mmcif_parse_with_alphafold(pytestconfig, tmp_path):
     )
 
     assert len(parsing_result.errors) == 0
+
+
+def test_watch_queries(tmp_path):
+    from colabfold.input import SEARCH_DONE, watch_queries
+
+    tmp_path.joinpath("b.a3m").write_text(">101\nMKVL\n>hit\nMKVI\n")
+    tmp_path.joinpath("a.a3m").write_text(">101\nGG\n")
+    tmp_path.joinpath("a_pdb100_230517.m8").write_text("101\t1abc_A\n")
+    rounds = watch_queries(tmp_path, interval=0.01)
+
+    queries, is_complex = next(rounds)
+    assert [query[:2] for query in queries] == [("a", "GG"), ("b", "MKVL")]
+    assert not is_complex
+
+    # the search adds results while the first round is predicted
+    tmp_path.joinpath("c.a3m").write_text("#2,2\t1,1\n>101\t102\nAAYY\n")
+    tmp_path.joinpath(SEARCH_DONE).touch()
+    queries, is_complex = next(rounds)
+    assert [query[:2] for query in queries] == [("c", "AAYY")]
+    assert is_complex
+    assert list(rounds) == []
+
+
+def test_watch_queries_skips_search_databases(tmp_path):
+    from colabfold.input import SEARCH_DONE, watch_queries
+    from tests.test_mmseqs_db import write_db
+
+    # the state of a --unpack 0 search in the middle of it: the uniref database is written, the
+    # final one isn't
+    tmp_path.joinpath("qdb.lookup").write_text("0\tjob1\t0\n")
+    write_db(tmp_path.joinpath("uniref.a3m"), {0: b">101\nMKVL\n>uniref\nMKVI\n\x00"})
+    tmp_path.joinpath("a.a3m").write_text(">101\nGG\n")
+    rounds = watch_queries(tmp_path, interval=0.01)
+
+    queries, _ = next(rounds)
+    assert [query[:2] for query in queries] == [("a", "GG")]
+
+    final_msa = ">101\nMKVL\n>uniref\nMKVI\n>env\nMRVL\n"
+    write_db(tmp_path.joinpath("final.a3m"), {0: final_msa.encode() + b"\x00"})
+    tmp_path.joinpath(SEARCH_DONE).touch()
+    queries, _ = next(rounds)
+    assert [query[:2] for query in queries] == [("job1", "MKVL")]
+    assert queries[0][2][0] == final_msa
+    assert list(rounds) == []